@@ -1,7 +1,7 @@
 
 import React, { useState, useCallback, useEffect } from 'react';
 import { ChatMessage, MessageRole, Source, ElasticResult, Intent, CodeSuggestion, ModelId, MODELS, ResponseType, Chat, Theme, Attachment, DataSource, GroundingOptions, DriveFile } from './types';
-import { searchCloudDocuments, getAllCloudFiles, getCloudFileContent, createDatasetFromSources, updateFileContent, searchPreloadedDocuments, getAllPreloadedFiles, getPreloadedFileContent } from './services/elasticService';
+import { streamCloudDocuments, getAllCloudFiles, getCloudFileContent, createDatasetFromSources, updateFileContent, searchPreloadedDocuments, getAllPreloadedFiles, getPreloadedFileContent } from './services/elasticService';
 import { streamAiResponse, classifyIntent, streamChitChatResponse, streamCodeGenerationResponse } from './services/geminiService';
 import Header from './components/Header';
 import ChatInterface from './components/ChatInterface';
@@ -234,7 +234,7 @@ const App: React.FC = () => {
     }));
   };
   
-  const searchElastic = async (query: string): Promise<ElasticResult[]> => {
+  const searchElastic = async (query: string, onCloudHit?: (result: ElasticResult) => void): Promise<ElasticResult[]> => {
     if (!activeChat) return [];
     setCloudSearchError(null);
 
@@ -242,7 +242,8 @@ const App: React.FC = () => {
     const { useCloud, usePreloaded } = activeChat.groundingOptions;
 
     if (useCloud) {
-        searchPromises.push(searchCloudDocuments(query));
+        // Hits are streamed as the server shapes them, so their sources show before the search completes
+        searchPromises.push(streamCloudDocuments(query, { onHit: onCloudHit }));
     }
     if (usePreloaded) {
       searchPromises.push(Promise.resolve(searchPreloadedDocuments(query, activeChat.dataset)));
@@ -308,7 +309,8 @@ const App: React.FC = () => {
     
     let elasticResults: ElasticResult[] = [];
     if (useCloud || usePreloaded) {
-      elasticResults = await searchElastic(latestQuery.content);
+      elasticResults = await searchElastic(latestQuery.content, result =>
+        updateLastMessageInActiveChat(msg => ({ ...msg, sources: [...(msg.sources || []), result.source] })));
       console.log("elasticResults", elasticResults);
     }
 
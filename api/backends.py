@@ -0,0 +1,194 @@
+import time
+from pathlib import Path
+from typing import AsyncIterator
+from fastapi.concurrency import run_in_threadpool
+from api.file_catalog import fetch_file_page, iter_files
+from api.search import chunk_filters, knn_body, lexical_body
+from api.telemetry import ELASTICSEARCH_TOOK_SECONDS, ELASTICSEARCH_WALL_SECONDS, span
+
+
+class RetrievalBackend:
+    """Where the API reads chunks and documents from.
+
+    Hits are returned in Elasticsearch's shape ({"_id", "_score", "_source", "highlight"}) so the
+    response shaping in api/main.py is shared by every backend.
+    """
+
+    async def search(self, query_vector: list[float], query_text: str | None, k: int, num_candidates: int,
+                     path: str | None = None, file_name: str | None = None,
+                     rescore_oversample: float | None = None) -> list[list[dict]]:
+        """Runs kNN (and, when query_text is given, lexical) retrieval; returns one ranked hit list per method."""
+        raise NotImplementedError
+
+    async def get_document(self, doc_id: str) -> dict | None:
+        """Returns a document's source; chunk IDs resolve to their parent document."""
+        raise NotImplementedError
+
+    async def neighbor_chunks(self, chunk_ids: list[str], window: int) -> dict[str, list[dict]]:
+        """The chunks within window positions of each chunk in the same document, itself included.
+
+        Returns {chunk_id: [{"chunkIndex", "text"}, ...]} in document order; unknown IDs are left out.
+        """
+        raise NotImplementedError
+
+    async def file_page(self, limit: int, search_after: list | None = None) -> tuple[list[dict], list | None]:
+        """One page of the file catalog and the sort values to continue from (None on the last page)."""
+        raise NotImplementedError
+
+    def iter_files(self, page_size: int) -> AsyncIterator[dict]:
+        """Every file in the catalog, in (path, file_name) order."""
+        raise NotImplementedError
+
+    async def index_meta(self) -> dict:
+        """The index _meta written by the indexer: index_version and the embedding model."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        pass
+
+
+def record_took(operation: str, took_ms: int | None, wall_seconds: float, current_span=None) -> None:
+    """Records Elasticsearch's own search time next to the wall time; the gap is network and queueing."""
+    ELASTICSEARCH_WALL_SECONDS.observe(wall_seconds, operation=operation)
+    if took_ms is not None:
+        ELASTICSEARCH_TOOK_SECONDS.observe(took_ms / 1000, operation=operation)
+    if current_span is not None:
+        current_span.set_attribute("elasticsearch.took_ms", took_ms if took_ms is not None else -1)
+
+
+class ElasticsearchBackend(RetrievalBackend):
+
+    def __init__(self, cloud_id: str, api_key: str, index: str, max_connections: int):
+        from elasticsearch import AsyncElasticsearch
+        self.index = index
+        self.es = AsyncElasticsearch(
+            cloud_id=cloud_id,
+            api_key=api_key,
+            connections_per_node=max_connections
+        )
+
+    async def search(self, query_vector, query_text, k, num_candidates, path=None, file_name=None,
+                     rescore_oversample=None):
+        filters = chunk_filters(path, file_name)
+        knn = knn_body(query_vector, k, num_candidates, filters, rescore_oversample)
+        if query_text is None:
+            start = time.perf_counter()
+            with span("elasticsearch.search") as current:
+                response = await self.es.search(index=self.index, body=knn)
+                record_took("search", response.get("took"), time.perf_counter() - start, current)
+            return [response["hits"]["hits"]]
+
+        # One round trip for both halves of a hybrid query
+        start = time.perf_counter()
+        with span("elasticsearch.msearch") as current:
+            response = await self.es.msearch(searches=[
+                {"index": self.index}, knn,
+                {"index": self.index}, lexical_body(query_text, k, filters)
+            ])
+            record_took("msearch", response.get("took"), time.perf_counter() - start, current)
+        hit_lists = []
+        for item in response["responses"]:
+            if "error" in item:
+                raise RuntimeError(f"Search failed: {item['error']}")
+            hit_lists.append(item["hits"]["hits"])
+        return hit_lists
+
+    async def get_document(self, doc_id):
+        from elasticsearch import NotFoundError
+        try:
+            response = await self.es.get(index=self.index, id=doc_id, source_includes=["doc_type", "parent_id", "content"])
+        except NotFoundError:
+            return None
+        # Search results point at chunks; their content lives once on the parent document
+        if response["_source"].get("doc_type") == "chunk":
+            response = await self.es.get(index=self.index, id=response["_source"]["parent_id"],
+                                         source_includes=["content"])
+        return response["_source"]
+
+    async def neighbor_chunks(self, chunk_ids, window):
+        if not chunk_ids:
+            return {}
+        docs = await self.es.mget(index=self.index, ids=chunk_ids, source_includes=["parent_id", "chunk_index"])
+        anchors = {doc["_id"]: (doc["_source"]["parent_id"], doc["_source"]["chunk_index"])
+                   for doc in docs["docs"] if doc.get("found") and "chunk_index" in doc.get("_source", {})}
+        if not anchors:
+            return {}
+        # One search for every window: each should clause is one parent_id and chunk_index range
+        windows = [{"bool": {"filter": [
+            {"term": {"parent_id": parent_id}},
+            {"range": {"chunk_index": {"gte": index - window, "lte": index + window}}}
+        ]}} for parent_id, index in anchors.values()]
+        start = time.perf_counter()
+        with span("elasticsearch.neighbors") as current:
+            response = await self.es.search(index=self.index, body={
+                "query": {"bool": {"filter": [{"term": {"doc_type": "chunk"}}], "should": windows,
+                                   "minimum_should_match": 1}},
+                "size": len(anchors) * (2 * window + 1),
+                "_source": ["parent_id", "chunk_index", "chunk_text"],
+                "sort": [{"chunk_index": "asc"}]
+            })
+            record_took("neighbors", response.get("took"), time.perf_counter() - start, current)
+        by_parent = {}
+        for hit in response["hits"]["hits"]:
+            source = hit["_source"]
+            by_parent.setdefault(source["parent_id"], []).append(source)
+        return {
+            chunk_id: [{"chunkIndex": source["chunk_index"], "text": source.get("chunk_text", "")}
+                       for source in by_parent.get(parent_id, []) if abs(source["chunk_index"] - index) <= window]
+            for chunk_id, (parent_id, index) in anchors.items()
+        }
+
+    async def file_page(self, limit, search_after=None):
+        return await fetch_file_page(self.es, self.index, limit, search_after)
+
+    def iter_files(self, page_size):
+        return iter_files(self.es, self.index, page_size)
+
+    async def index_meta(self):
+        mapping = await self.es.indices.get_mapping(index=self.index)
+        return next(iter(mapping.values()))["mappings"].get("_meta", {})
+
+    async def close(self):
+        await self.es.close()
+
+
+class LocalBackend(RetrievalBackend):
+    """Serves from a local index directory written by the indexer with --backend local."""
+
+    def __init__(self, directory: Path):
+        from api.local_index import LocalIndexReader
+        self.reader = LocalIndexReader(directory)
+
+    async def search(self, query_vector, query_text, k, num_candidates, path=None, file_name=None,
+                     rescore_oversample=None):
+        # Vectors are scored exactly (or on int8 with per-row scales), so there is nothing to rescore
+        hit_lists = [await run_in_threadpool(self.reader.knn, query_vector, k, num_candidates, path, file_name)]
+        if query_text is not None:
+            hit_lists.append(await run_in_threadpool(self.reader.lexical, query_text, k, path, file_name))
+        return hit_lists
+
+    async def get_document(self, doc_id):
+        return await run_in_threadpool(self.reader.get, doc_id)
+
+    async def neighbor_chunks(self, chunk_ids, window):
+        return await run_in_threadpool(self.reader.neighbors, chunk_ids, window)
+
+    async def file_page(self, limit, search_after=None):
+        rows = await run_in_threadpool(self.reader.file_page, limit, search_after)
+        files = [{"id": row["id"], "fileName": row["file_name"], "path": row["path"]} for row in rows]
+        next_after = [rows[-1]["path"], rows[-1]["file_name"]] if len(rows) == limit else None
+        return files, next_after
+
+    async def iter_files(self, page_size):
+        search_after = None
+        while True:
+            files, search_after = await self.file_page(page_size, search_after)
+            for entry in files:
+                yield entry
+            if search_after is None:
+                return
+
+    async def index_meta(self):
+        # Picks up a re-committed index without restarting the API
+        await run_in_threadpool(self.reader.reload)
+        return {**self.reader.meta.get("_meta", {}), "index_version": self.reader.meta.get("index_version", "0")}
@@ -0,0 +1,169 @@
+import re
+import json
+import math
+import time
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+
+class CacheBackend:
+    """Storage for SearchCache. Values must be JSON-serialisable."""
+
+    async def get(self, key: str) -> Any | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any) -> None:
+        raise NotImplementedError
+
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+
+class LocalTTLCache(CacheBackend):
+    """In-process LRU cache with a per-entry time-to-live."""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Any | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    async def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    async def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCache(CacheBackend):
+    """Redis-backed cache so several uvicorn workers share entries. Needs the 'redis' package."""
+
+    def __init__(self, url: str, namespace: str, ttl_seconds: float):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("SEARCH_CACHE_BACKEND=redis requires the 'redis' package: pip install redis") from e
+        self.client = redis.from_url(url)
+        self.namespace = namespace
+        self.ttl = ttl_seconds
+
+    async def get(self, key: str) -> Any | None:
+        value = await self.client.get(f"{self.namespace}:{key}")
+        return json.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any) -> None:
+        # Millisecond expiry, so TTLs under a second do not round down to an invalid 0
+        await self.client.set(f"{self.namespace}:{key}", json.dumps(value), px=max(math.ceil(self.ttl * 1000), 1))
+
+    async def clear(self, batch_size: int = 500) -> None:
+        """Deletes every entry in this cache's namespace, which other workers share."""
+        batch = []
+        async for key in self.client.scan_iter(match=f"{self.namespace}:*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                await self.client.delete(*batch)
+                batch = []
+        if batch:
+            await self.client.delete(*batch)
+
+
+def normalize_query(text: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as the embedding cache key."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def vector_digest(vector: list[float]) -> str:
+    return hashlib.sha1(array("f", vector).tobytes()).hexdigest()
+
+
+class SearchCache:
+    """Two-level cache: query text -> embedding, and (vector, search params, index version) -> results."""
+
+    def __init__(self, embeddings: CacheBackend, results: CacheBackend, model_name: str):
+        self.embeddings = embeddings
+        self.results = results
+        self.model_name = model_name
+        self.counters = {"embedding": {"hits": 0, "misses": 0}, "results": {"hits": 0, "misses": 0}}
+
+    def _count(self, level: str, value: Any | None) -> Any | None:
+        self.counters[level]["hits" if value is not None else "misses"] += 1
+        return value
+
+    async def get_embedding(self, query: str) -> list[float] | None:
+        return self._count("embedding", await self.embeddings.get(self._embedding_key(query)))
+
+    async def set_embedding(self, query: str, vector: list[float]) -> None:
+        await self.embeddings.set(self._embedding_key(query), vector)
+
+    async def get_results(self, vector: list[float], params: dict, index: str, version: str) -> list | None:
+        return self._count("results", await self.results.get(self._results_key(vector, params, index, version)))
+
+    async def set_results(self, vector: list[float], params: dict, index: str, version: str, results: list) -> None:
+        await self.results.set(self._results_key(vector, params, index, version), results)
+
+    async def invalidate_results(self) -> None:
+        await self.results.clear()
+
+    def stats(self) -> dict:
+        stats = {}
+        for level, counts in self.counters.items():
+            total = counts["hits"] + counts["misses"]
+            stats[level] = {**counts, "hitRate": counts["hits"] / total if total else 0.0}
+        return stats
+
+    def _embedding_key(self, query: str) -> str:
+        return f"emb:{self.model_name}:{hashlib.sha1(normalize_query(query).encode('utf-8')).hexdigest()}"
+
+    def _results_key(self, vector: list[float], params: dict, index: str, version: str) -> str:
+        params_key = json.dumps(params, sort_keys=True, separators=(",", ":"))
+        return f"res:{index}:{version}:{vector_digest(vector)}:{hashlib.sha1(params_key.encode('utf-8')).hexdigest()}"
+
+
+class IndexVersionTracker:
+    """Polls the index_version the indexer stamps into the index mapping's _meta.
+
+    When it changes, cached results are invalidated; results keys also carry the version,
+    so shared backends never serve results from an older build of the index.
+    """
+
+    def __init__(self, fetch_version: Callable[[], Awaitable[str]], cache: SearchCache, check_interval: float = 30.0):
+        self.fetch_version = fetch_version
+        self.cache = cache
+        self.check_interval = check_interval
+        self.version = None
+        self._checked_at = 0.0
+
+    async def current(self) -> str:
+        if self.version is None or time.monotonic() - self._checked_at > self.check_interval:
+            self._checked_at = time.monotonic()
+            try:
+                version = await self.fetch_version()
+            except Exception:
+                version = self.version or "unknown"
+            if self.version is not None and version != self.version:
+                await self.cache.invalidate_results()
+            self.version = version
+        return self.version
@@ -0,0 +1,135 @@
+"""Embedding models shared by the API (queries) and the indexer (passages).
+
+Both sides must encode with the same model, or query and chunk vectors live in different
+spaces and ranking silently degrades. Models are picked by registry name; the indexer stamps
+the model into the index _meta and the API refuses to search an index built with another one.
+"""
+import logging
+from dataclasses import dataclass
+from api.lazy import Lazy
+
+# "fastembed" runs models on ONNX Runtime; "sentence-transformers" runs them on torch
+EMBEDDING_RUNTIMES = ("fastembed", "sentence-transformers")
+
+
+@dataclass(frozen=True)
+class EmbeddingModel:
+    name: str
+    model_id: str
+    dims: int
+    # Bump when anything that changes the vectors changes, e.g. the prefixes below
+    version: str = "1"
+    query_prefix: str = ""
+    passage_prefix: str = ""
+    # sentence-transformers only: the model ships its own modelling code
+    trust_remote_code: bool = False
+
+    @property
+    def fingerprint(self) -> str:
+        return f"{self.model_id}@{self.version}"
+
+
+EMBEDDING_MODELS = {model.name: model for model in [
+    EmbeddingModel("bge-small-en-v1.5", "BAAI/bge-small-en-v1.5", 384,
+                   query_prefix="Represent this sentence for searching relevant passages: "),
+    EmbeddingModel("bge-base-en-v1.5", "BAAI/bge-base-en-v1.5", 768,
+                   query_prefix="Represent this sentence for searching relevant passages: "),
+    EmbeddingModel("all-minilm-l6-v2", "sentence-transformers/all-MiniLM-L6-v2", 384),
+    EmbeddingModel("nomic-embed-text-v1.5", "nomic-ai/nomic-embed-text-v1.5", 768,
+                   query_prefix="search_query: ", passage_prefix="search_document: ", trust_remote_code=True),
+]}
+DEFAULT_EMBEDDING_MODEL = "bge-small-en-v1.5"
+
+
+class EmbeddingModelMismatch(RuntimeError):
+    pass
+
+
+def get_embedding_model(name: str) -> EmbeddingModel:
+    """Looks a model up by registry name or by its Hugging Face model ID."""
+    if name in EMBEDDING_MODELS:
+        return EMBEDDING_MODELS[name]
+    for model in EMBEDDING_MODELS.values():
+        if model.model_id == name:
+            return model
+    raise ValueError(f"Unknown embedding model '{name}'. Use one of {', '.join(EMBEDDING_MODELS)}.")
+
+
+def model_meta(model: EmbeddingModel) -> dict:
+    """The _meta entries identifying the model an index was built with."""
+    return {
+        "embedding_model": model.name,
+        "embedding_model_id": model.model_id,
+        "embedding_model_version": model.version,
+        "embedding_dims": model.dims,
+    }
+
+
+def check_index_model(model: EmbeddingModel, meta: dict) -> None:
+    """Raises EmbeddingModelMismatch if the index _meta names a different model."""
+    if "embedding_model_id" not in meta:
+        logging.warning("The index does not record its embedding model; re-run the indexer to stamp it.")
+        return
+    indexed = (meta["embedding_model_id"], str(meta.get("embedding_model_version")), meta.get("embedding_dims"))
+    if indexed != (model.model_id, model.version, model.dims):
+        raise EmbeddingModelMismatch(
+            f"The index was built with {indexed[0]} (version {indexed[1]}, {indexed[2]} dims) but queries are "
+            f"encoded with {model.model_id} (version {model.version}, {model.dims} dims). "
+            f"Set EMBEDDING_MODEL to match the index or re-index."
+        )
+
+
+class Embedder:
+    """Encodes queries and passages with one registry model, adding the model's prefixes.
+
+    The model is loaded on first use (or by load()), thread-safely.
+    """
+
+    def __init__(self, model: EmbeddingModel, runtime: str = "fastembed", threads: int | None = None):
+        if runtime not in EMBEDDING_RUNTIMES:
+            raise ValueError(f"Unknown embedding runtime '{runtime}'. Use one of {', '.join(EMBEDDING_RUNTIMES)}.")
+        self.model = model
+        self.runtime = runtime
+        self.threads = threads
+        self._model = Lazy(self._load)
+
+    @property
+    def loaded(self) -> bool:
+        return self._model.loaded
+
+    @property
+    def load_seconds(self) -> float | None:
+        return self._model.load_seconds
+
+    def load(self) -> None:
+        self._model.get()
+
+    def embed_queries(self, texts: list[str]):
+        """float32 matrix of L2-normalised query vectors."""
+        return self._encode([self.model.query_prefix + text for text in texts])
+
+    def embed_passages(self, texts: list[str], batch_size: int = 256, parallel: int | None = None):
+        """float32 matrix of L2-normalised passage vectors. parallel only applies to fastembed."""
+        return self._encode([self.model.passage_prefix + text for text in texts], batch_size, parallel)
+
+    def _encode(self, texts: list[str], batch_size: int = 256, parallel: int | None = None):
+        import numpy as np
+        if not texts:
+            return np.empty((0, self.model.dims), dtype=np.float32)
+        model = self._model.get()
+        if self.runtime == "fastembed":
+            vectors = list(model.embed(texts, batch_size=batch_size, parallel=parallel))
+        else:
+            vectors = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _load(self):
+        logging.info(f"Loading embedding model '{self.model.model_id}' on {self.runtime}...")
+        if self.runtime == "sentence-transformers":
+            from sentence_transformers import SentenceTransformer
+            return SentenceTransformer(self.model.model_id, trust_remote_code=self.model.trust_remote_code)
+        try:
+            from fastembed import TextEmbedding
+        except ImportError as e:
+            raise RuntimeError("The fastembed runtime requires the fastembed package") from e
+        return TextEmbedding(model_name=self.model.model_id, threads=self.threads)
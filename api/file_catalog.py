@@ -0,0 +1,81 @@
+import json
+import base64
+from typing import TYPE_CHECKING, AsyncIterator
+
+if TYPE_CHECKING:
+    from elasticsearch import AsyncElasticsearch
+
+# Parent "document" records are unique per (path, file_name), so this sort is a total order
+CATALOG_SORT = [{"path": "asc"}, {"file_name": "asc"}]
+CATALOG_QUERY = {"term": {"doc_type": "document"}}
+PIT_KEEP_ALIVE = "1m"
+
+
+def encode_cursor(sort_values: list) -> str:
+    """Turns the sort values of the last hit on a page into an opaque cursor."""
+    return base64.urlsafe_b64encode(json.dumps(sort_values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> list:
+    """Inverse of encode_cursor. Raises ValueError for anything that is not a valid cursor."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != len(CATALOG_SORT):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def file_entry(hit: dict) -> dict:
+    return {
+        "id": hit["_id"],
+        "fileName": hit["_source"].get("file_name", ""),
+        "path": hit["_source"].get("path", "")
+    }
+
+
+async def fetch_file_page(es: "AsyncElasticsearch", index: str, limit: int,
+                          search_after: list | None = None) -> tuple[list[dict], list | None]:
+    """Returns one page of files and the sort values to continue from (None on the last page)."""
+    body = {
+        "size": limit,
+        "query": CATALOG_QUERY,
+        "sort": CATALOG_SORT,
+        "_source": ["file_name", "path"],
+        "track_total_hits": False
+    }
+    if search_after:
+        body["search_after"] = search_after
+    response = await es.search(index=index, body=body)
+    hits = response["hits"]["hits"]
+    next_after = hits[-1]["sort"] if len(hits) == limit else None
+    return [file_entry(hit) for hit in hits], next_after
+
+
+async def iter_files(es: "AsyncElasticsearch", index: str, page_size: int) -> AsyncIterator[dict]:
+    """Yields every file in the catalog, paging with search_after over a point-in-time snapshot."""
+    pit_id = (await es.open_point_in_time(index=index, keep_alive=PIT_KEEP_ALIVE))["id"]
+    try:
+        search_after = None
+        while True:
+            body = {
+                "size": page_size,
+                "query": CATALOG_QUERY,
+                "sort": CATALOG_SORT,
+                "_source": ["file_name", "path"],
+                "track_total_hits": False,
+                "pit": {"id": pit_id, "keep_alive": PIT_KEEP_ALIVE}
+            }
+            if search_after:
+                body["search_after"] = search_after
+            response = await es.search(body=body)
+            pit_id = response.get("pit_id", pit_id)
+            hits = response["hits"]["hits"]
+            for hit in hits:
+                yield file_entry(hit)
+            if len(hits) < page_size:
+                return
+            search_after = hits[-1]["sort"]
+    finally:
+        await es.close_point_in_time(id=pit_id)
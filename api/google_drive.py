@@ -1,8 +1,11 @@
-
 import os
-from google_auth_oauthlib.flow import Flow
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 
 # This is the scope that your application will request from the user.
 # For this application, we need to read files from Google Drive and create new files (for the export to sheets feature).
@@ -13,8 +16,16 @@ SCOPES = [
 
 REDIRECT_URI = 'http://localhost:5173/api/auth/google/callback'
 
+# Service objects are cached per user credential: discovery parsing, connection setup and
+# token refresh then happen once per user instead of once per request
+SERVICE_CACHE_SIZE = int(os.getenv("GOOGLE_SERVICE_CACHE_SIZE", "256"))
+SERVICE_CACHE_TTL_SECONDS = float(os.getenv("GOOGLE_SERVICE_CACHE_TTL_SECONDS", "1800"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("GOOGLE_HTTP_TIMEOUT_SECONDS", "60"))
+
 def get_google_flow():
     """Creates and returns a Google OAuth 2.0 Flow object."""
+    # Imported on use: the OAuth and API client libraries add noticeably to cold start
+    from google_auth_oauthlib.flow import Flow
     client_secrets = {
         "web": {
             "client_id": os.getenv("GOOGLE_CLIENT_ID"),
@@ -26,10 +37,150 @@ def get_google_flow():
     }
     return Flow.from_client_config(client_secrets, scopes=SCOPES, redirect_uri=REDIRECT_URI)
 
+@lru_cache(maxsize=None)
+def discovery_document(api: str, version: str) -> str:
+    """The discovery document bundled with google-api-python-client; never fetched at runtime."""
+    from googleapiclient.discovery_cache import get_static_doc
+    document = get_static_doc(api, version)
+    if document is None:
+        raise RuntimeError(f"No static discovery document for {api} {version}")
+    return document
+
+class ThreadLocalHttp:
+    """Gives every thread its own keep-alive httplib2.Http, which is not thread-safe itself.
+
+    Executor threads are long-lived, so each keeps its connections to Google open across requests.
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            import httplib2
+            http = self._local.http = httplib2.Http(timeout=self.timeout)
+        return http
+
+    def request(self, *args, **kwargs):
+        return self._http().request(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._http(), name)
+
+# Shared by every cached service; connections are pooled per thread, not per user
+_transport = ThreadLocalHttp(HTTP_TIMEOUT_SECONDS)
+
+class GoogleSession:
+    """One user's credentials and the service objects built on them."""
+
+    def __init__(self, credentials: Credentials):
+        import google_auth_httplib2
+        self.credentials = credentials
+        self.http = google_auth_httplib2.AuthorizedHttp(credentials, http=_transport)
+        self.services = {}
+        self.expires_at = time.monotonic() + SERVICE_CACHE_TTL_SECONDS
+        self._lock = threading.Lock()
+
+    def refresh_if_needed(self) -> None:
+        """Refreshes an expired access token once, however many requests are waiting on it."""
+        with self._lock:
+            if not self.credentials.valid and self.credentials.refresh_token:
+                import google_auth_httplib2
+                logging.info("Refreshing Google access token.")
+                self.credentials.refresh(google_auth_httplib2.Request(_transport))
+
+    def service(self, api: str, version: str):
+        with self._lock:
+            if (api, version) not in self.services:
+                from googleapiclient.discovery import build_from_document
+                self.services[(api, version)] = build_from_document(discovery_document(api, version), http=self.http)
+            return self.services[(api, version)]
+
+class GoogleServiceCache:
+    """LRU of GoogleSessions keyed by credential, each living at most ttl_seconds."""
+
+    def __init__(self, maxsize: int, ttl_seconds: float):
+        self.maxsize = maxsize
+        self.ttl = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(credentials: Credentials) -> str:
+        # The refresh token identifies a grant for as long as it lives; access tokens rotate hourly
+        identity = credentials.refresh_token or credentials.token or ""
+        return hashlib.sha256(f"{credentials.client_id}:{identity}".encode("utf-8")).hexdigest()
+
+    def session(self, credentials: Credentials) -> GoogleSession:
+        key = self.key(credentials)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is not None and session.expires_at > time.monotonic():
+                self._sessions.move_to_end(key)
+                self.hits += 1
+                return session
+            self.misses += 1
+            # Cookies carry the token they were issued with; a cached session may hold a newer one
+            session = self._sessions[key] = GoogleSession(credentials)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+            return session
+
+    def stats(self) -> dict:
+        return {"sessions": len(self._sessions), "hits": self.hits, "misses": self.misses}
+
+service_cache = GoogleServiceCache(SERVICE_CACHE_SIZE, SERVICE_CACHE_TTL_SECONDS)
+
+def get_service(credentials: Credentials, api: str, version: str):
+    """Returns a cached API service object for these credentials with a valid access token."""
+    session = service_cache.session(credentials)
+    session.refresh_if_needed()
+    return session.service(api, version)
+
 def get_drive_service(credentials: Credentials):
     """Returns a Google Drive API service object."""
-    return build('drive', 'v3', credentials=credentials)
+    return get_service(credentials, 'drive', 'v3')
 
 def get_sheets_service(credentials: Credentials):
     """Returns a Google Sheets API service object."""
-    return build('sheets', 'v4', credentials=credentials)
+    return get_service(credentials, 'sheets', 'v4')
+
+# --- Drive listing ---
+
+DRIVE_DOCUMENT_TYPES = [
+    'application/vnd.google-apps.document',
+    'application/vnd.google-apps.spreadsheet'
+]
+DRIVE_FILE_FIELDS = "id, name, mimeType, modifiedTime"
+# Retries with exponential backoff on 429, 5xx and 403 rate-limit errors (googleapiclient's own policy)
+GOOGLE_API_RETRIES = int(os.getenv("GOOGLE_API_RETRIES", "5"))
+
+def mime_type_query(mime_types: list[str]) -> str:
+    """Drive search query for non-trashed files of the given types."""
+    types = " or ".join(f"mimeType='{mime_type}'" for mime_type in mime_types)
+    return f"({types}) and trashed = false"
+
+def list_drive_page(service, query: str, page_size: int, page_token: str | None = None,
+                    fields: str = DRIVE_FILE_FIELDS) -> tuple[list[dict], str | None]:
+    """One page of a Drive listing and the token of the next page (None on the last page)."""
+    response = service.files().list(
+        q=query,
+        pageSize=page_size,
+        pageToken=page_token,
+        fields=f"nextPageToken, files({fields})"
+    ).execute(num_retries=GOOGLE_API_RETRIES)
+    return response.get('files', []), response.get('nextPageToken')
+
+def iter_drive_files(service, query: str, page_size: int = 1000, fields: str = DRIVE_FILE_FIELDS):
+    """Every file matching query, following nextPageToken through the whole listing."""
+    page_token = None
+    while True:
+        files, page_token = list_drive_page(service, query, page_size, page_token, fields)
+        yield from files
+        if not page_token:
+            return
@@ -0,0 +1,35 @@
+import time
+import threading
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class Lazy(Generic[T]):
+    """Builds a value on first use instead of at import time.
+
+    Safe to call from several threads at once: the factory runs exactly once and everyone else
+    waits for its result. A failed build is not cached, so the next call retries.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self.factory = factory
+        self.load_seconds: float | None = None
+        self._value: T | None = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> T:
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                start = time.perf_counter()
+                self._value = self.factory()
+                self.load_seconds = time.perf_counter() - start
+                self._loaded = True
+        return self._value
@@ -0,0 +1,497 @@
+"""Local, in-process vector index: a drop-in alternative to Elasticsearch for dev, CI and
+small single-node deployments.
+
+Layout of an index directory:
+
+    store.sqlite     documents, chunks (with raw float32 vectors) and an FTS5 table for BM25
+    vectors.f32.npy  row-major matrix of L2-normalised vectors (or vectors.i8.npy + scales.f32.npy)
+    chunk_ids.npy    the chunk ID of each matrix row, in the same (sorted) order
+    ivf_*.npy        optional inverted-file lists over the matrix
+    meta.json        dims, row count, dtype, index_version and free-form _meta entries
+
+sqlite is the source of truth and is updated incrementally; commit() re-exports the matrix
+and IVF lists, which is cheap next to embedding. Readers memory-map the matrix. Every exported
+file is replaced atomically, and rows are resolved through the reader's own chunk_ids, so a
+reader still on the previous export never maps a row to the wrong chunk.
+"""
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Iterable, Iterator
+import numpy as np
+
+VECTOR_DTYPES = ["float32", "int8"]
+# Rows scored per NumPy call, which bounds the temporary memory of a brute-force scan
+SCAN_BLOCK_ROWS = 65536
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    content TEXT,
+    content_type TEXT,
+    content_hash TEXT,
+    chunk_count INTEGER,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_by_file ON documents (path, file_name);
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    path TEXT NOT NULL,
+    chunk_index INTEGER,
+    chunk_text TEXT,
+    vector BLOB,
+    timestamp TEXT
+);
+CREATE INDEX IF NOT EXISTS chunks_by_file ON chunks (path, file_name);
+CREATE INDEX IF NOT EXISTS chunks_by_parent ON chunks (parent_id, chunk_index);
+"""
+_FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(chunk_id UNINDEXED, chunk_text)"
+
+
+def _fts_query(text: str) -> str:
+    """Turns free text into an FTS5 OR-query of quoted terms, so user input is never parsed as syntax."""
+    terms = ["".join(ch for ch in word if ch.isalnum()) for word in text.split()]
+    return " OR ".join(f'"{term}"' for term in terms if term)
+
+
+def _file_filter(path: str | None, file_name: str | None, table: str = "") -> tuple[str, list]:
+    """SQL condition and parameters restricting chunks to a folder (and below) and/or file."""
+    prefix = f"{table}." if table else ""
+    clauses, params = [], []
+    if path:
+        clauses.append(f"({prefix}path = ? OR {prefix}path LIKE ? ESCAPE '\\')")
+        escaped = path.rstrip("/").replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        params += [path, escaped + "/%"]
+    if file_name:
+        clauses.append(f"{prefix}file_name = ?")
+        params.append(file_name)
+    return (" AND ".join(clauses) or "1"), params
+
+
+class LocalIndexWriter:
+    """Writes documents and chunks into a local index directory. Thread-safe."""
+
+    def __init__(self, directory: Path, dims: int):
+        self.directory = Path(directory)
+        self.dims = dims
+        self._lock = threading.Lock()
+        self._db = None
+
+    def exists(self) -> bool:
+        return (self.directory / "meta.json").is_file()
+
+    def open(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.directory / "store.sqlite", check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        try:
+            self._db.execute(_FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            logging.warning("SQLite was built without FTS5; lexical search on the local index is disabled.")
+            self.has_fts = False
+        self._db.commit()
+
+    def reset(self) -> None:
+        """Deletes the whole index directory contents and starts empty."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+        if self.directory.is_dir():
+            for path in self.directory.iterdir():
+                if path.is_file():
+                    path.unlink()
+        self.open()
+
+    def delete_file(self, file_name: str, relative_path: str, keep: Iterable[str] = ()) -> int:
+        """Removes the document and chunks of one file, except the records whose IDs are in keep.
+        Returns the number of records deleted."""
+        with self._lock:
+            self._db.execute("CREATE TEMP TABLE IF NOT EXISTS keep_ids (id TEXT PRIMARY KEY)")
+            self._db.execute("DELETE FROM keep_ids")
+            self._db.executemany("INSERT OR IGNORE INTO keep_ids VALUES (?)", ((doc_id,) for doc_id in keep))
+            where = "file_name = ? AND path = ? AND id NOT IN (SELECT id FROM keep_ids)"
+            if self.has_fts:
+                self._db.execute(f"DELETE FROM chunks_fts WHERE chunk_id IN (SELECT id FROM chunks WHERE {where})",
+                                 (file_name, relative_path))
+            deleted = self._db.execute(f"DELETE FROM chunks WHERE {where}", (file_name, relative_path)).rowcount
+            deleted += self._db.execute(f"DELETE FROM documents WHERE {where}", (file_name, relative_path)).rowcount
+            self._db.commit()
+            return deleted
+
+    def write(self, actions: Iterable[dict], batch_size: int = 500) -> Iterator[tuple[bool, str, str | None]]:
+        """Upserts Elasticsearch-style bulk actions; yields (ok, id, error) per action."""
+        batch = []
+        for action in actions:
+            batch.append(action)
+            if len(batch) >= batch_size:
+                yield from self._write_batch(batch)
+                batch = []
+        if batch:
+            yield from self._write_batch(batch)
+
+    def _write_batch(self, actions: list[dict]) -> list[tuple[bool, str, str | None]]:
+        results = []
+        with self._lock:
+            for action in actions:
+                doc_id = action["_id"]
+                try:
+                    if action.get("_op_type") == "update":
+                        # Only promotions of duplicate references are sent as partial updates
+                        vector = self._vector(action["doc"]["chunk_vector"])
+                        if not self._db.execute("UPDATE chunks SET vector = ? WHERE id = ?",
+                                                (vector.tobytes(), doc_id)).rowcount:
+                            raise LookupError("document missing")
+                        results.append((True, doc_id, None))
+                        continue
+                    source = action["_source"]
+                    if source.get("doc_type") == "chunk":
+                        # Duplicate references carry no vector; they stay out of the search matrix
+                        vector = self._vector(source["chunk_vector"]) if "chunk_vector" in source else None
+                        existed = self._db.execute("SELECT 1 FROM chunks WHERE id = ?", (doc_id,)).fetchone()
+                        self._db.execute(
+                            "INSERT OR REPLACE INTO chunks (id, parent_id, file_name, path, chunk_index, chunk_text,"
+                            " vector, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (doc_id, source["parent_id"], source["file_name"], source["path"], source["chunk_index"],
+                             source["chunk_text"], vector.tobytes() if vector is not None else None,
+                             source.get("timestamp")))
+                        if self.has_fts:
+                            # chunk_id is UNINDEXED, so this delete scans the FTS table; only pay for it on re-writes
+                            if existed:
+                                self._db.execute("DELETE FROM chunks_fts WHERE chunk_id = ?", (doc_id,))
+                            self._db.execute("INSERT INTO chunks_fts (chunk_id, chunk_text) VALUES (?, ?)",
+                                             (doc_id, source["chunk_text"]))
+                    else:
+                        self._db.execute(
+                            "INSERT OR REPLACE INTO documents (id, file_name, path, content, content_type,"
+                            " content_hash, chunk_count, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                            (doc_id, source["file_name"], source["path"], source.get("content"),
+                             source.get("content_type"), source.get("content_hash"), source.get("chunk_count"),
+                             source.get("timestamp")))
+                    results.append((True, doc_id, None))
+                except Exception as e:
+                    results.append((False, doc_id, str(e)))
+            self._db.commit()
+        return results
+
+    def _vector(self, values) -> np.ndarray:
+        vector = np.asarray(values, dtype=np.float32)
+        if vector.shape != (self.dims,):
+            raise ValueError(f"expected {self.dims} dims, got {vector.shape}")
+        return vector
+
+    def read_meta(self) -> dict:
+        meta_path = self.directory / "meta.json"
+        if not meta_path.is_file():
+            return {}
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+
+    def commit(self, vector_dtype: str = "float32", ivf_lists: int = 0, meta: dict | None = None) -> dict:
+        """Exports the search matrix (and IVF lists) from sqlite and stamps a new index_version."""
+        if vector_dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unknown vector dtype '{vector_dtype}'. Expected one of: {', '.join(VECTOR_DTYPES)}")
+        with self._lock:
+            count = self._db.execute("SELECT COUNT(*) FROM chunks WHERE vector IS NOT NULL").fetchone()[0]
+            matrix_name = "vectors.i8.npy" if vector_dtype == "int8" else "vectors.f32.npy"
+            tmp_path = self.directory / (matrix_name + ".tmp")
+            dtype = np.int8 if vector_dtype == "int8" else np.float32
+            if count:
+                matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(count, self.dims))
+            else:
+                matrix = np.empty((0, self.dims), dtype=dtype)
+            scales = np.zeros(count, dtype=np.float32) if vector_dtype == "int8" else None
+
+            chunk_ids = []
+            cursor = self._db.execute("SELECT id, vector FROM chunks WHERE vector IS NOT NULL ORDER BY id")
+            for row, (chunk_id, blob) in enumerate(cursor):
+                vector = np.frombuffer(blob, dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                vector = vector / norm if norm > 0 else vector
+                if scales is not None:
+                    # Symmetric per-row scale: int8 value * scale approximates the float component
+                    scale = float(np.abs(vector).max()) / 127 or 1.0
+                    matrix[row] = np.round(vector / scale).astype(np.int8)
+                    scales[row] = scale
+                else:
+                    matrix[row] = vector
+                chunk_ids.append(chunk_id.encode("utf-8"))
+            if count:
+                matrix.flush()
+                del matrix
+            else:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, matrix)
+
+            # Readers keep serving from their existing mappings; each swap is atomic
+            _save_atomic(self.directory / "chunk_ids.npy", np.array(chunk_ids, dtype=bytes))
+            tmp_path.replace(self.directory / matrix_name)
+            if scales is not None:
+                _save_atomic(self.directory / "scales.f32.npy", scales)
+            else:
+                (self.directory / "vectors.i8.npy").unlink(missing_ok=True)
+                (self.directory / "scales.f32.npy").unlink(missing_ok=True)
+            if vector_dtype == "int8":
+                (self.directory / "vectors.f32.npy").unlink(missing_ok=True)
+
+            lists = min(ivf_lists, count // 4) if ivf_lists else 0
+            if lists > 1:
+                _build_ivf(self.directory, lists, vector_dtype)
+            else:
+                for name in ("ivf_centroids.npy", "ivf_order.npy", "ivf_offsets.npy"):
+                    (self.directory / name).unlink(missing_ok=True)
+
+            previous = self.read_meta()
+            new_meta = {
+                "dims": self.dims,
+                "count": count,
+                "vector_dtype": vector_dtype,
+                "ivf_lists": lists if lists > 1 else 0,
+                "has_fts": self.has_fts,
+                "index_version": str(time.time_ns()),
+                "_meta": {**previous.get("_meta", {}), **(meta or {})},
+            }
+            tmp_meta = self.directory / "meta.json.tmp"
+            tmp_meta.write_text(json.dumps(new_meta, indent=2), encoding="utf-8")
+            tmp_meta.replace(self.directory / "meta.json")
+            return new_meta
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def _save_atomic(path: Path, array: np.ndarray) -> None:
+    """np.save to a temporary file swapped into place, so memory-mapped readers keep the old file."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    tmp_path.replace(path)
+
+
+def _load_matrix(directory: Path, vector_dtype: str = "float32") -> tuple[np.ndarray, np.ndarray | None]:
+    if vector_dtype == "int8":
+        return np.load(directory / "vectors.i8.npy", mmap_mode="r"), np.load(directory / "scales.f32.npy")
+    return np.load(directory / "vectors.f32.npy", mmap_mode="r"), None
+
+
+def _build_ivf(directory: Path, lists: int, vector_dtype: str, iterations: int = 10,
+               sample_rows: int = 100_000) -> None:
+    """Trains k-means centroids on a sample of rows and stores rows grouped by nearest centroid."""
+    matrix, scales = _load_matrix(directory, vector_dtype)
+    rng = np.random.default_rng(0)
+    sample_idx = np.sort(rng.choice(len(matrix), size=min(sample_rows, len(matrix)), replace=False))
+    sample = _dequantize(matrix[sample_idx], scales[sample_idx] if scales is not None else None)
+    centroids = sample[rng.choice(len(sample), size=lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for list_id in range(lists):
+            members = sample[assign == list_id]
+            if len(members):
+                centroid = members.mean(axis=0)
+                norm = np.linalg.norm(centroid)
+                centroids[list_id] = centroid / norm if norm > 0 else centroid
+
+    assign = np.empty(len(matrix), dtype=np.int32)
+    for start in range(0, len(matrix), SCAN_BLOCK_ROWS):
+        block = _dequantize(matrix[start:start + SCAN_BLOCK_ROWS],
+                            scales[start:start + SCAN_BLOCK_ROWS] if scales is not None else None)
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    order = np.argsort(assign, kind="stable").astype(np.int64)
+    offsets = np.zeros(lists + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(assign, minlength=lists))
+    _save_atomic(directory / "ivf_centroids.npy", centroids.astype(np.float32))
+    _save_atomic(directory / "ivf_order.npy", order)
+    _save_atomic(directory / "ivf_offsets.npy", offsets)
+
+
+def _dequantize(block: np.ndarray, scales: np.ndarray | None) -> np.ndarray:
+    if scales is None:
+        return np.asarray(block, dtype=np.float32)
+    return block.astype(np.float32) * scales[:, None]
+
+
+class LocalIndexReader:
+    """Read side of a local index. Search calls are synchronous and CPU-bound; run them off the event loop."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.meta = {}
+        # (matrix, scales, ivf lists, chunk_ids) of one export, swapped as a whole by reload()
+        self._export = None
+        self.reload()
+
+    def reload(self) -> None:
+        """(Re)opens the matrix and IVF lists if the index has been re-committed since the last load."""
+        meta_path = self.directory / "meta.json"
+        if not meta_path.is_file():
+            raise FileNotFoundError(f"No local index at '{self.directory}'. Run the indexer with --backend local first.")
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        if meta.get("index_version") == self.meta.get("index_version"):
+            return
+        with self._lock:
+            matrix, scales = _load_matrix(self.directory, meta.get("vector_dtype", "float32"))
+            ivf = None
+            if meta.get("ivf_lists"):
+                ivf = (np.load(self.directory / "ivf_centroids.npy"),
+                       np.load(self.directory / "ivf_order.npy", mmap_mode="r"),
+                       np.load(self.directory / "ivf_offsets.npy"))
+            ids_path = self.directory / "chunk_ids.npy"
+            if not ids_path.is_file():
+                raise FileNotFoundError(f"Local index '{self.directory}' was written by an older indexer. "
+                                        f"Run the indexer again to re-export it.")
+            chunk_ids = np.load(ids_path, mmap_mode="r")
+            if len(chunk_ids) != len(matrix):
+                # Loaded in the middle of another commit, whose meta.json triggers the next reload
+                if self._export is None:
+                    raise RuntimeError(f"Local index '{self.directory}' is being committed; try again.")
+                logging.warning(f"Local index '{self.directory}' is being re-committed; keeping the previous export.")
+                return
+            self._export, self.meta = (matrix, scales, ivf, chunk_ids), meta
+
+    def _db(self) -> sqlite3.Connection:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(f"file:{self.directory / 'store.sqlite'}?mode=ro", uri=True)
+            db.row_factory = sqlite3.Row
+            self._local.db = db
+        return db
+
+    def _candidate_rows(self, ivf, query: np.ndarray, num_candidates: int) -> np.ndarray | None:
+        """Rows from the closest IVF lists until at least num_candidates are gathered; None = scan everything."""
+        if ivf is None:
+            return None
+        centroids, order, offsets = ivf
+        rows = []
+        gathered = 0
+        for list_id in np.argsort(-(centroids @ query)):
+            start, end = offsets[list_id], offsets[list_id + 1]
+            rows.append(order[start:end])
+            gathered += end - start
+            if gathered >= num_candidates:
+                break
+        return np.sort(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+    def knn(self, query_vector: list[float], k: int, num_candidates: int,
+            path: str | None = None, file_name: str | None = None) -> list[dict]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        query = query / norm if norm > 0 else query
+        # One export throughout, even if reload() swaps in a newer one meanwhile
+        matrix, scales, ivf, chunk_ids = self._export
+
+        rows = self._candidate_rows(ivf, query, num_candidates)
+        if path or file_name:
+            condition, params = _file_filter(path, file_name)
+            allowed = self._rows_of(chunk_ids, [r[0] for r in self._db().execute(
+                f"SELECT id FROM chunks WHERE vector IS NOT NULL AND {condition}", params)])
+            rows = allowed if rows is None else np.intersect1d(rows, allowed)
+
+        best_rows, best_scores = [], []
+        total = len(matrix) if rows is None else len(rows)
+        for start in range(0, total, SCAN_BLOCK_ROWS):
+            if rows is None:
+                block_rows = np.arange(start, min(start + SCAN_BLOCK_ROWS, total))
+                block = matrix[start:start + SCAN_BLOCK_ROWS]
+            else:
+                block_rows = rows[start:start + SCAN_BLOCK_ROWS]
+                block = matrix[block_rows]
+            scores = _dequantize(block, scales[block_rows] if scales is not None else None) @ query
+            if len(scores) > k:
+                top = np.argpartition(-scores, k)[:k]
+                block_rows, scores = block_rows[top], scores[top]
+            best_rows.append(block_rows)
+            best_scores.append(scores)
+        if not best_rows:
+            return []
+        all_rows = np.concatenate(best_rows)
+        all_scores = np.concatenate(best_scores)
+        top = np.argsort(-all_scores)[:k]
+        # Same scale as Elasticsearch's cosine similarity score
+        ids = [chunk_ids[row].decode("utf-8") for row in all_rows[top]]
+        return self._hits(ids, ((1 + all_scores[top]) / 2).tolist())
+
+    @staticmethod
+    def _rows_of(chunk_ids: np.ndarray, ids: list[str]) -> np.ndarray:
+        """Sorted matrix rows of the given chunk IDs; IDs not in this export are left out."""
+        if not ids or not len(chunk_ids):
+            return np.empty(0, dtype=np.int64)
+        wanted = np.array([chunk_id.encode("utf-8") for chunk_id in ids], dtype=bytes)
+        rows = np.minimum(np.searchsorted(chunk_ids, wanted), len(chunk_ids) - 1)
+        return np.sort(rows[chunk_ids[rows] == wanted])
+
+    def _hits(self, ids: list[str], scores: list[float]) -> list[dict]:
+        if not ids:
+            return []
+        placeholders = ",".join("?" * len(ids))
+        by_id = {r["id"]: r for r in self._db().execute(
+            f"SELECT id, parent_id, file_name, path, chunk_text FROM chunks WHERE id IN ({placeholders})", ids)}
+        # Chunks deleted since the export was loaded are dropped
+        return [
+            {"_id": chunk_id, "_score": score, "_source": {
+                "file_name": by_id[chunk_id]["file_name"], "path": by_id[chunk_id]["path"],
+                "chunk_text": by_id[chunk_id]["chunk_text"], "parent_id": by_id[chunk_id]["parent_id"]}}
+            for chunk_id, score in zip(ids, scores) if chunk_id in by_id
+        ]
+
+    def lexical(self, text: str, size: int, path: str | None = None, file_name: str | None = None) -> list[dict]:
+        """BM25 over chunk_text via SQLite FTS5, with <em>-highlighted snippets like Elasticsearch."""
+        fts_query = _fts_query(text)
+        if not self.meta.get("has_fts") or not fts_query:
+            return []
+        condition, params = _file_filter(path, file_name, table="c")
+        if not path and not file_name:
+            # Duplicate references only count when searching inside their own folder or file
+            condition = "c.vector IS NOT NULL"
+        rows = self._db().execute(
+            "SELECT c.id, c.parent_id, c.file_name, c.path, c.chunk_text, -bm25(chunks_fts) AS score,"
+            " snippet(chunks_fts, 1, '<em>', '</em>', '...', 24) AS fragment"
+            f" FROM chunks_fts JOIN chunks c ON c.id = chunks_fts.chunk_id"
+            f" WHERE chunks_fts MATCH ? AND {condition} ORDER BY score DESC LIMIT ?",
+            [fts_query, *params, size]).fetchall()
+        return [
+            {"_id": r["id"], "_score": r["score"], "highlight": {"chunk_text": [r["fragment"]]}, "_source": {
+                "file_name": r["file_name"], "path": r["path"], "chunk_text": r["chunk_text"], "parent_id": r["parent_id"]}}
+            for r in rows
+        ]
+
+    def get(self, doc_id: str) -> dict | None:
+        """Returns a document's source; chunk IDs resolve to their parent document."""
+        db = self._db()
+        chunk = db.execute("SELECT parent_id FROM chunks WHERE id = ?", (doc_id,)).fetchone()
+        if chunk is not None:
+            doc_id = chunk["parent_id"]
+        row = db.execute("SELECT * FROM documents WHERE id = ?", (doc_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def neighbors(self, chunk_ids: list[str], window: int) -> dict[str, list[dict]]:
+        """The chunks within window positions of each chunk in the same document, in document order."""
+        if not chunk_ids:
+            return {}
+        placeholders = ",".join("?" * len(chunk_ids))
+        neighbors = {}
+        for r in self._db().execute(
+                "SELECT a.id AS anchor, c.chunk_index, c.chunk_text FROM chunks a"
+                " JOIN chunks c ON c.parent_id = a.parent_id AND c.chunk_index BETWEEN a.chunk_index - ? AND a.chunk_index + ?"
+                f" WHERE a.id IN ({placeholders}) ORDER BY a.id, c.chunk_index", [window, window, *chunk_ids]):
+            neighbors.setdefault(r["anchor"], []).append({"chunkIndex": r["chunk_index"], "text": r["chunk_text"]})
+        return neighbors
+
+    def file_page(self, limit: int, after: list | None = None) -> list[dict]:
+        """Files ordered by (path, file_name), starting after the given sort values."""
+        query = "SELECT id, file_name, path FROM documents"
+        params = []
+        if after:
+            query += " WHERE (path, file_name) > (?, ?)"
+            params = list(after)
+        query += " ORDER BY path, file_name LIMIT ?"
+        return [dict(r) for r in self._db().execute(query, [*params, limit]).fetchall()]
@@ -1,14 +1,34 @@
 import os
 import json
-from fastapi import FastAPI, HTTPException, Body, Request, Cookie
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel
-from elasticsearch import Elasticsearch
+import time
+import asyncio
+import logging
+import tempfile
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Body, Request, Cookie, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from typing import Literal
+from pydantic import BaseModel, Field, model_validator
 from dotenv import load_dotenv
 from pathlib import Path
 from itsdangerous import URLSafeSerializer
 from google.oauth2.credentials import Credentials
-from api.google_drive import get_google_flow, get_drive_service, get_sheets_service
+from api.google_drive import (DRIVE_DOCUMENT_TYPES, GOOGLE_API_RETRIES, get_google_flow, get_drive_service,
+                              get_sheets_service, iter_drive_files, list_drive_page, mime_type_query, service_cache)
+from api.sheets_export import SHEETS_EXPORT_SPOOL_BYTES, create_spreadsheet, export_jobs, run_export
+from api.query_batcher import QueryEmbeddingBatcher
+from api.cache import IndexVersionTracker, LocalTTLCache, RedisCache, SearchCache
+from api.file_catalog import decode_cursor, encode_cursor
+from api.search import reciprocal_rank_fusion
+from api.backends import ElasticsearchBackend, LocalBackend, RetrievalBackend
+from api.lazy import Lazy
+from api.telemetry import (ENCODE_SECONDS, RERANK_OUTCOMES, SEARCH_PHASE_SECONDS, CallbackMetric, MetricsMiddleware,
+                           registry, span)
+from api.rerank import CrossEncoderReranker, RerankScoreCache, text_digest
+from api.embeddings import (DEFAULT_EMBEDDING_MODEL, Embedder, EmbeddingModelMismatch, check_index_model,
+                            get_embedding_model)
 
 # Construct the path to the .env.local file
 dotenv_path = Path(__file__).resolve().parent.parent / '.env.local'
@@ -17,16 +37,108 @@ load_dotenv(dotenv_path=dotenv_path)
 ELASTIC_CLOUD_ID = os.getenv("ELASTIC_CLOUD_ID")
 ELASTIC_API_KEY = os.getenv("ELASTIC_API_KEY")
 ELASTIC_INDEX = os.getenv("ELASTIC_INDEX")
-
-if not all([ELASTIC_CLOUD_ID, ELASTIC_API_KEY, ELASTIC_INDEX]):
-    raise RuntimeError("Missing required environment variables for Elasticsearch")
-
-es = Elasticsearch(
-    cloud_id=ELASTIC_CLOUD_ID,
-    api_key=ELASTIC_API_KEY
-)
-
-app = FastAPI()
+# "elasticsearch" (default) or "local", an in-process index written by the indexer with --backend local
+RETRIEVAL_BACKEND = os.getenv("RETRIEVAL_BACKEND", "elasticsearch")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR",
+                            str(Path(__file__).resolve().parent.parent / ".local_index" / (ELASTIC_INDEX or "rag_documents")))
+# Pooled connections shared by every request; size it to the expected concurrency
+ELASTIC_MAX_CONNECTIONS = int(os.getenv("ELASTIC_MAX_CONNECTIONS", "32"))
+# Registry name from api/embeddings.py; must match the model the index was built with.
+# The model is loaded on the first search (or warmup), not at import.
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+# "sentence-transformers" (torch) or "fastembed" (ONNX Runtime, as in the indexer)
+QUERY_EMBEDDING_RUNTIME = os.getenv("QUERY_EMBEDDING_RUNTIME", "sentence-transformers")
+QUERY_ONNX_THREADS = int(os.environ["QUERY_ONNX_THREADS"]) if os.getenv("QUERY_ONNX_THREADS") else None
+# Load the model and open the backend in the background as soon as the app starts. Leave off
+# for serverless, where OAuth and Drive requests should not pay for a model they never use.
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+# Threads dedicated to query encoding, so CPU-bound model calls never run on the event loop
+EMBEDDING_WORKERS = int(os.getenv("EMBEDDING_WORKERS", "2"))
+# Concurrent queries are encoded together: up to this many per batch, waiting at most this long
+EMBEDDING_MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "32"))
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+# Query embedding and search result caches. "redis" shares them between uvicorn workers.
+SEARCH_CACHE_BACKEND = os.getenv("SEARCH_CACHE_BACKEND", "local")
+SEARCH_CACHE_REDIS_URL = os.getenv("SEARCH_CACHE_REDIS_URL", "redis://localhost:6379/0")
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+INDEX_VERSION_CHECK_SECONDS = float(os.getenv("INDEX_VERSION_CHECK_SECONDS", "30"))
+# "knn" is vector-only; "hybrid" (opt-in per request or here) fuses BM25 on chunk_text with kNN using
+# reciprocal rank fusion, whose scores are rank-based (about 1/60 per list) rather than cosine similarities
+SEARCH_DEFAULT_MODE = os.getenv("SEARCH_DEFAULT_MODE", "knn")
+RRF_RANK_CONSTANT = int(os.getenv("RRF_RANK_CONSTANT", "60"))
+# Oversampling factor for re-scoring kNN hits on raw vectors when chunk_vector is quantized
+SEARCH_RESCORE_OVERSAMPLE = float(os.environ["SEARCH_RESCORE_OVERSAMPLE"]) if os.getenv("SEARCH_RESCORE_OVERSAMPLE") else None
+# Largest context_window /api/search/stream accepts, in chunks on each side of a hit
+SEARCH_CONTEXT_MAX_WINDOW = int(os.getenv("SEARCH_CONTEXT_MAX_WINDOW", "3"))
+# Cross-encoder re-ranking of the top candidates; requests opt in with "rerank": true, or SEARCH_RERANK
+# makes it the default. RERANK_MODEL defaults to a MiniLM MS MARCO cross-encoder for the runtime.
+SEARCH_RERANK = os.getenv("SEARCH_RERANK", "false").lower() == "true"
+RERANK_RUNTIME = os.getenv("RERANK_RUNTIME", QUERY_EMBEDDING_RUNTIME)
+RERANK_MODEL = os.getenv("RERANK_MODEL") or None
+RERANK_ONNX_THREADS = int(os.environ["RERANK_ONNX_THREADS"]) if os.getenv("RERANK_ONNX_THREADS") else None
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+# Past the budget a search keeps retrieval order; scoring finishes in the background and lands in the cache
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "250"))
+# Scoring calls at once (including ones finishing past their budget); further searches skip re-ranking
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", "1"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "2048"))
+RERANK_CACHE_TTL_SECONDS = float(os.getenv("RERANK_CACHE_TTL_SECONDS", "86400"))
+# Scored (query, chunk) pairs kept per query; a query's pairs are read and written as one entry
+RERANK_CACHE_MAX_PAIRS = int(os.getenv("RERANK_CACHE_MAX_PAIRS", "256"))
+FILE_CATALOG_PAGE_SIZE = int(os.getenv("FILE_CATALOG_PAGE_SIZE", "500"))
+FILE_CATALOG_MAX_PAGE_SIZE = 5000
+# Drive's maximum page size for files.list
+DRIVE_PAGE_SIZE = 1000
+
+# Configuration is validated here; models and clients are only created on first use
+try:
+    embedder = Embedder(get_embedding_model(EMBEDDING_MODEL), QUERY_EMBEDDING_RUNTIME, QUERY_ONNX_THREADS)
+    reranker = CrossEncoderReranker(RERANK_MODEL, RERANK_RUNTIME, RERANK_ONNX_THREADS)
+except ValueError as e:
+    raise RuntimeError(str(e))
+
+if RETRIEVAL_BACKEND == "local":
+    INDEX_NAME = LOCAL_INDEX_DIR
+elif RETRIEVAL_BACKEND == "elasticsearch":
+    if not all([ELASTIC_CLOUD_ID, ELASTIC_API_KEY, ELASTIC_INDEX]):
+        raise RuntimeError("Missing required environment variables for Elasticsearch")
+    INDEX_NAME = ELASTIC_INDEX
+else:
+    raise RuntimeError(f"Unknown RETRIEVAL_BACKEND '{RETRIEVAL_BACKEND}'. Use 'elasticsearch' or 'local'.")
+
+def create_backend() -> RetrievalBackend:
+    if RETRIEVAL_BACKEND == "local":
+        return LocalBackend(Path(LOCAL_INDEX_DIR))
+    return ElasticsearchBackend(ELASTIC_CLOUD_ID, ELASTIC_API_KEY, ELASTIC_INDEX, ELASTIC_MAX_CONNECTIONS)
+
+backend: Lazy[RetrievalBackend] = Lazy(create_backend)
+
+async def get_backend() -> RetrievalBackend:
+    # The first call imports and builds the client; keep that off the event loop
+    if not backend.loaded:
+        await run_in_threadpool(backend.get)
+    return backend.get()
+
+embedding_executor = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS, thread_name_prefix="embed")
+rerank_executor = ThreadPoolExecutor(max_workers=RERANK_WORKERS, thread_name_prefix="rerank")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    warmup_task = asyncio.create_task(warmup()) if WARMUP_ON_STARTUP else None
+    yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await query_batcher.stop()
+    if backend.loaded:
+        await backend.get().close()
+    embedding_executor.shutdown(wait=False)
+    rerank_executor.shutdown(wait=False)
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 # Secret key for signing session data
 # In a production application, this should be a long, random string stored securely
@@ -35,6 +147,24 @@ serializer = URLSafeSerializer(SECRET_KEY)
 
 class SearchQuery(BaseModel):
     query: str
+    mode: Literal["knn", "hybrid"] = SEARCH_DEFAULT_MODE
+    k: int = Field(10, ge=1, le=100)
+    num_candidates: int = Field(100, ge=1, le=10000)
+    size: int = Field(10, ge=1, le=100)
+    path: str | None = None
+    file_name: str | None = None
+    rescore_oversample: float | None = Field(SEARCH_RESCORE_OVERSAMPLE, ge=1.0, le=10.0)
+    # Re-rank this many retrieved candidates with the cross-encoder, then keep the top size
+    rerank: bool = SEARCH_RERANK
+    rerank_candidates: int = Field(RERANK_CANDIDATES, ge=1, le=200)
+    # Also return each hit's full chunk text as chunkText, which the snippet is only a highlight of
+    chunk_text: bool = False
+
+    @model_validator(mode="after")
+    def check_candidates(self):
+        if self.num_candidates < self.k:
+            raise ValueError("num_candidates must be greater than or equal to k")
+        return self
 
 class Source(BaseModel):
     id: str
@@ -58,7 +188,7 @@ async def auth_google_callback(request: Request, state: str = Cookie(None)):
         raise HTTPException(status_code=400, detail="State mismatch")
 
     flow = get_google_flow()
-    flow.fetch_token(authorization_response=str(request.url))
+    await run_in_threadpool(flow.fetch_token, authorization_response=str(request.url))
     
     credentials = flow.credentials
     
@@ -81,7 +211,12 @@ def credentials_to_dict(credentials):
             'scopes': credentials.scopes}
 
 @app.get("/api/drive/files")
-async def list_drive_files(credentials: str = Cookie(None)):
+async def list_drive_files(limit: int | None = None, cursor: str | None = None, credentials: str = Cookie(None)):
+    """Lists the user's Google Docs and Sheets.
+
+    With ``limit`` or ``cursor`` a single page is returned together with a ``nextCursor``.
+    Without either, every page of the listing is followed and the files are returned as a JSON array.
+    """
     if not credentials:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
@@ -91,15 +226,15 @@ async def list_drive_files(credentials: str = Cookie(None)):
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    drive_service = get_drive_service(creds)
+    drive_service = await run_in_threadpool(get_drive_service, creds)
 
     try:
-        results = drive_service.files().list(
-            q="mimeType='application/vnd.google-apps.document' or mimeType='application/vnd.google-apps.spreadsheet'",
-            pageSize=100, 
-            fields="nextPageToken, files(id, name, mimeType, modifiedTime)").execute()
-        items = results.get('files', [])
-        return items
+        query = mime_type_query(DRIVE_DOCUMENT_TYPES)
+        if limit is not None or cursor is not None:
+            page_size = min(max(limit or DRIVE_PAGE_SIZE, 1), DRIVE_PAGE_SIZE)
+            files, next_token = await run_in_threadpool(list_drive_page, drive_service, query, page_size, cursor)
+            return {"files": files, "nextCursor": next_token}
+        return await run_in_threadpool(lambda: list(iter_drive_files(drive_service, query, DRIVE_PAGE_SIZE)))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -114,10 +249,11 @@ async def get_drive_file(file_id: str, credentials: str = Cookie(None)):
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    drive_service = get_drive_service(creds)
+    drive_service = await run_in_threadpool(get_drive_service, creds)
 
     try:
-        file_metadata = drive_service.files().get(fileId=file_id).execute()
+        file_metadata = await run_in_threadpool(drive_service.files().get(fileId=file_id).execute,
+                                                 num_retries=GOOGLE_API_RETRIES)
         mime_type = file_metadata.get('mimeType')
 
         if mime_type == 'application/vnd.google-apps.document':
@@ -127,13 +263,17 @@ async def get_drive_file(file_id: str, credentials: str = Cookie(None)):
         else:
             request = drive_service.files().get_media(fileId=file_id)
         
-        file_content = request.execute()
+        file_content = await run_in_threadpool(request.execute, num_retries=GOOGLE_API_RETRIES)
         return {"content": file_content.decode('utf-8')}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/sheets/export")
-async def export_to_sheets(request: Request, credentials: str = Cookie(None)):
+async def export_to_sheets(request: Request, background_tasks: BackgroundTasks, credentials: str = Cookie(None)):
+    """Creates the spreadsheet and returns its URL at once; the rows are written by a background task.
+
+    Poll ``statusUrl`` for progress. The body is spooled while it is received, never parsed whole.
+    """
     if not credentials:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
@@ -143,115 +283,439 @@ async def export_to_sheets(request: Request, credentials: str = Cookie(None)):
     except Exception:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    sheets_service = get_sheets_service(creds)
-    data = await request.json()
-    table_data = data.get('tableData')
-
+    body = tempfile.SpooledTemporaryFile(max_size=SHEETS_EXPORT_SPOOL_BYTES)
     try:
-        spreadsheet = {
-            'properties': {
-                'title': 'Exported Table Data'
-            }
-        }
-        spreadsheet = sheets_service.spreadsheets().create(body=spreadsheet,
-                                                    fields='spreadsheetId,spreadsheetUrl').execute()
-        
-        body = {
-            'values': table_data
-        }
-        result = sheets_service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet.get('spreadsheetId'),
-            range='A1',
-            valueInputOption='RAW',
-            body=body).execute()
-
-        return {"sheetUrl": spreadsheet.get('spreadsheetUrl')}
+        async for block in request.stream():
+            body.write(block)
+        body.seek(0)
+        sheets_service = await run_in_threadpool(get_sheets_service, creds)
+        spreadsheet = await run_in_threadpool(create_spreadsheet, sheets_service, 'Exported Table Data')
     except Exception as e:
+        body.close()
         raise HTTPException(status_code=500, detail=str(e))
 
-from sentence_transformers import SentenceTransformer
+    job = export_jobs.create(service_cache.key(creds), spreadsheet)
+    background_tasks.add_task(run_export, sheets_service, job, spreadsheet, body)
+    return {"sheetUrl": job.sheet_url, "exportId": job.export_id, "statusUrl": f"/api/sheets/export/{job.export_id}"}
 
-# ... (existing code) ...
+@app.get("/api/sheets/export/{export_id}")
+async def export_status(export_id: str, credentials: str = Cookie(None)):
+    if not credentials:
+        raise HTTPException(status_code=401, detail="Not authenticated")
 
-embedding_model = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
+    try:
+        creds = Credentials(**serializer.loads(credentials))
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
 
-# ... (existing code) ...
+    job = export_jobs.get(export_id)
+    # Jobs live in this instance's memory; another user's job is reported as missing too
+    if job is None or job.owner != service_cache.key(creds):
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job.to_dict()
+
+# embed_queries runs on the embedding executor, so the first call loads the model off the event loop
+query_batcher = QueryEmbeddingBatcher(
+    embedder.embed_queries,
+    embedding_executor,
+    max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+    max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+    max_in_flight=EMBEDDING_WORKERS
+)
 
-import logging
+if SEARCH_CACHE_BACKEND == "redis":
+    search_cache = SearchCache(
+        RedisCache(SEARCH_CACHE_REDIS_URL, "search:embeddings", EMBEDDING_CACHE_TTL_SECONDS),
+        RedisCache(SEARCH_CACHE_REDIS_URL, "search:results", RESULT_CACHE_TTL_SECONDS),
+        embedder.model.fingerprint
+    )
+else:
+    search_cache = SearchCache(
+        LocalTTLCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS),
+        LocalTTLCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL_SECONDS),
+        embedder.model.fingerprint
+    )
 
-# ... (existing code) ...
+if SEARCH_CACHE_BACKEND == "redis":
+    rerank_cache = RerankScoreCache(RedisCache(SEARCH_CACHE_REDIS_URL, "search:rerank", RERANK_CACHE_TTL_SECONDS),
+                                    reranker.model_id, RERANK_CACHE_MAX_PAIRS)
+else:
+    rerank_cache = RerankScoreCache(LocalTTLCache(RERANK_CACHE_SIZE, RERANK_CACHE_TTL_SECONDS), reranker.model_id,
+                                    RERANK_CACHE_MAX_PAIRS)
+# Scoring calls running on rerank_executor, including ones that outlived their search's budget
+rerank_in_flight = 0
+
+# Set while the index reports a different embedding model than the one encoding queries
+index_model_error: str | None = None
+
+# The indexer stamps a new index_version after every run that changes the index, and the model it used
+async def fetch_index_version() -> str:
+    global index_model_error
+    meta = await (await get_backend()).index_meta()
+    try:
+        check_index_model(embedder.model, meta)
+        index_model_error = None
+    except EmbeddingModelMismatch as e:
+        logging.error(str(e))
+        index_model_error = str(e)
+    return str(meta.get("index_version", "0"))
+
+index_version = IndexVersionTracker(fetch_index_version, search_cache, INDEX_VERSION_CHECK_SECONDS)
+
+async def encode_query(text: str) -> list[float]:
+    """Encodes a query in a shared batch on the embedding executor, off the event loop."""
+    vector = await search_cache.get_embedding(text)
+    if vector is None:
+        start = time.perf_counter()
+        with span("embedding.encode"):
+            vector = await query_batcher.encode(text)
+        ENCODE_SECONDS.observe(time.perf_counter() - start)
+        await search_cache.set_embedding(text, vector)
+    return vector
+
+async def warmup() -> dict:
+    """Loads the query model, runs one encode and opens the backend; returns the time each took."""
+    timings = {}
+    start = time.perf_counter()
+    await query_batcher.encode("warmup")
+    timings["encodeMs"] = 1000 * (time.perf_counter() - start)
+    start = time.perf_counter()
+    await index_version.current()
+    timings["backendMs"] = 1000 * (time.perf_counter() - start)
+    if SEARCH_RERANK:
+        start = time.perf_counter()
+        await asyncio.get_running_loop().run_in_executor(rerank_executor, reranker.load)
+        timings["rerankMs"] = 1000 * (time.perf_counter() - start)
+    if index_model_error:
+        raise RuntimeError(index_model_error)
+    logging.info(f"Warmup finished: {timings}")
+    return timings
+
+@app.get("/api/warmup")
+async def warmup_endpoint():
+    """Pre-warms an instance, e.g. from a scheduled ping, so the first real search is fast."""
+    try:
+        return await warmup()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/search")
-async def search_documents(query: SearchQuery):
+@app.get("/api/embedding/stats")
+async def embedding_stats():
+    return {
+        **query_batcher.stats(),
+        "model": embedder.model.model_id,
+        "runtime": embedder.runtime,
+        "modelLoaded": embedder.loaded,
+        "modelLoadSeconds": embedder.load_seconds,
+        "indexModelError": index_model_error,
+    }
+
+@app.get("/api/rerank/stats")
+async def rerank_stats():
+    return {
+        "model": reranker.model_id,
+        "runtime": reranker.runtime,
+        "modelLoaded": reranker.loaded,
+        "modelLoadSeconds": reranker.load_seconds,
+        "defaultEnabled": SEARCH_RERANK,
+        "budgetMs": RERANK_BUDGET_MS,
+        "inFlight": rerank_in_flight,
+        "pairCache": rerank_cache.stats(),
+    }
+
+def cache_counts() -> dict[tuple[str, str], float]:
+    return {(level, result): counts[key] for level, counts in search_cache.counters.items()
+            for result, key in (("hit", "hits"), ("miss", "misses"))}
+
+CallbackMetric("search_cache_requests_total", "Search cache lookups by level and outcome.", "counter",
+               ("level", "result"), cache_counts)
+CallbackMetric("embedding_model_loaded", "1 once the query embedding model is loaded.", "gauge", (),
+               lambda: {(): float(embedder.loaded)})
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus text exposition of this process's metrics."""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    return {**search_cache.stats(), "indexVersion": index_version.version, "googleServices": service_cache.stats(),
+            "sheetsExports": export_jobs.stats()}
+
+def server_timing(timings: dict[str, float], cache: str, rerank: str | None = None) -> str:
+    """Server-Timing header value: per-phase milliseconds, whether results came from the cache and,
+    for re-ranked searches, how re-ranking went."""
+    entries = [*(f"{name};dur={ms:.2f}" for name, ms in timings.items()), f'cache;desc="{cache}"']
+    if rerank:
+        entries.append(f'reranked;desc="{rerank}"')
+    return ", ".join(entries)
+
+def record_timings(response: Response, timings: dict[str, float], cache: str, rerank: str | None = None) -> None:
+    for phase, ms in timings.items():
+        SEARCH_PHASE_SECONDS.observe(ms / 1000, phase=phase)
+    response.headers["Server-Timing"] = server_timing(timings, cache, rerank)
+
+def shape_hit(hit: dict, chunk_text: bool = False) -> dict | None:
+    """One search result: the hit's source, its highlight (or chunk text), score and, when asked, the
+    full chunk text; None without text."""
+    content_snippet = hit.get("highlight", {}).get("chunk_text", [hit["_source"].get("chunk_text", "")])[0]
+    if not content_snippet:
+        return None
+    return {
+        "source": {
+            "id": hit["_id"],
+            "fileName": hit["_source"].get("file_name", ""),
+            "path": hit["_source"].get("path", "")
+        },
+        "contentSnippet": content_snippet,
+        "score": hit["_score"],
+        **({"chunkText": hit["_source"].get("chunk_text", "")} if chunk_text else {}),
+        **({"rerankScore": hit["_rerank_score"]} if "_rerank_score" in hit else {})
+    }
+
+async def prepare_search(query: SearchQuery, timings: dict[str, float]) -> tuple[list[float], dict, str]:
+    """Encodes the query and resolves the index version; returns the vector, cache key params and version."""
+    start = time.perf_counter()
+    with span("search.encode"):
+        query_vector = await encode_query(query.query)
+    timings["encode"] = 1000 * (time.perf_counter() - start)
+    search_params = query.model_dump(include=set(SearchQuery.model_fields) - {"query"})
+    if query.mode == "hybrid":
+        # The lexical half depends on the raw text, not just its vector
+        search_params["text"] = query.query
+    start = time.perf_counter()
+    version = await index_version.current()
+    timings["version"] = 1000 * (time.perf_counter() - start)
+    if index_model_error:
+        # Vectors from another model would rank silently wrong; refuse instead
+        raise HTTPException(status_code=503, detail=index_model_error)
+    return query_vector, search_params, version
+
+async def score_pairs(query_text: str, texts: dict[str, str]) -> dict[str, float] | None:
+    """Scores texts (by digest) against the query in one batch on the re-rank executor and caches
+    the scores; None if scoring failed."""
+    global rerank_in_flight
+    rerank_in_flight += 1
     try:
-        query_vector = embedding_model.encode(query.query).tolist()
-
-        search_body = {
-            "knn": {
-                "field": "chunk_vector",
-                "query_vector": query_vector,
-                "k": 10,
-                "num_candidates": 100
-            },
-            "_source": ["fileName", "path", "chunk_text"],
-            "highlight": {
-                "fields": { "chunk_text": {} },
-                "fragment_size": 150,
-                "number_of_fragments": 1
-            }
-        }
-
-        response = es.search(
-            index=ELASTIC_INDEX,
-            body=search_body
+        with span("search.rerank.score", **{"rerank.pairs": len(texts)}):
+            scores = await asyncio.get_running_loop().run_in_executor(
+                rerank_executor, reranker.score, query_text, list(texts.values()))
+        scores = dict(zip(texts, scores))
+        await rerank_cache.set(query_text, scores)
+        return scores
+    except Exception as e:
+        logging.error(f"Re-ranking {len(texts)} candidates failed: {e}")
+        return None
+    finally:
+        rerank_in_flight -= 1
+
+async def rerank_hits(query: SearchQuery, hits: list[dict], timings: dict[str, float]) -> tuple[list[dict], str]:
+    """Orders hits by cross-encoder score; returns them with the outcome. On timeout, error or
+    a busy re-ranker the retrieval order is kept."""
+    start = time.perf_counter()
+    digests = [text_digest(hit["_source"].get("chunk_text", "")) for hit in hits]
+    scores = await rerank_cache.get(query.query, digests)
+    missing = {digest: hit["_source"]["chunk_text"] for digest, hit in zip(digests, hits)
+               if digest not in scores and hit["_source"].get("chunk_text")}
+    outcome = "cached"
+    if missing and rerank_in_flight >= RERANK_WORKERS:
+        outcome = "busy"
+    elif missing:
+        # Shielded so a search past its budget leaves the scores to the cache rather than wasting them
+        scoring = asyncio.ensure_future(score_pairs(query.query, missing))
+        try:
+            scored = await asyncio.wait_for(asyncio.shield(scoring), RERANK_BUDGET_MS / 1000)
+            outcome = "applied" if scored is not None else "error"
+            scores.update(scored or {})
+        except asyncio.TimeoutError:
+            outcome = "timeout"
+    timings["rerank"] = 1000 * (time.perf_counter() - start)
+    RERANK_OUTCOMES.inc(outcome=outcome)
+    if outcome not in ("applied", "cached"):
+        return hits, outcome
+    for digest, hit in zip(digests, hits):
+        hit["_rerank_score"] = scores.get(digest, float("-inf"))
+    # Stable, so equal scores keep their retrieval order
+    return sorted(hits, key=lambda hit: hit["_rerank_score"], reverse=True), outcome
+
+async def fetch_hits(query: SearchQuery, query_vector: list[float],
+                     timings: dict[str, float]) -> tuple[list[dict], str | None]:
+    """Runs the backend search, fuses hybrid hit lists and optionally re-ranks the top candidates;
+    returns at most query.size ranked hits and the re-ranking outcome (None when not asked for)."""
+    candidates = max(query.size, query.rerank_candidates) if query.rerank else query.size
+    k = max(query.k, candidates)
+    start = time.perf_counter()
+    with span("search.backend", **{"search.mode": query.mode, "search.k": k,
+                                   "search.num_candidates": query.num_candidates}):
+        hit_lists = await (await get_backend()).search(
+            query_vector,
+            query.query if query.mode == "hybrid" else None,
+            k,
+            max(query.num_candidates, k),
+            path=query.path,
+            file_name=query.file_name,
+            rescore_oversample=query.rescore_oversample
         )
+    timings["backend"] = 1000 * (time.perf_counter() - start)
+    hits = reciprocal_rank_fusion(hit_lists, RRF_RANK_CONSTANT) if len(hit_lists) > 1 else hit_lists[0]
+    hits = hits[:candidates]
+    if not query.rerank:
+        return hits, None
+    hits, outcome = await rerank_hits(query, hits, timings)
+    return hits[:query.size], outcome
+
+def cacheable(rerank: str | None) -> bool:
+    # Results that fell back to retrieval order are not cached, so the next search gets another try
+    return rerank in (None, "applied", "cached")
 
-        results = []
-        for hit in response["hits"]["hits"]:
-            logging.info(f"hit: {hit}")
-            content_snippet = hit.get("highlight", {}).get("chunk_text", [hit["_source"].get("chunk_text", "")])[0]
-            logging.info(f"content_snippet: {content_snippet}")
-            if content_snippet:
-                results.append({
-                    "source": {
-                        "id": hit["_id"],
-                        "fileName": hit["_source"].get("fileName", ""),
-                        "path": hit["_source"].get("path", "")
-                    },
-                    "contentSnippet": content_snippet,
-                    "score": hit["_score"]
-                })
+@app.post("/api/search")
+async def search_documents(query: SearchQuery, response: Response):
+    timings = {}
+    try:
+        query_vector, search_params, version = await prepare_search(query, timings)
+        cached = await search_cache.get_results(query_vector, search_params, INDEX_NAME, version)
+        if cached is not None:
+            record_timings(response, timings, "hit")
+            return cached
+
+        hits, rerank = await fetch_hits(query, query_vector, timings)
+        start = time.perf_counter()
+        results = [result for hit in hits if (result := shape_hit(hit, query.chunk_text)) is not None]
+        timings["shape"] = 1000 * (time.perf_counter() - start)
+        if cacheable(rerank):
+            await search_cache.set_results(query_vector, search_params, INDEX_NAME, version, results)
+        record_timings(response, timings, "miss", rerank)
         return results
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/files/{file_id}")
+class StreamSearchQuery(SearchQuery):
+    # Neighbouring chunks on each side of every hit, sent after all hits; 0 skips the context phase
+    context_window: int = Field(0, ge=0, le=SEARCH_CONTEXT_MAX_WINDOW)
+
+def stream_event(event: str, data, format: str) -> str:
+    if format == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+@app.post("/api/search/stream")
+async def stream_search(query: StreamSearchQuery, format: str = "sse"):
+    """Streams search results as server-sent events (``format=sse``) or NDJSON (``format=ndjson``).
+
+    Each result is sent as a ``hit`` event as soon as it is shaped. With ``context_window`` a
+    ``context`` event per hit follows, holding the neighbouring chunks of its document. A final
+    ``done`` event carries the phase timings; a failure after the first event is sent as an
+    ``error`` event, since the status line has already gone out. Re-ranking, when asked for, runs
+    before the first ``hit``. The body is POSTed, so browsers
+    read the stream with fetch rather than EventSource.
+    """
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'sse' or 'ndjson'")
+    timings = {}
+    try:
+        # Everything that can fail with a status code happens before the stream starts
+        query_vector, search_params, version = await prepare_search(query, timings)
+        results = await search_cache.get_results(query_vector, search_params, INDEX_NAME, version)
+        cache = "miss" if results is None else "hit"
+        hits, rerank = await fetch_hits(query, query_vector, timings) if results is None else (None, None)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def events():
+        nonlocal results
+        try:
+            start = time.perf_counter()
+            if hits is not None:
+                results = []
+                for hit in hits:
+                    result = shape_hit(hit, query.chunk_text)
+                    if result is not None:
+                        results.append(result)
+                        yield stream_event("hit", result, format)
+                timings["shape"] = 1000 * (time.perf_counter() - start)
+                if cacheable(rerank):
+                    await search_cache.set_results(query_vector, search_params, INDEX_NAME, version, results)
+            else:
+                for result in results:
+                    yield stream_event("hit", result, format)
+
+            if query.context_window and results:
+                start = time.perf_counter()
+                with span("search.context", **{"search.context_window": query.context_window}):
+                    neighbors = await (await get_backend()).neighbor_chunks(
+                        [result["source"]["id"] for result in results], query.context_window)
+                timings["context"] = 1000 * (time.perf_counter() - start)
+                for result in results:
+                    chunk_id = result["source"]["id"]
+                    if chunk_id in neighbors:
+                        yield stream_event("context", {"id": chunk_id, "chunks": neighbors[chunk_id]}, format)
+
+            for phase, ms in timings.items():
+                SEARCH_PHASE_SECONDS.observe(ms / 1000, phase=phase)
+            yield stream_event("done", {"count": len(results), "cache": cache, "rerank": rerank,
+                                        "timings": {phase: round(ms, 2) for phase, ms in timings.items()}}, format)
+        except Exception as e:
+            logging.error(f"Search stream failed: {e}")
+            yield stream_event("error", {"detail": str(e)}, format)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    # no-transform and X-Accel-Buffering keep proxies from buffering the stream into one response
+    return StreamingResponse(events(), media_type=media_type, headers={
+        "Cache-Control": "no-cache, no-transform",
+        "X-Accel-Buffering": "no",
+        "Server-Timing": server_timing(timings, cache, rerank)
+    })
+
+# Document IDs are derived from file keys, so Drive and subfolder files carry slashes
+@app.get("/api/files/{file_id:path}")
 async def get_file_content(file_id: str):
     try:
-        response = es.get(index=ELASTIC_INDEX, id=file_id)
-        return {"content": response["_source"].get("content", "Content not found")}
+        document = await (await get_backend()).get_document(file_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if document is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    return {"content": document.get("content") or "Content not found"}
 
 @app.get("/api/files")
-async def get_all_files():
+async def get_all_files(limit: int | None = None, cursor: str | None = None, format: str = "json"):
+    """Lists indexed files.
+
+    With ``limit`` a single page is returned together with a ``nextCursor`` to pass back as
+    ``cursor``. With ``format=ndjson`` every file is streamed as one JSON object per line.
+    Without either, the full list is returned as a JSON array.
+    """
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'ndjson'")
+
+    if format == "ndjson":
+        async def stream_files():
+            try:
+                async for entry in (await get_backend()).iter_files(FILE_CATALOG_PAGE_SIZE):
+                    yield json.dumps(entry) + "\n"
+            except Exception as e:
+                # Headers are already sent, so the error can only be reported in-band
+                logging.error(f"File catalog stream failed: {e}")
+                yield json.dumps({"error": str(e)}) + "\n"
+        return StreamingResponse(stream_files(), media_type="application/x-ndjson")
+
     try:
-        response = es.search(
-            index=ELASTIC_INDEX,
-            body={
-                "size": 1000,
-                "query": { "match_all": {} },
-                "_source": ["fileName", "path"]
-            }
-        )
-        results = [
-            {
-                "id": hit["_id"],
-                "fileName": hit["_source"].get("fileName", ""),
-                "path": hit["_source"].get("path", "")
-            }
-            for hit in response["hits"]["hits"]
-        ]
-        return results
+        if limit is not None or cursor is not None:
+            page_size = min(max(limit or FILE_CATALOG_PAGE_SIZE, 1), FILE_CATALOG_MAX_PAGE_SIZE)
+            try:
+                search_after = decode_cursor(cursor) if cursor else None
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            files, next_after = await (await get_backend()).file_page(page_size, search_after)
+            return {"files": files, "nextCursor": encode_cursor(next_after) if next_after else None}
+
+        retrieval = await get_backend()
+        return [entry async for entry in retrieval.iter_files(FILE_CATALOG_PAGE_SIZE)]
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,100 @@
+import time
+import asyncio
+import logging
+from concurrent.futures import Executor
+from typing import Callable, Sequence
+
+
+class QueryEmbeddingBatcher:
+    """Collects concurrent query encodes into one batched model call.
+
+    A request waits at most max_wait_ms for others to join its batch; a batch is sent as soon
+    as it reaches max_batch_size. Batches run on the given executor, so several can be in
+    flight while the next one is being collected.
+    """
+
+    def __init__(self, encode_batch: Callable[[list[str]], Sequence], executor: Executor,
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0, max_in_flight: int = 2):
+        self.encode_batch = encode_batch
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.max_in_flight = max_in_flight
+        self.batches = 0
+        self.items = 0
+        self.encode_seconds = 0.0
+        self._queue = None
+        self._worker = None
+        self._in_flight = None
+
+    def start(self) -> None:
+        """Starts the collector task on the running event loop. Safe to call more than once."""
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._worker = asyncio.get_running_loop().create_task(self._collect())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def encode(self, text: str) -> list[float]:
+        """Encodes one query as part of whichever batch it lands in."""
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avgBatchSize": self.items / self.batches if self.batches else 0.0,
+            # Share of batch capacity actually used; low values mean the wait window is too short
+            "fillRate": self.items / (self.batches * self.max_batch_size) if self.batches else 0.0,
+            "avgEncodeMs": 1000 * self.encode_seconds / self.batches if self.batches else 0.0,
+            "maxBatchSize": self.max_batch_size,
+            "maxWaitMs": self.max_wait * 1000,
+        }
+
+    async def _collect(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._in_flight.acquire()
+            loop.create_task(self._run(batch))
+
+    async def _run(self, batch: list) -> None:
+        texts = [text for text, _ in batch]
+        start = time.perf_counter()
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(self.executor, self.encode_batch, texts)
+        except Exception as e:
+            logging.error(f"Batched query encoding failed for {len(texts)} queries: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._in_flight.release()
+        self.encode_seconds += time.perf_counter() - start
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), vector in zip(batch, vectors):
+            # The caller may have gone away (client disconnect cancels its future)
+            if not future.done():
+                future.set_result(vector.tolist())
@@ -0,0 +1,108 @@
+"""Cross-encoder re-ranking of retrieved chunks.
+
+A cross-encoder reads the query and a chunk together, which ranks much better than comparing
+two independently computed vectors but costs a model pass per pair. It is only run over the
+top candidates of a search, in one batched call, and its scores are cached per (query, chunk
+text) pair so repeated and overlapping searches skip the model. The query is the model's input,
+so scores are keyed on its exact text.
+"""
+import logging
+import hashlib
+from typing import Any
+from api.lazy import Lazy
+from api.cache import CacheBackend
+from api.embeddings import EMBEDDING_RUNTIMES
+
+# Small MS MARCO cross-encoders that run comfortably on CPU; the runtimes name the same model differently
+DEFAULT_RERANK_MODELS = {
+    "fastembed": "Xenova/ms-marco-MiniLM-L-6-v2",
+    "sentence-transformers": "cross-encoder/ms-marco-MiniLM-L-6-v2",
+}
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:20]
+
+
+class CrossEncoderReranker:
+    """Scores (query, passage) pairs with a cross-encoder, loaded on first use (or by load())."""
+
+    def __init__(self, model_id: str | None = None, runtime: str = "fastembed", threads: int | None = None):
+        if runtime not in EMBEDDING_RUNTIMES:
+            raise ValueError(f"Unknown re-ranking runtime '{runtime}'. Use one of {', '.join(EMBEDDING_RUNTIMES)}.")
+        self.model_id = model_id or DEFAULT_RERANK_MODELS[runtime]
+        self.runtime = runtime
+        self.threads = threads
+        self._model = Lazy(self._load)
+
+    @property
+    def loaded(self) -> bool:
+        return self._model.loaded
+
+    @property
+    def load_seconds(self) -> float | None:
+        return self._model.load_seconds
+
+    def load(self) -> None:
+        self._model.get()
+
+    def score(self, query: str, texts: list[str]) -> list[float]:
+        """Relevance of each text to the query (higher is better), from a single batch."""
+        if not texts:
+            return []
+        model = self._model.get()
+        if self.runtime == "fastembed":
+            scores = model.rerank(query, texts, batch_size=len(texts))
+        else:
+            scores = model.predict([(query, text) for text in texts], batch_size=len(texts),
+                                   show_progress_bar=False)
+        return [float(score) for score in scores]
+
+    def _load(self):
+        logging.info(f"Loading re-ranking model '{self.model_id}' on {self.runtime}...")
+        if self.runtime == "sentence-transformers":
+            from sentence_transformers import CrossEncoder
+            return CrossEncoder(self.model_id)
+        try:
+            from fastembed.rerank.cross_encoder import TextCrossEncoder
+        except ImportError as e:
+            raise RuntimeError("The fastembed runtime requires the fastembed package") from e
+        return TextCrossEncoder(model_name=self.model_id, threads=self.threads)
+
+
+class RerankScoreCache:
+    """Cross-encoder scores keyed by query, then by chunk text digest.
+
+    All pairs of one query live in a single entry, so a search costs one lookup and one write
+    however many candidates it scores. An entry keeps the max_pairs most recently scored pairs,
+    which bounds what a popular query reads and rewrites on every search.
+    """
+
+    def __init__(self, backend: CacheBackend, model_id: str, max_pairs: int = 256):
+        self.backend = backend
+        self.model_id = model_id
+        self.max_pairs = max_pairs
+        self.counters = {"hits": 0, "misses": 0}
+
+    async def get(self, query: str, digests: list[str]) -> dict[str, float]:
+        """Cached scores of the given text digests; missing pairs are left out."""
+        entry = await self.backend.get(self._key(query)) or {}
+        scores = {digest: entry[digest] for digest in digests if digest in entry}
+        self.counters["hits"] += len(scores)
+        self.counters["misses"] += len(set(digests)) - len(scores)
+        return scores
+
+    async def set(self, query: str, scores: dict[str, float]) -> None:
+        key = self._key(query)
+        entry: dict[str, Any] = await self.backend.get(key) or {}
+        # Re-scored pairs move to the end, so the oldest pairs are the ones dropped
+        merged = {digest: score for digest, score in entry.items() if digest not in scores}
+        merged.update(scores)
+        await self.backend.set(key, dict(list(merged.items())[-self.max_pairs:]))
+
+    def stats(self) -> dict:
+        total = self.counters["hits"] + self.counters["misses"]
+        return {**self.counters, "hitRate": self.counters["hits"] / total if total else 0.0}
+
+    def _key(self, query: str) -> str:
+        return f"rerank:{self.model_id}:{hashlib.sha1(query.encode('utf-8')).hexdigest()}"
@@ -0,0 +1,76 @@
+HIGHLIGHT = {
+    "fields": {"chunk_text": {}},
+    "fragment_size": 150,
+    "number_of_fragments": 1
+}
+SEARCH_SOURCE = ["file_name", "path", "chunk_text", "parent_id"]
+
+
+def chunk_filters(path: str | None = None, file_name: str | None = None) -> list[dict]:
+    """Filters restricting a search to chunks, optionally under one folder or for one file."""
+    filters = [{"term": {"doc_type": "chunk"}}]
+    if path:
+        # Match the folder itself and everything below it
+        filters.append({"bool": {"should": [
+            {"term": {"path": path}},
+            {"prefix": {"path": path.rstrip("/") + "/"}}
+        ], "minimum_should_match": 1}})
+    if file_name:
+        filters.append({"term": {"file_name": file_name}})
+    if not path and not file_name:
+        # Duplicate references only count when searching inside their own folder or file
+        filters.append({"bool": {"must_not": {"term": {"duplicate": True}}}})
+    return filters
+
+
+def knn_body(query_vector: list[float], k: int, num_candidates: int, filters: list[dict],
+             rescore_oversample: float | None = None) -> dict:
+    knn = {
+        "field": "chunk_vector",
+        "query_vector": query_vector,
+        "k": k,
+        "num_candidates": num_candidates,
+        "filter": filters
+    }
+    if rescore_oversample:
+        # For quantized indices: fetch k * oversample hits and re-rank them on the raw float vectors
+        knn["rescore_vector"] = {"oversample": rescore_oversample}
+    return {
+        "knn": knn,
+        "size": k,
+        "_source": SEARCH_SOURCE,
+        "highlight": HIGHLIGHT
+    }
+
+
+def lexical_body(query_text: str, size: int, filters: list[dict]) -> dict:
+    return {
+        "query": {"bool": {
+            "must": [{"match": {"chunk_text": query_text}}],
+            "filter": filters
+        }},
+        "size": size,
+        "_source": SEARCH_SOURCE,
+        "highlight": HIGHLIGHT
+    }
+
+
+def reciprocal_rank_fusion(hit_lists: list[list[dict]], rank_constant: int = 60) -> list[dict]:
+    """Fuses ranked Elasticsearch hit lists with RRF, mirroring utils/rrf.ts on the frontend.
+
+    Each returned hit carries its fused score in ``_score``; the first highlight found for a
+    hit is kept, so lexical highlights survive when the kNN hit has none.
+    """
+    scores = {}
+    fused = {}
+    for hits in hit_lists:
+        for rank, hit in enumerate(hits, start=1):
+            hit_id = hit["_id"]
+            scores[hit_id] = scores.get(hit_id, 0.0) + 1 / (rank_constant + rank)
+            if hit_id not in fused:
+                fused[hit_id] = dict(hit)
+            elif "highlight" not in fused[hit_id] and "highlight" in hit:
+                fused[hit_id]["highlight"] = hit["highlight"]
+    for hit_id, hit in fused.items():
+        hit["_score"] = scores[hit_id]
+    return sorted(fused.values(), key=lambda hit: hit["_score"], reverse=True)
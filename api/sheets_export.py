@@ -0,0 +1,256 @@
+"""Background export of large tables to Google Sheets.
+
+The request body is spooled to a temporary file while it is received, the spreadsheet is
+created and its URL returned at once, and the rows are then parsed from the spool one at a
+time and written in fixed-size batches by a background task whose progress can be polled.
+"""
+import os
+import json
+import time
+import uuid
+import codecs
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterator
+from api.google_drive import GOOGLE_API_RETRIES
+
+# Rows per values().update call; each call stays well under the Sheets request size limit
+SHEETS_EXPORT_BATCH_ROWS = int(os.getenv("SHEETS_EXPORT_BATCH_ROWS", "1000"))
+# Export jobs remembered for status polling; the oldest are forgotten first
+SHEETS_EXPORT_MAX_JOBS = int(os.getenv("SHEETS_EXPORT_MAX_JOBS", "256"))
+# Request bodies up to this size are spooled in memory, larger ones on disk
+SHEETS_EXPORT_SPOOL_BYTES = int(os.getenv("SHEETS_EXPORT_SPOOL_BYTES", str(4 * 1024 * 1024)))
+
+SHEET_TITLE = "Sheet1"
+READ_BLOCK_SIZE = 64 * 1024
+_WHITESPACE = " \t\r\n"
+
+
+class TableParseError(ValueError):
+    pass
+
+
+def iter_table_rows(body: BinaryIO, key: str = "tableData") -> Iterator[list]:
+    """Yields the rows of the array under key in a JSON object, reading body in blocks.
+
+    Only one row (plus one read block) is held at a time; other members of the object are
+    decoded whole and skipped.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        block = body.read(READ_BLOCK_SIZE)
+        eof = not block
+        buffer = buffer[pos:] + text_decoder.decode(block, final=eof)
+        pos = 0
+        return True
+
+    def next_char() -> str:
+        # The next non-whitespace character, without consuming it
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not fill():
+                raise TableParseError("Unexpected end of the request body")
+
+    def expect(char: str) -> None:
+        nonlocal pos
+        if next_char() != char:
+            raise TableParseError(f"Expected '{char}' in the request body")
+        pos += 1
+
+    def value():
+        nonlocal pos
+        next_char()
+        while True:
+            try:
+                decoded, end = decoder.raw_decode(buffer, pos)
+                # A number at the end of the buffer may continue in the next block
+                if end < len(buffer) or eof:
+                    pos = end
+                    return decoded
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise TableParseError(f"Invalid JSON in the request body: {e.msg}") from e
+            fill()
+
+    expect("{")
+    found = False
+    first = True
+    while next_char() != "}":
+        if not first:
+            expect(",")
+        first = False
+        member = value()
+        if not isinstance(member, str):
+            raise TableParseError("Expected an object key")
+        expect(":")
+        if member != key:
+            value()
+            continue
+        found = True
+        expect("[")
+        first_row = True
+        while next_char() != "]":
+            if not first_row:
+                expect(",")
+            first_row = False
+            row = value()
+            if not isinstance(row, list):
+                raise TableParseError(f"Every item of {key} must be an array of cells")
+            yield row
+        expect("]")
+    if not found:
+        raise TableParseError(f"The request body has no {key}")
+
+
+@dataclass
+class ExportJob:
+    export_id: str
+    owner: str
+    spreadsheet_id: str
+    sheet_url: str
+    status: str = "pending"
+    rows_written: int = 0
+    batches: int = 0
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "exportId": self.export_id,
+            "status": self.status,
+            "sheetUrl": self.sheet_url,
+            "rowsWritten": self.rows_written,
+            "batches": self.batches,
+            "error": self.error,
+            "seconds": round((self.finished_at or time.time()) - self.created_at, 3),
+        }
+
+
+class ExportJobs:
+    """In-process registry of recent export jobs, so status only works on the instance that ran the job."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, owner: str, spreadsheet: dict) -> ExportJob:
+        job = ExportJob(uuid.uuid4().hex, owner, spreadsheet["spreadsheetId"], spreadsheet["spreadsheetUrl"])
+        with self._lock:
+            self._jobs[job.export_id] = job
+            while len(self._jobs) > self.maxsize:
+                self._jobs.popitem(last=False)
+        return job
+
+    def get(self, export_id: str) -> ExportJob | None:
+        with self._lock:
+            return self._jobs.get(export_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return {status: sum(job.status == status for job in jobs) for status in ("pending", "running", "done", "failed")}
+
+
+export_jobs = ExportJobs(SHEETS_EXPORT_MAX_JOBS)
+
+
+def create_spreadsheet(sheets_service, title: str) -> dict:
+    """Creates an empty spreadsheet whose single sheet has a known ID and title."""
+    body = {
+        'properties': {'title': title},
+        'sheets': [{'properties': {'sheetId': 0, 'title': SHEET_TITLE}}]
+    }
+    return sheets_service.spreadsheets().create(
+        body=body,
+        fields='spreadsheetId,spreadsheetUrl,sheets(properties(gridProperties))'
+    ).execute(num_retries=GOOGLE_API_RETRIES)
+
+
+class SheetWriter:
+    """Writes rows to the sheet in batches at explicit ranges, so a retried call never duplicates rows.
+
+    values().update cannot write past the sheet grid, so the grid is grown ahead of the rows
+    (doubling, to keep resize calls rare) and trimmed to the rows written at the end.
+    """
+
+    def __init__(self, sheets_service, spreadsheet: dict, batch_rows: int = SHEETS_EXPORT_BATCH_ROWS):
+        self.service = sheets_service
+        self.spreadsheet_id = spreadsheet["spreadsheetId"]
+        grid = spreadsheet.get("sheets", [{}])[0].get("properties", {}).get("gridProperties", {})
+        self.row_count = grid.get("rowCount", 1000)
+        self.column_count = grid.get("columnCount", 26)
+        self.batch_rows = batch_rows
+        self.rows_written = 0
+
+    def write(self, rows: list[list]) -> None:
+        if not rows:
+            return
+        needed_rows = self.rows_written + len(rows)
+        needed_columns = max(len(row) for row in rows)
+        if needed_rows > self.row_count or needed_columns > self.column_count:
+            row_count = max(needed_rows, self.row_count * 2) if needed_rows > self.row_count else self.row_count
+            self._resize(row_count, max(needed_columns, self.column_count))
+        self.service.spreadsheets().values().update(
+            spreadsheetId=self.spreadsheet_id,
+            range=f"'{SHEET_TITLE}'!A{self.rows_written + 1}",
+            valueInputOption='RAW',
+            body={'values': rows}
+        ).execute(num_retries=GOOGLE_API_RETRIES)
+        self.rows_written = needed_rows
+
+    def finish(self) -> None:
+        if self.row_count > max(self.rows_written, 1):
+            self._resize(max(self.rows_written, 1), self.column_count)
+
+    def _resize(self, rows: int, columns: int) -> None:
+        # Setting absolute sizes keeps the call safe to retry
+        self.service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body={'requests': [{
+            'updateSheetProperties': {
+                'properties': {'sheetId': 0, 'gridProperties': {'rowCount': rows, 'columnCount': columns}},
+                'fields': 'gridProperties.rowCount,gridProperties.columnCount'
+            }
+        }]}).execute(num_retries=GOOGLE_API_RETRIES)
+        self.row_count, self.column_count = rows, columns
+
+
+def run_export(sheets_service, job: ExportJob, spreadsheet: dict, body: BinaryIO) -> None:
+    """Background task: streams the spooled rows into the sheet, recording progress on job."""
+    job.status = "running"
+    writer = SheetWriter(sheets_service, spreadsheet)
+    try:
+        batch = []
+        for row in iter_table_rows(body):
+            batch.append(row)
+            if len(batch) >= writer.batch_rows:
+                writer.write(batch)
+                job.rows_written, job.batches = writer.rows_written, job.batches + 1
+                batch = []
+        if batch:
+            writer.write(batch)
+            job.rows_written, job.batches = writer.rows_written, job.batches + 1
+        writer.finish()
+        job.status = "done"
+        logging.info(f"Sheets export {job.export_id}: {job.rows_written} rows in {job.batches} batches.")
+    except Exception as e:
+        logging.error(f"Sheets export {job.export_id} failed after {job.rows_written} rows: {e}")
+        job.status = "failed"
+        job.error = str(e)
+    finally:
+        job.finished_at = time.time()
+        body.close()
@@ -0,0 +1,208 @@
+"""Request metrics in the Prometheus text format, and optional OpenTelemetry spans.
+
+Metrics live in this process: with several uvicorn workers, every worker serves its own
+/metrics and the scraper sums them (on Vercel, vercel.json routes /metrics to the function, and
+each instance reports only what it served). Spans use the OpenTelemetry API when TRACING_ENABLED is
+set; they are exported by whatever SDK the deployment configures (for example by running
+under opentelemetry-instrument), and are no-ops without one.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+
+# Prometheus' default latency buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        if not labelnames and self.kind in ("counter", "gauge"):
+            self._values[()] = 0.0
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        super().__init__(name, documentation, labelnames)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket (non-cumulative) counts, then the sum and the total count
+            counts = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {counts[-1]}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_number(counts[-2])}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {counts[-1]}"
+
+
+class CallbackMetric(Metric):
+    """A metric whose samples are read at scrape time, for counts kept elsewhere (e.g. cache hits)."""
+
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: tuple[str, ...],
+                 collect: Callable[[], dict[tuple[str, ...], float]]):
+        self.kind = kind
+        self.collect = collect
+        super().__init__(name, documentation, labelnames)
+
+    def samples(self) -> Iterator[str]:
+        for key, value in sorted(self.collect().items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_number(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> None:
+        self.metrics.append(metric)
+
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self.metrics)
+
+
+registry = Registry()
+
+# --- Metrics ---
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Time to serve a request, including streaming.",
+                            ("method", "route", "status"))
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being served.")
+SEARCH_PHASE_SECONDS = Histogram("search_phase_seconds", "Time spent in each phase of /api/search.", ("phase",))
+ENCODE_SECONDS = Histogram("embedding_encode_seconds", "Query encodes that missed the embedding cache.",
+                           buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+ELASTICSEARCH_TOOK_SECONDS = Histogram("elasticsearch_took_seconds",
+                                       "Search time reported by Elasticsearch (took), per request.", ("operation",))
+ELASTICSEARCH_WALL_SECONDS = Histogram("elasticsearch_wall_seconds",
+                                       "Wall time of Elasticsearch search requests as seen by the API.", ("operation",))
+RERANK_OUTCOMES = Counter("search_rerank_total", "Re-ranked searches by outcome (applied, cached, timeout, busy, error).",
+                          ("outcome",))
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency per route template and the number of requests in flight."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            # The matched route's template keeps label cardinality bounded (no file IDs in paths)
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                    route=getattr(route, "path", "unmatched"), status=str(status[0]))
+
+
+# --- Tracing ---
+
+_tracer = None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """An OpenTelemetry span around a block when tracing is enabled; yields None otherwise."""
+    global _tracer
+    if not TRACING_ENABLED:
+        yield None
+        return
+    if _tracer is None:
+        # Imported on first use so cold starts without tracing never pay for it
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("api")
+    with _tracer.start_as_current_span(name, attributes=attributes) as current:
+        yield current
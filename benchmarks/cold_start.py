@@ -0,0 +1,118 @@
+"""Cold-start report for the API.
+
+Every run starts a fresh interpreter, as a new serverless instance would, and times:
+
+    import       importing api.main
+    first_light  the first request that needs neither the model nor the backend
+    warmup       loading the query model, one encode and opening the backend (/api/warmup)
+    first_search the first /api/search after warmup (skipped with --no-search)
+
+"eager" is import + warmup: what every cold start paid before the model and clients were
+loaded lazily. A single -X importtime run lists the slowest imports made by api.main.
+
+    python -m benchmarks.cold_start --runs 5 --runtimes sentence-transformers,fastembed
+"""
+import os
+import sys
+import json
+import logging
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Runs in the child interpreter; prints one JSON object with timings in milliseconds
+CHILD = """
+import sys, json, time
+start = time.perf_counter()
+import api.main
+result = {"import": 1000 * (time.perf_counter() - start)}
+from fastapi.testclient import TestClient
+with TestClient(api.main.app) as client:
+    def timed(name, method, url, **kwargs):
+        start = time.perf_counter()
+        response = client.request(method, url, **kwargs)
+        result[name] = 1000 * (time.perf_counter() - start)
+        if response.status_code != 200:
+            result.setdefault("errors", {})[name] = response.text[:200]
+    timed("first_light", "GET", "/api/embedding/stats")
+    timed("warmup", "GET", "/api/warmup")
+    if sys.argv[1] == "search":
+        timed("first_search", "POST", "/api/search", json={"query": "what are merchant fees"})
+print(json.dumps(result))
+"""
+
+
+def run_child(runtime: str, search: bool) -> dict:
+    env = {**os.environ, "QUERY_EMBEDDING_RUNTIME": runtime, "WARMUP_ON_STARTUP": "false"}
+    completed = subprocess.run(
+        [sys.executable, "-c", CHILD, "search" if search else "no-search"],
+        cwd=REPO_ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list[dict]:
+    """Modules imported directly by api.main, ordered by cumulative import time."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.main"],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True
+    )
+    imports = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nesting is shown by two spaces per level; api.main itself is level 0
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            imports.append({"module": name.strip(), "ms": int(cumulative) / 1000})
+    return sorted(imports, key=lambda entry: entry["ms"], reverse=True)[:top]
+
+
+def summarize(samples: list[float]) -> dict:
+    return {"median_ms": statistics.median(samples), "min_ms": min(samples), "max_ms": max(samples)}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure API import time and cold-start latency.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per runtime.")
+    parser.add_argument("--runtimes", default="sentence-transformers,fastembed",
+                        help="Comma-separated QUERY_EMBEDDING_RUNTIME values to compare.")
+    parser.add_argument("--no-search", action="store_true", help="Skip the first search (no backend reachable).")
+    parser.add_argument("--top-imports", type=int, default=15)
+    parser.add_argument("--output", default="cold_start_report.json")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = {"runs": args.runs, "runtimes": {}, "slowest_imports": slowest_imports(args.top_imports)}
+
+    for runtime in args.runtimes.split(","):
+        results = []
+        for run in range(args.runs):
+            result = run_child(runtime, not args.no_search)
+            logging.info(f"{runtime} run {run + 1}: {result}")
+            results.append(result)
+        phases = [name for name in ("import", "first_light", "warmup", "first_search") if name in results[0]]
+        summary = {name: summarize([result[name] for result in results]) for name in phases}
+        summary["eager"] = summarize([result["import"] + result["warmup"] for result in results])
+        summary["errors"] = [result["errors"] for result in results if "errors" in result]
+        report["runtimes"][runtime] = summary
+
+    for runtime, summary in report["runtimes"].items():
+        logging.info(f"{runtime}: import {summary['import']['median_ms']:.0f} ms, "
+                     f"first light request {summary['first_light']['median_ms']:.0f} ms, "
+                     f"eager start {summary['eager']['median_ms']:.0f} ms")
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
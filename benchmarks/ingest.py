@@ -0,0 +1,288 @@
+"""Ingestion benchmark over a synthetic corpus.
+
+Generates N files of a chosen size distribution and mix of types, runs them through the
+indexer's extract -> embed -> upload pipeline and writes a JSON report with the time and
+throughput of every stage (parse, split, embed, bulk upload) and one timing record per file,
+to size ingest hardware and to see which stage bounds a run.
+
+    python -m benchmarks.ingest --files 200 --size-dist lognormal --size-kb 200 --types txt,pdf,docx
+    python -m benchmarks.ingest --files 50 --backend elasticsearch --profile-dir ./ingest_profile
+
+--profile-dir dumps cProfile stats per pipeline thread and per extraction worker (pstats
+format, e.g. for snakeviz). For a sampling profile of everything at once, run the command
+under py-spy instead: py-spy record --subprocesses -o ingest.svg -- python -m benchmarks.ingest
+"""
+import os
+import json
+import time
+import random
+import logging
+import zipfile
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from xml.sax.saxutils import escape
+from dotenv import load_dotenv
+from api.embeddings import DEFAULT_EMBEDDING_MODEL, EMBEDDING_MODELS, Embedder, get_embedding_model, model_meta
+from ingest.documents import CHUNK_SIZE, CHUNK_OVERLAP, iter_document_files
+from ingest.manifest import file_sha256
+from ingest.mapping import build_index_mapping
+from ingest.pipeline import FileTask, IngestPipeline
+from ingest.targets import ElasticsearchTarget, LocalTarget
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ELASTIC_CLOUD_ID = os.getenv("ELASTIC_CLOUD_ID")
+ELASTIC_API_KEY = os.getenv("ELASTIC_API_KEY")
+ES_INDEX_NAME = os.getenv("ELASTIC_INDEX", "rag_documents")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+
+FILE_TYPES = ("txt", "md", "docx", "pdf")
+# Words for the generated text; the real corpus is used when present so token statistics are realistic
+VOCABULARY_SOURCE = Path(__file__).resolve().parent.parent / "fixed_documents"
+FALLBACK_VOCABULARY = ("account payment transfer fee balance currency merchant customer transaction "
+                       "wallet crypto statement personal data privacy service rate international "
+                       "domestic refund dispute bank card limit policy").split()
+PDF_LINE_CHARS = 90
+PDF_LINES_PER_PAGE = 50
+
+
+# --- Synthetic corpus ---
+
+def load_vocabulary() -> list[str]:
+    words = []
+    if VOCABULARY_SOURCE.is_dir():
+        for path in sorted(VOCABULARY_SOURCE.glob("*.txt")):
+            words.extend(word for word in path.read_text(encoding="utf-8", errors="ignore").split() if word.isalpha())
+    return words or FALLBACK_VOCABULARY
+
+
+def file_sizes(rng: random.Random, count: int, distribution: str, size_kb: float, max_size_kb: float) -> list[int]:
+    """Target sizes in bytes: every file size_kb ("fixed"), uniform up to max, or lognormal around size_kb."""
+    if distribution == "fixed":
+        sizes = [size_kb] * count
+    elif distribution == "uniform":
+        sizes = [rng.uniform(1, max_size_kb) for _ in range(count)]
+    else:
+        sizes = [min(max_size_kb, rng.lognormvariate(0, 1) * size_kb) for _ in range(count)]
+    return [max(256, int(size * 1024)) for size in sizes]
+
+
+def generate_text(rng: random.Random, vocabulary: list[str], num_chars: int) -> str:
+    """Paragraphs of random sentences totalling about num_chars characters."""
+    paragraphs = []
+    total = 0
+    while total < num_chars:
+        sentences = []
+        for _ in range(rng.randint(3, 8)):
+            words = rng.choices(vocabulary, k=rng.randint(8, 24))
+            sentences.append(" ".join(words).capitalize() + ".")
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        total += len(paragraph) + 2
+    return "\n\n".join(paragraphs)[:num_chars]
+
+
+def write_docx(path: Path, text: str) -> None:
+    """A minimal .docx: one w:p per paragraph, which is all the extractor reads."""
+    body = "".join(f'<w:p><w:r><w:t xml:space="preserve">{escape(paragraph)}</w:t></w:r></w:p>'
+                   for paragraph in text.split("\n\n"))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml",
+                         '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+                         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+                         '<Default Extension="xml" ContentType="application/xml"/>'
+                         '<Override PartName="/word/document.xml" ContentType="application/'
+                         'vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        archive.writestr("_rels/.rels",
+                         '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+                         '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                         'relationships/officeDocument" Target="word/document.xml"/></Relationships>')
+        archive.writestr("word/document.xml",
+                         '<?xml version="1.0" encoding="UTF-8"?>'
+                         '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                         f'<w:body>{body}</w:body></w:document>')
+
+
+def write_pdf(path: Path, text: str) -> None:
+    """A plain PDF with the text laid out in Helvetica lines, one content stream per page."""
+    flat = " ".join(text.split())
+    lines = [flat[i:i + PDF_LINE_CHARS] for i in range(0, len(flat), PDF_LINE_CHARS)] or [""]
+    pages = [lines[i:i + PDF_LINES_PER_PAGE] for i in range(0, len(lines), PDF_LINES_PER_PAGE)]
+
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page
+    objects = {3: b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"}
+    page_ids = []
+    for number, page_lines in enumerate(pages):
+        page_id, content_id = 4 + 2 * number, 5 + 2 * number
+        page_ids.append(page_id)
+        escaped = [line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in page_lines]
+        stream = ("BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({line}) '" for line in escaped) + " ET")
+        stream_bytes = stream.encode("latin-1", errors="replace")
+        objects[page_id] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {content_id} 0 R "
+                            f"/Resources << /Font << /F1 3 0 R >> >> >>").encode()
+        objects[content_id] = b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream_bytes), stream_bytes)
+    objects[1] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(f'{i} 0 R' for i in page_ids)}] /Count {len(page_ids)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += b"%d 0 obj\n%s\nendobj\n" % (object_id, objects[object_id])
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offsets[object_id] for object_id in sorted(objects))
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    path.write_bytes(bytes(output))
+
+
+def generate_corpus(corpus_dir: Path, count: int, distribution: str, size_kb: float, max_size_kb: float,
+                    types: list[str], seed: int) -> dict:
+    """Writes count files into corpus_dir, cycling through types; sizes are of the text, before formatting."""
+    rng = random.Random(seed)
+    vocabulary = load_vocabulary()
+    corpus_dir.mkdir(parents=True, exist_ok=True)
+    sizes = file_sizes(rng, count, distribution, size_kb, max_size_kb)
+    for number, num_chars in enumerate(sizes):
+        file_type = types[number % len(types)]
+        # Spread files over folders like a real document tree
+        path = corpus_dir / f"folder-{number % 10}" / f"doc-{number:05d}.{file_type}"
+        path.parent.mkdir(exist_ok=True)
+        text = generate_text(rng, vocabulary, num_chars)
+        if file_type == "docx":
+            write_docx(path, text)
+        elif file_type == "pdf":
+            write_pdf(path, text)
+        else:
+            path.write_text(text, encoding="utf-8")
+    return {"files": count, "size_distribution": distribution, "size_kb": size_kb, "max_size_kb": max_size_kb,
+            "types": types, "seed": seed, "text_bytes": sum(sizes),
+            "disk_bytes": sum(path.stat().st_size for path in corpus_dir.rglob("*") if path.is_file())}
+
+
+# --- Benchmark ---
+
+def build_target(args, dims: int, scratch: Path):
+    if args.backend == "local":
+        return LocalTarget(scratch / "index", dims)
+    from elasticsearch import Elasticsearch
+    es_client = Elasticsearch(cloud_id=ELASTIC_CLOUD_ID, api_key=ELASTIC_API_KEY, request_timeout=120)
+    return ElasticsearchTarget(es_client, f"{ES_INDEX_NAME}-bench-ingest", bulk_threads=args.bulk_threads)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the indexer on a synthetic corpus.")
+    parser.add_argument("--files", type=int, default=100, help="Number of files to generate.")
+    parser.add_argument("--size-dist", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--size-kb", type=float, default=100, help="File size (fixed) or median size (lognormal).")
+    parser.add_argument("--max-size-kb", type=float, default=5000, help="Upper bound for uniform and lognormal sizes.")
+    parser.add_argument("--types", default="txt,pdf,docx", help=f"Comma-separated mix of {', '.join(FILE_TYPES)}.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus-dir", help="Generate (or reuse, if it exists) the corpus here instead of a temp folder.")
+    parser.add_argument("--backend", choices=["local", "elasticsearch"], default="local",
+                        help="local writes a scratch index in a temp folder; elasticsearch a scratch index on the cluster.")
+    parser.add_argument("--embedding-model", choices=list(EMBEDDING_MODELS), default=EMBEDDING_MODEL)
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument("--embed-batch-size", type=int, default=256)
+    parser.add_argument("--embed-parallel", type=int, default=None)
+    parser.add_argument("--onnx-threads", type=int, default=None)
+    parser.add_argument("--bulk-threads", type=int, default=4)
+    parser.add_argument("--profile-dir", help="Dump cProfile stats per pipeline thread and extraction worker here.")
+    parser.add_argument("--output", default="ingest_report.json", help="Where to write the JSON report.")
+    args = parser.parse_args()
+    args.types = [file_type.strip() for file_type in args.types.split(",") if file_type.strip()]
+    unknown = set(args.types) - set(FILE_TYPES)
+    if unknown:
+        parser.error(f"Unknown file types: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.backend == "elasticsearch" and (not ELASTIC_CLOUD_ID or not ELASTIC_API_KEY):
+        logging.error("Elastic Cloud ID or API Key not found. Check .env or .env.local. Exiting.")
+        exit(1)
+    spec = get_embedding_model(args.embedding_model)
+
+    with tempfile.TemporaryDirectory(prefix="ingest-bench-") as scratch_dir:
+        scratch = Path(scratch_dir)
+        corpus_dir = Path(args.corpus_dir) if args.corpus_dir else scratch / "corpus"
+        start = time.perf_counter()
+        if corpus_dir.is_dir() and any(corpus_dir.iterdir()):
+            logging.info(f"Reusing the corpus in '{corpus_dir}'.")
+            corpus = {"reused": str(corpus_dir)}
+        else:
+            logging.info(f"Generating {args.files} {args.size_dist} files ({', '.join(args.types)})...")
+            corpus = generate_corpus(corpus_dir, args.files, args.size_dist, args.size_kb, args.max_size_kb,
+                                     args.types, args.seed)
+        corpus["generate_seconds"] = time.perf_counter() - start
+
+        embedder = Embedder(spec, runtime="fastembed", threads=args.onnx_threads)
+        start = time.perf_counter()
+        embedder.load()
+        model_load_seconds = time.perf_counter() - start
+
+        target = build_target(args, spec.dims, scratch)
+        meta = model_meta(spec)
+        target.create(build_index_mapping(spec.dims, meta=meta), recreate=True)
+        pipeline = IngestPipeline(
+            target, embedder,
+            workers=args.workers,
+            chunk_size=CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            embed_batch_size=args.embed_batch_size,
+            embed_parallel=args.embed_parallel,
+            profile_dir=Path(args.profile_dir) if args.profile_dir else None
+        )
+        start = time.perf_counter()
+        hash_seconds = 0.0
+        tasks = []
+        for file_path, file_key, file_name, relative_path in iter_document_files(corpus_dir):
+            hash_start = time.perf_counter()
+            tasks.append(FileTask(str(file_path), file_key, file_name, relative_path, file_sha256(file_path)))
+            hash_seconds += time.perf_counter() - hash_start
+        pipeline.run(tasks)
+        finish_start = time.perf_counter()
+        target.finish(changed=True, meta=meta)
+        finish_seconds = time.perf_counter() - finish_start
+        wall_seconds = time.perf_counter() - start
+        if args.backend == "elasticsearch":
+            target.es_client.indices.delete(index=target.index_name, ignore_unavailable=True)
+
+    data = pipeline.report_data()
+    input_bytes = data["stages"]["extract"]["bytes"]
+    report = {
+        "machine": {"cpu_count": os.cpu_count(), "platform": platform.platform(), "python": platform.python_version()},
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "corpus_dir")},
+        "corpus": corpus,
+        "model_load_seconds": model_load_seconds,
+        "hash_seconds": hash_seconds,
+        "finish_seconds": finish_seconds,
+        "wall_seconds": wall_seconds,
+        "throughput": {
+            "files_per_second": len(data["files"]) / wall_seconds,
+            "input_mb_per_second": input_bytes / 1_000_000 / wall_seconds,
+            "chunks_per_second": data["stages"]["embed"]["items"] / wall_seconds,
+            "docs_per_second": data["stages"]["upload"]["items"] / wall_seconds,
+        },
+        **data,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    for line in pipeline.report():
+        logging.info(f"  {line}")
+    throughput = report["throughput"]
+    logging.info(f"Wall {wall_seconds:.2f}s: {throughput['files_per_second']:.1f} files/s, "
+                 f"{throughput['input_mb_per_second']:.2f} MB/s, {throughput['chunks_per_second']:.1f} chunks/s, "
+                 f"{throughput['docs_per_second']:.1f} docs/s")
+    logging.info(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
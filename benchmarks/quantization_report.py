@@ -0,0 +1,179 @@
+"""Recall-vs-latency report for chunk_vector index_options modes.
+
+Builds one scratch index per mode from the same documents, computes exact top-k neighbours
+with a brute-force script_score query, then measures approximate kNN recall@k, latency and
+index size for each mode (optionally with rescore_vector oversampling).
+
+    python -m benchmarks.quantization_report --modes hnsw,int8_hnsw,int4_hnsw,bbq_hnsw --oversample 0,2
+
+int4_hnsw needs Elasticsearch 8.15+, bbq_hnsw 8.16+ and rescore_vector 8.18+.
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import statistics
+from pathlib import Path
+from dotenv import load_dotenv
+from elasticsearch import Elasticsearch
+from api.embeddings import DEFAULT_EMBEDDING_MODEL, Embedder, get_embedding_model, model_meta
+from ingest.documents import CHUNK_SIZE, CHUNK_OVERLAP, iter_document_files
+from ingest.manifest import file_sha256
+from ingest.mapping import build_index_mapping, vector_index_options
+from ingest.pipeline import FileTask, IngestPipeline
+from ingest.targets import ElasticsearchTarget
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ELASTIC_CLOUD_ID = os.getenv("ELASTIC_CLOUD_ID")
+ELASTIC_API_KEY = os.getenv("ELASTIC_API_KEY")
+ES_INDEX_NAME = os.getenv("ELASTIC_INDEX", "rag_documents")
+EMBEDDING_MODEL = get_embedding_model(os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL))
+
+DEFAULT_QUERIES = [
+    "what are merchant fees",
+    "fee for receiving money from another country",
+    "currency conversion spread",
+    "chargeback fee amount",
+    "micropayments pricing",
+    "fees for sending money to friends and family",
+    "instant transfer to bank account fee",
+    "how are cryptocurrency purchases priced",
+    "can I transfer crypto to an external wallet",
+    "crypto sale proceeds and tax reporting",
+    "what personal data is collected",
+    "how long is personal data retained",
+    "sharing personal information with third parties",
+    "cookies and tracking technologies",
+    "dispute resolution and arbitration",
+]
+
+
+def build_index(es_client: Elasticsearch, embedder: Embedder, docs_path: Path, index_name: str, mode: str) -> float:
+    """Creates a scratch index for one mode, ingests the corpus and returns the build time."""
+    if es_client.indices.exists(index=index_name):
+        es_client.indices.delete(index=index_name)
+    mapping = build_index_mapping(EMBEDDING_MODEL.dims, vector_index_options(mode), model_meta(EMBEDDING_MODEL))
+    es_client.indices.create(index=index_name, mappings=mapping)
+    tasks = [FileTask(str(file_path), file_key, file_name, relative_path, file_sha256(file_path))
+             for file_path, file_key, file_name, relative_path in iter_document_files(docs_path)]
+    pipeline = IngestPipeline(ElasticsearchTarget(es_client, index_name), embedder,
+                              workers=max(1, (os.cpu_count() or 2) - 1),
+                              chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    start = time.perf_counter()
+    pipeline.run(tasks)
+    es_client.indices.refresh(index=index_name)
+    # One segment per index so graph-search latency is comparable across modes
+    es_client.indices.forcemerge(index=index_name, max_num_segments=1)
+    return time.perf_counter() - start
+
+
+def exact_neighbours(es_client: Elasticsearch, index_name: str, query_vector: list[float], k: int) -> list[str]:
+    """Brute-force cosine top-k over the raw float vectors, used as ground truth."""
+    response = es_client.search(index=index_name, body={
+        "size": k,
+        "_source": False,
+        "query": {"script_score": {
+            "query": {"term": {"doc_type": "chunk"}},
+            "script": {
+                "source": "cosineSimilarity(params.query_vector, 'chunk_vector') + 1.0",
+                "params": {"query_vector": query_vector}
+            }
+        }}
+    })
+    return [hit["_id"] for hit in response["hits"]["hits"]]
+
+
+def measure(es_client: Elasticsearch, index_name: str, query_vectors: list[list[float]], truth: list[list[str]],
+            k: int, num_candidates: int, oversample: float, repeat: int) -> dict:
+    wall_ms, took_ms, recalls = [], [], []
+    for query_vector, expected in zip(query_vectors, truth):
+        knn = {"field": "chunk_vector", "query_vector": query_vector, "k": k,
+               "num_candidates": num_candidates, "filter": [{"term": {"doc_type": "chunk"}}]}
+        if oversample:
+            knn["rescore_vector"] = {"oversample": oversample}
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = es_client.search(index=index_name, body={"knn": knn, "size": k, "_source": False})
+            wall_ms.append((time.perf_counter() - start) * 1000)
+            took_ms.append(response["took"])
+        found = {hit["_id"] for hit in response["hits"]["hits"]}
+        recalls.append(len(found & set(expected)) / len(expected) if expected else 1.0)
+    wall_ms.sort()
+    return {
+        "recall_at_k": statistics.mean(recalls),
+        "latency_ms_p50": wall_ms[len(wall_ms) // 2],
+        "latency_ms_p95": wall_ms[min(len(wall_ms) - 1, int(len(wall_ms) * 0.95))],
+        "took_ms_mean": statistics.mean(took_ms),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare recall and latency of chunk_vector index_options modes.")
+    parser.add_argument("--docs", default="./fixed_documents", help="Documents folder to index.")
+    parser.add_argument("--modes", default="hnsw,int8_hnsw,int4_hnsw,bbq_hnsw",
+                        help="Comma-separated dense_vector index_options types.")
+    parser.add_argument("--oversample", default="0",
+                        help="Comma-separated rescore_vector oversample factors (0 = no rescoring).")
+    parser.add_argument("--queries", help="File with one query per line. Defaults to a built-in fee/crypto/privacy set.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--num-candidates", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query.")
+    parser.add_argument("--output", default="quantization_report.json", help="Where to write the JSON report.")
+    parser.add_argument("--keep-indices", action="store_true", help="Do not delete the scratch indices afterwards.")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not ELASTIC_CLOUD_ID or not ELASTIC_API_KEY:
+        logging.error("Elastic Cloud ID or API Key not found. Check .env or .env.local. Exiting.")
+        exit(1)
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    oversamples = [float(value) for value in args.oversample.split(",")]
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        queries = [line.strip() for line in Path(args.queries).read_text(encoding="utf-8").splitlines() if line.strip()]
+
+    es_client = Elasticsearch(cloud_id=ELASTIC_CLOUD_ID, api_key=ELASTIC_API_KEY, request_timeout=120)
+    embedder = Embedder(EMBEDDING_MODEL)
+    query_vectors = embedder.embed_queries(queries).tolist()
+
+    report = {"k": args.k, "num_candidates": args.num_candidates, "queries": len(queries), "modes": {}}
+    truth = None
+    index_names = []
+    try:
+        for mode in modes:
+            index_name = f"{ES_INDEX_NAME}-bench-{mode}"
+            index_names.append(index_name)
+            logging.info(f"Building '{index_name}' ({mode})...")
+            build_seconds = build_index(es_client, embedder, Path(args.docs), index_name, mode)
+            if truth is None:
+                # Chunk IDs are content-derived, so one exact pass serves every mode
+                truth = [exact_neighbours(es_client, index_name, vector, args.k) for vector in query_vectors]
+            stats = es_client.indices.stats(index=index_name, metric="store,docs")["_all"]["primaries"]
+            runs = {}
+            for oversample in oversamples:
+                runs[f"oversample_{oversample:g}"] = measure(es_client, index_name, query_vectors, truth, args.k,
+                                                            args.num_candidates, oversample, args.repeat)
+            report["modes"][mode] = {
+                "build_seconds": build_seconds,
+                "store_bytes": stats["store"]["size_in_bytes"],
+                "docs": stats["docs"]["count"],
+                "runs": runs,
+            }
+    finally:
+        if not args.keep_indices:
+            for index_name in index_names:
+                es_client.indices.delete(index=index_name, ignore_unavailable=True)
+
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    logging.info(f"{'mode':<12} {'rescore':>8} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'store MB':>9}")
+    for mode, result in report["modes"].items():
+        for run_name, run in result["runs"].items():
+            logging.info(f"{mode:<12} {run_name.split('_')[1]:>8} {run['recall_at_k']:>9.3f} "
+                         f"{run['latency_ms_p50']:>8.1f} {run['latency_ms_p95']:>8.1f} "
+                         f"{result['store_bytes'] / 1_000_000:>9.2f}")
+    logging.info(f"Report written to '{args.output}'.")
@@ -0,0 +1,218 @@
+"""Latency, throughput and relevance report for /api/search.
+
+Replays a labelled query set against the API, either in-process (the FastAPI app over an
+ASGI transport, no server needed) or against a running server with --url, and reports:
+
+    quality      recall@size and MRR of the first pass, judged against labelled chunks
+    levels       p50/p95/p99 latency and QPS at each concurrency level
+    split        mean time per search phase, from the Server-Timing header of /api/search
+                 (encode, version, backend, rerank, shape); "other" is transport and serialisation
+
+A chunk is relevant to a label when it comes from the labelled file and its full text contains
+the labelled phrase, so labels survive re-chunking and re-indexing. Searches ask for the full
+chunk text (chunk_text) rather than judging the snippet, which lexical and hybrid hits cut down
+to a highlight. The search cache is disabled
+in-process unless --cache is given; start a server with EMBEDDING_CACHE_SIZE=0 and
+RESULT_CACHE_SIZE=0 to measure uncached searches there.
+
+    python -m benchmarks.retrieval --concurrency 1,4,16 --passes 3
+    python -m benchmarks.retrieval --url http://localhost:8000 --mode hybrid --rerank
+"""
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+import argparse
+import statistics
+from pathlib import Path
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+DEFAULT_QUERIES = Path(__file__).resolve().parent / "retrieval_queries.json"
+PHASES = ("encode", "version", "backend", "rerank", "shape")
+_TAG = re.compile(r"</?em>")
+_SPACE = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """Lower-cased text without highlight tags and with whitespace collapsed, for phrase matching."""
+    return _SPACE.sub(" ", _TAG.sub("", text)).strip().lower()
+
+
+def parse_server_timing(header: str | None) -> tuple[dict[str, float], str | None]:
+    """Phase durations in milliseconds and the cache outcome from a Server-Timing header."""
+    timings, cache = {}, None
+    for metric in (header or "").split(","):
+        name, *params = [part.strip() for part in metric.split(";")]
+        for param in params:
+            key, _, value = param.partition("=")
+            if key == "dur":
+                timings[name] = float(value)
+            elif key == "desc" and name == "cache":
+                cache = value.strip('"')
+    return timings, cache
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def judge(results: list[dict], relevant: list[dict]) -> tuple[float, float]:
+    """recall over the labels and reciprocal rank of the first relevant result."""
+    labels = [(label["file"], normalize(label["contains"])) for label in relevant]
+    found = set()
+    first_rank = None
+    for rank, result in enumerate(results, start=1):
+        text = normalize(result.get("chunkText", ""))
+        file_name = result.get("source", {}).get("fileName")
+        matched = {i for i, (label_file, phrase) in enumerate(labels) if file_name == label_file and phrase in text}
+        if matched and first_rank is None:
+            first_rank = rank
+        found |= matched
+    recall = len(found) / len(labels) if labels else 1.0
+    return recall, 1.0 / first_rank if first_rank else 0.0
+
+
+async def timed_search(client, payload: dict) -> dict:
+    start = time.perf_counter()
+    response = await client.post("/api/search", json=payload)
+    wall_ms = 1000 * (time.perf_counter() - start)
+    timings, cache = parse_server_timing(response.headers.get("server-timing"))
+    return {"status": response.status_code, "wall_ms": wall_ms, "timings": timings, "cache": cache,
+            "results": response.json() if response.status_code == 200 else None,
+            "error": response.text[:200] if response.status_code != 200 else None}
+
+
+async def run_level(client, payloads: list[dict], concurrency: int, passes: int) -> dict:
+    """Sends every payload passes times with at most concurrency requests in flight."""
+    work = asyncio.Queue()
+    for _ in range(passes):
+        for payload in payloads:
+            work.put_nowait(payload)
+    samples = []
+
+    async def worker():
+        while not work.empty():
+            samples.append(await timed_search(client, work.get_nowait()))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    ok = [sample for sample in samples if sample["status"] == 200]
+    wall = sorted(sample["wall_ms"] for sample in ok)
+    summary = {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "qps": len(ok) / elapsed if elapsed > 0 else 0.0,
+        "cache_hits": sum(sample["cache"] == "hit" for sample in ok),
+    }
+    if wall:
+        summary.update({
+            "latency_ms_p50": percentile(wall, 0.50),
+            "latency_ms_p95": percentile(wall, 0.95),
+            "latency_ms_p99": percentile(wall, 0.99),
+            "latency_ms_mean": statistics.mean(wall),
+        })
+        split = {phase: statistics.mean(sample["timings"].get(phase, 0.0) for sample in ok) for phase in PHASES}
+        split["other"] = summary["latency_ms_mean"] - sum(split.values())
+        summary["split_ms"] = split
+    if summary["errors"]:
+        summary["first_error"] = next(sample["error"] for sample in samples if sample["status"] != 200)
+    return summary
+
+
+async def run(args, queries: list[dict]) -> dict:
+    import httpx
+    payloads = [{"query": entry["query"], "mode": args.mode, "k": args.k, "num_candidates": args.num_candidates,
+                 "size": args.size, "rerank": args.rerank, "chunk_text": True} for entry in queries]
+    report = {"target": args.url or "in-process", "mode": args.mode, "rerank": args.rerank, "k": args.k, "size": args.size,
+              "num_candidates": args.num_candidates, "queries": len(queries), "passes": args.passes,
+              "cache": args.cache or bool(args.url), "levels": {}}
+
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout) as client:
+            await measure(client, args, payloads, queries, report)
+        return report
+
+    if not args.cache:
+        os.environ["EMBEDDING_CACHE_SIZE"] = "0"
+        os.environ["RESULT_CACHE_SIZE"] = "0"
+    from api.main import app
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=args.timeout) as client:
+            await measure(client, args, payloads, queries, report)
+    return report
+
+
+async def measure(client, args, payloads: list[dict], queries: list[dict], report: dict) -> None:
+    warmup = await client.get("/api/warmup")
+    if warmup.status_code != 200:
+        raise RuntimeError(f"Warmup failed: {warmup.text[:200]}")
+    report["warmup"] = warmup.json()
+
+    # Relevance from one sequential pass, which also loads anything still cold
+    per_query = []
+    for entry, payload in zip(queries, payloads):
+        sample = await timed_search(client, payload)
+        recall, reciprocal_rank = judge(sample["results"] or [], entry.get("relevant", []))
+        per_query.append({"query": entry["query"], "recall": recall, "reciprocal_rank": reciprocal_rank,
+                          "error": sample["error"]})
+    report["quality"] = {
+        f"recall_at_{args.size}": statistics.mean(item["recall"] for item in per_query),
+        "mrr": statistics.mean(item["reciprocal_rank"] for item in per_query),
+        "per_query": per_query,
+    }
+
+    for concurrency in args.concurrency:
+        logging.info(f"Concurrency {concurrency}: {args.passes} passes of {len(payloads)} queries...")
+        report["levels"][str(concurrency)] = await run_level(client, payloads, concurrency, args.passes)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Measure /api/search latency, throughput and recall.")
+    parser.add_argument("--url", help="Base URL of a running API. Default: run the app in-process.")
+    parser.add_argument("--queries", default=str(DEFAULT_QUERIES),
+                        help="JSON list of {query, relevant: [{file, contains}]} entries.")
+    parser.add_argument("--mode", choices=["knn", "hybrid"], default="knn")
+    parser.add_argument("--rerank", action="store_true", help="Re-rank candidates with the cross-encoder.")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--num-candidates", type=int, default=100)
+    parser.add_argument("--size", type=int, default=10, help="Results per search; recall is measured at this depth.")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels.")
+    parser.add_argument("--passes", type=int, default=3, help="Times the query set is replayed per level.")
+    parser.add_argument("--cache", action="store_true", help="Keep the search cache enabled in-process.")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", default="retrieval_report.json", help="Where to write the JSON report.")
+    args = parser.parse_args()
+    args.concurrency = [int(value) for value in args.concurrency.split(",")]
+    return args
+
+
+def main():
+    args = parse_args()
+    queries = json.loads(Path(args.queries).read_text(encoding="utf-8"))
+    report = asyncio.run(run(args, queries))
+
+    quality = report["quality"]
+    logging.info(f"recall@{args.size} {quality[f'recall_at_{args.size}']:.3f}, MRR {quality['mrr']:.3f}")
+    logging.info(f"{'conc':>5} {'qps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+                 + " ".join(f"{phase:>8}" for phase in (*PHASES, "other")))
+    for concurrency, level in report["levels"].items():
+        if "split_ms" not in level:
+            logging.info(f"{concurrency:>5} every request failed: {level.get('first_error')}")
+            continue
+        logging.info(f"{concurrency:>5} {level['qps']:>8.1f} {level['latency_ms_p50']:>8.1f} "
+                     f"{level['latency_ms_p95']:>8.1f} {level['latency_ms_p99']:>8.1f} "
+                     + " ".join(f"{level['split_ms'][phase]:>8.2f}" for phase in (*PHASES, "other")))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,20 @@
 import os
+import json
 import logging
-import base64
+import argparse
 from pathlib import Path
+from typing import Iterable, Iterator
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk, BulkIndexError
-# --- CHANGED: Import the correct class ---
-from fastembed import TextEmbedding 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-import PyPDF2
-import docx
 import time
-import numpy as np
+from api.embeddings import DEFAULT_EMBEDDING_MODEL, EMBEDDING_MODELS, Embedder, get_embedding_model, model_meta
+from ingest.documents import CHUNK_SIZE, CHUNK_OVERLAP, iter_document_files
+from ingest.mapping import VECTOR_INDEX_TYPES, build_index_mapping, vector_index_options
+from ingest.manifest import file_sha256, load_manifest, new_manifest, read_manifest, save_manifest
+from ingest.pipeline import FileTask, IngestPipeline
+from ingest.checkpoint import DeadLetterQueue, RunJournal
+from ingest.dedup import DEDUP_MODES, ChunkDeduplicator, DeduplicatingTarget
+from ingest.targets import ElasticsearchTarget, LocalTarget
 
 # --- Configuration ---
 load_dotenv()
@@ -22,299 +25,507 @@ ELASTIC_CLOUD_ID = os.getenv("ELASTIC_CLOUD_ID")
 ELASTIC_API_KEY = os.getenv("ELASTIC_API_KEY")
 ES_INDEX_NAME = os.getenv("ELASTIC_INDEX", "rag_documents")
 
-# 'BAAI/bge-small-en-v1.5' is the default and is 384 dimensions
-EMBEDDING_MODEL_NAME = 'BAAI/bge-small-en-v1.5'
-EMBEDDING_DIM = 384  # This is correct for bge-small-en-v1.5
+# Registry name from api/embeddings.py; the API must serve with the same EMBEDDING_MODEL
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
 DOCS_FOLDER = "./fixed_documents"
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 150
+# "folder" indexes DOCS_FOLDER; "drive" syncs the Google Drive of the user authorized in GOOGLE_DRIVE_TOKEN_FILE
+INGEST_SOURCE = os.getenv("INGEST_SOURCE", "folder")
+GOOGLE_DRIVE_TOKEN_FILE = os.getenv("GOOGLE_DRIVE_TOKEN_FILE", "./.ingest_state/drive_token.json")
+DRIVE_EXPORT_WORKERS = int(os.getenv("INGEST_DRIVE_EXPORT_WORKERS", "8"))
+DRIVE_STAGING_DIR = os.getenv("INGEST_DRIVE_STAGING_DIR", "./.ingest_state/drive_exports")
+# "elasticsearch" writes to Elastic Cloud; "local" writes an index directory the API can serve with RETRIEVAL_BACKEND=local
+INGEST_BACKEND = os.getenv("INGEST_BACKEND", "elasticsearch")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", f"./.local_index/{ES_INDEX_NAME}")
+LOCAL_VECTOR_DTYPE = os.getenv("LOCAL_VECTOR_DTYPE", "float32")
+LOCAL_IVF_LISTS = int(os.getenv("LOCAL_IVF_LISTS", "0"))
+MANIFEST_PATH = os.getenv("INGEST_MANIFEST")
+EXTRACT_WORKERS = int(os.getenv("INGEST_EXTRACT_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "256"))
+# fastembed data-parallel workers per batch (unset: in-process) and ONNX intra-op threads (unset: runtime default)
+EMBED_PARALLEL = int(os.environ["INGEST_EMBED_PARALLEL"]) if os.getenv("INGEST_EMBED_PARALLEL") else None
+ONNX_THREADS = int(os.environ["INGEST_ONNX_THREADS"]) if os.getenv("INGEST_ONNX_THREADS") else None
+# Per-document ceiling on extracted text in MB (0 = none) and seconds before extraction of one file is abandoned.
+# The parent record holds a document's whole text (or base64 PDF), so this cap is what bounds memory per worker.
+MAX_DOCUMENT_MB = float(os.getenv("INGEST_MAX_DOCUMENT_MB", "64"))
+EXTRACT_TIMEOUT = float(os.getenv("INGEST_EXTRACT_TIMEOUT", "300"))
+BULK_BATCH_SIZE = int(os.getenv("INGEST_BULK_BATCH_SIZE", "500"))
+BULK_THREADS = int(os.getenv("INGEST_BULK_THREADS", "4"))
+# Byte ceiling of one bulk request; halved when the cluster answers 429 and grown back as requests succeed
+BULK_MAX_MB = float(os.getenv("INGEST_BULK_MAX_MB", "10"))
+# Quantized HNSW (int8_hnsw, int4_hnsw, bbq_hnsw) shrinks graph memory; unset keeps the cluster default
+VECTOR_INDEX_TYPE = os.getenv("INGEST_VECTOR_INDEX_TYPE") or None
+HNSW_M = int(os.environ["INGEST_HNSW_M"]) if os.getenv("INGEST_HNSW_M") else None
+HNSW_EF_CONSTRUCTION = int(os.environ["INGEST_HNSW_EF_CONSTRUCTION"]) if os.getenv("INGEST_HNSW_EF_CONSTRUCTION") else None
+# Chunks already in the index (by exact text, or MinHash similarity in the opt-in "near" mode) are indexed
+# as references without a vector instead of being embedded again; "off" embeds every copy
+INGEST_DEDUP = os.getenv("INGEST_DEDUP", "exact")
+INGEST_DEDUP_THRESHOLD = float(os.getenv("INGEST_DEDUP_THRESHOLD", "0.9"))
+INGEST_DEDUP_STORE = os.getenv("INGEST_DEDUP_STORE")
+INGEST_REPORT = os.getenv("INGEST_REPORT")
+INGEST_PROFILE_DIR = os.getenv("INGEST_PROFILE_DIR")
+
+# --- Helper Functions ---
+
+def select_files(docs_path: Path, manifest: dict, incremental: bool, seen_files: set[str],
+                 replaced_files: dict[str, str], counts: dict) -> Iterator[FileTask]:
+    """Walks the documents folder and yields the files that need (re-)indexing. Changed files are
+    recorded in replaced_files; their old documents stay searchable until the new version is in."""
+    for file_path, file_key, file_name, relative_path in iter_document_files(docs_path):
+        seen_files.add(file_key)
 
-# --- Helper Functions (No Changes) ---
-
-def get_file_content_and_type(file_path: Path) -> tuple[str | bytes | None, str | None]:
-    """Reads file content based on extension, returning content and type."""
-    suffix = file_path.suffix.lower()
-    content = None
-    content_type = None
-
-    try:
-        if suffix == ".pdf":
-            with open(file_path, "rb") as f:
-                content = f.read()
-            content_type = "pdf_base64"
-        elif suffix == ".docx":
-            text = ""
-            doc = docx.Document(file_path)
-            for para in doc.paragraphs:
-                text += para.text + "\n"
-            content = text
-            content_type = "text"
-        elif suffix in [".txt", ".md", ".py", ".js", ".ts", ".html", ".css", ".json", ".yaml", ".yml"]:
-             with open(file_path, "r", encoding="utf-8", errors='ignore') as f:
-                content = f.read()
-             content_type = "text"
-        else:
-            logging.warning(f"Skipping unsupported file type: {file_path.name}")
-    except FileNotFoundError:
-        logging.error(f"File not found: {file_path}")
-    except Exception as e:
-        logging.error(f"Error reading {file_path.name}: {e}", exc_info=False)
-    return content, content_type
-
-
-def extract_text_from_pdf(file_bytes: bytes, file_path_str: str) -> str:
-    """Extracts text from PDF bytes using PyPDF2."""
-    text = ""
-    try:
-        import io
-        pdf_file = io.BytesIO(file_bytes)
-        reader = PyPDF2.PdfReader(pdf_file)
-        if reader.is_encrypted:
-            try:
-                reader.decrypt('')
-            except Exception as decrypt_error:
-                logging.warning(f"Skipping encrypted PDF (password needed): {file_path_str} - {decrypt_error}")
-                return ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-    except Exception as e:
-        logging.error(f"Error extracting text from PDF {Path(file_path_str).name}: {e}", exc_info=False)
-    return text
+        try:
+            content_hash = file_sha256(file_path)
+        except Exception as e:
+            logging.error(f"  Could not hash {file_name}: {e}. Skipping.")
+            continue
+
+        previous_entry = manifest["files"].get(file_key)
+        if incremental and previous_entry and previous_entry.get("sha256") == content_hash:
+            counts["skipped"] += 1
+            continue
+
+        counts["processed"] += 1
+        if incremental and previous_entry:
+            replaced_files[file_key] = file_key
+        yield FileTask(str(file_path), file_key, file_name, relative_path, content_hash)
+
+
+def journaled(tasks: Iterator[FileTask], journal: RunJournal) -> Iterator[FileTask]:
+    """Records each file in the run journal as it is handed to the pipeline."""
+    for task in tasks:
+        journal.started(task.file_key, task.file_name, task.relative_path)
+        yield task
+
+
+def retry_failed(target, manifest: dict, dead_letters: DeadLetterQueue) -> bool:
+    """Replays the dead-letter queue, recording the files whose missing documents all made it.
+    Actions that fail again stay queued. Returns whether anything was indexed."""
+    records = dead_letters.actions
+    by_id = {record["doc_id"]: record for record in records}
+    dead_letters.actions = []
+    indexed = set()
+    for ok, doc_id, error in target.write(record["action"] for record in records):
+        if ok:
+            indexed.add(doc_id)
+        elif doc_id in by_id:
+            dead_letters.add_action(by_id[doc_id]["action"], error)
+    indexed_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    for file_key, record in list(dead_letters.files.items()):
+        if indexed.issuperset(record["missing"]):
+            manifest["files"][file_key] = {**record["entry"], "indexed_at": indexed_at}
+            del dead_letters.files[file_key]
+    logging.info(f"Replayed {len(records)} failed actions: {len(indexed)} indexed, "
+                 f"{len(dead_letters.actions)} failed again.")
+    return bool(indexed)
+
+
+def load_drive_credentials(token_file: Path):
+    """Loads authorized-user credentials, writing a refreshed access token back to the file."""
+    from google.oauth2.credentials import Credentials
+    from api.google_drive import SCOPES
+    credentials = Credentials.from_authorized_user_file(str(token_file), SCOPES)
+    if not credentials.valid and credentials.refresh_token:
+        from google.auth.transport.requests import Request
+        credentials.refresh(Request())
+        token_file.write_text(credentials.to_json(), encoding="utf-8")
+    return credentials
+
+
+def write_report(report_path: Path, args: argparse.Namespace, counts: dict, wall_seconds: float,
+                 pipeline: IngestPipeline) -> None:
+    """Writes the run's settings, totals and per-stage/per-file timings as JSON."""
+    report = {
+        "source": args.source,
+        "backend": args.backend,
+        "embedding_model": args.embedding_model,
+        "cpu_count": os.cpu_count(),
+        "workers": args.workers,
+        "embed_batch_size": args.embed_batch_size,
+        "embed_parallel": args.embed_parallel,
+        "onnx_threads": args.onnx_threads,
+        "bulk_threads": args.bulk_threads,
+        "bulk_max_mb": args.bulk_max_mb,
+        "dedup": args.dedup,
+        "files_processed": counts["processed"],
+        "files_skipped": counts["skipped"],
+        "wall_seconds": wall_seconds,
+        **pipeline.report_data(),
+    }
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    logging.info(f"Ingest report written to '{report_path}'.")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Chunk, embed and index documents into Elasticsearch.")
+    parser.add_argument("--full", action="store_true",
+                        help="Delete the index and re-embed every file instead of indexing only new or changed files.")
+    parser.add_argument("--embedding-model", choices=list(EMBEDDING_MODELS), default=EMBEDDING_MODEL,
+                        help="Embedding model. Changing it forces a full rebuild.")
+    parser.add_argument("--source", choices=["folder", "drive"], default=INGEST_SOURCE,
+                        help="Index the documents folder or sync Google Drive.")
+    parser.add_argument("--drive-token-file", default=GOOGLE_DRIVE_TOKEN_FILE,
+                        help="Authorized-user token JSON (with a refresh token) for --source drive.")
+    parser.add_argument("--drive-export-workers", type=int, default=DRIVE_EXPORT_WORKERS,
+                        help="Concurrent Drive exports.")
+    parser.add_argument("--drive-staging-dir", default=DRIVE_STAGING_DIR,
+                        help="Folder Drive files are exported to before extraction; emptied after the run.")
+    parser.add_argument("--backend", choices=["elasticsearch", "local"], default=INGEST_BACKEND,
+                        help="Where to write the index.")
+    parser.add_argument("--local-index-dir", default=LOCAL_INDEX_DIR,
+                        help="Directory of the local index (--backend local).")
+    parser.add_argument("--local-vector-dtype", choices=["float32", "int8"], default=LOCAL_VECTOR_DTYPE,
+                        help="Storage type of the local search matrix.")
+    parser.add_argument("--local-ivf-lists", type=int, default=LOCAL_IVF_LISTS,
+                        help="IVF lists for the local index (0 = exact brute-force search).")
+    parser.add_argument("--manifest", default=MANIFEST_PATH,
+                        help="Path of the per-file content-hash manifest used for incremental runs.")
+    parser.add_argument("--workers", type=int, default=EXTRACT_WORKERS,
+                        help="Processes used for text extraction and splitting.")
+    parser.add_argument("--max-document-mb", type=float, default=MAX_DOCUMENT_MB,
+                        help="Extracted text kept per document; longer documents are truncated (0 = no limit). Each "
+                             "document's parent record is held whole, so this also bounds memory per extraction "
+                             "worker.")
+    parser.add_argument("--extract-timeout", type=float, default=EXTRACT_TIMEOUT,
+                        help="Seconds allowed to extract one file before it is skipped (0 = no limit).")
+    parser.add_argument("--embed-batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="Chunks per embedding call, collected across files.")
+    parser.add_argument("--embed-parallel", type=int, default=EMBED_PARALLEL,
+                        help="fastembed data-parallel workers (0 = all cores). Default: embed in-process.")
+    parser.add_argument("--onnx-threads", type=int, default=ONNX_THREADS,
+                        help="ONNX Runtime threads for the in-process embedding model.")
+    parser.add_argument("--vector-index-type", choices=VECTOR_INDEX_TYPES, default=VECTOR_INDEX_TYPE,
+                        help="dense_vector index_options type for chunk_vector. Changing it forces a full rebuild.")
+    parser.add_argument("--hnsw-m", type=int, default=HNSW_M,
+                        help="HNSW graph connections per node.")
+    parser.add_argument("--hnsw-ef-construction", type=int, default=HNSW_EF_CONSTRUCTION,
+                        help="HNSW candidate list size while building the graph.")
+    parser.add_argument("--bulk-threads", type=int, default=BULK_THREADS,
+                        help="Concurrent bulk requests sent to Elasticsearch.")
+    parser.add_argument("--bulk-max-mb", type=float, default=BULK_MAX_MB,
+                        help="Largest bulk request in MB; shrunk automatically while the cluster rejects requests.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run, including a --full rebuild, instead of starting it over.")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Only replay the actions in the dead-letter queue of earlier runs, then exit.")
+    parser.add_argument("--dedup", choices=DEDUP_MODES, default=INGEST_DEDUP,
+                        help="Index duplicate chunks as references instead of embedding them: exact copies only "
+                             "(default), or near duplicates too, which then lose their own vector and are hidden "
+                             "from unfiltered lexical search.")
+    parser.add_argument("--dedup-threshold", type=float, default=INGEST_DEDUP_THRESHOLD,
+                        help="Estimated Jaccard similarity of word shingles above which chunks are near duplicates.")
+    parser.add_argument("--dedup-store", default=INGEST_DEDUP_STORE,
+                        help="SQLite signature store shared by every source writing to the index.")
+    parser.add_argument("--report", default=INGEST_REPORT,
+                        help="Write per-stage and per-file timings of the run to this JSON file.")
+    parser.add_argument("--profile-dir", default=INGEST_PROFILE_DIR,
+                        help="Profile every pipeline thread and extraction worker with cProfile, one .prof file each.")
+    return parser.parse_args()
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
+    args = parse_args()
+    backend_suffix = "" if args.backend == "elasticsearch" else f".{args.backend}"
+    if args.manifest is None:
+        source_suffix = ".drive" if args.source == "drive" else ""
+        args.manifest = f"./.ingest_state/{ES_INDEX_NAME}{backend_suffix}{source_suffix}.manifest.json"
+    if args.dedup_store is None:
+        # One store per index, so Drive copies of folder documents are found too
+        args.dedup_store = f"./.ingest_state/{ES_INDEX_NAME}{backend_suffix}.dedup.sqlite"
+    manifest_path = Path(args.manifest)
+    journal = RunJournal(manifest_path.with_suffix(".journal.jsonl"))
+    dead_letters = DeadLetterQueue(manifest_path.with_suffix(".dead_letter.jsonl"))
+    embedding_spec = get_embedding_model(args.embedding_model)
     logging.info("--- Starting Document Indexing Script (using FastEmbed) ---")
 
     # 1. Validate Configuration
-    if not ELASTIC_CLOUD_ID or not ELASTIC_API_KEY:
+    if args.backend == "elasticsearch" and (not ELASTIC_CLOUD_ID or not ELASTIC_API_KEY):
         logging.error("Elastic Cloud ID or API Key not found. Check .env or .env.local. Exiting.")
         exit(1)
+    if args.retry_failed and not len(dead_letters):
+        logging.info(f"No failed actions queued in '{dead_letters.path}'. Nothing to retry.")
+        exit(0)
     docs_path = Path(DOCS_FOLDER)
-    if not docs_path.is_dir():
+    drive_source = None
+    # Replays are self-contained: --retry-failed reads no source and loads no model
+    if args.source == "drive" and not args.retry_failed:
+        from api.google_drive import get_drive_service
+        from ingest.drive import DriveSource
+        try:
+            drive_service = get_drive_service(load_drive_credentials(Path(args.drive_token_file)))
+        except Exception as e:
+            logging.error(f"Could not authorize Google Drive with '{args.drive_token_file}': {e}", exc_info=True)
+            exit(1)
+        drive_source = DriveSource(drive_service, Path(args.drive_staging_dir), export_workers=args.drive_export_workers)
+    elif not args.retry_failed and not docs_path.is_dir():
         logging.error(f"Documents folder '{DOCS_FOLDER}' not found. Exiting.")
         exit(1)
 
-    # 2. Connect to Elasticsearch
-    logging.info("Connecting to Elasticsearch...")
-    try:
-        es_client = Elasticsearch(
-            cloud_id=ELASTIC_CLOUD_ID,
-            api_key=ELASTIC_API_KEY,
-            request_timeout=60
-        )
-        if not es_client.ping():
-             raise ConnectionError("Ping failed.")
-        logging.info("Connected to Elasticsearch successfully.")
-    except Exception as e:
-        logging.error(f"Failed to connect to Elasticsearch: {e}", exc_info=True)
-        exit(1)
+    # 2. Connect to the index target
+    if args.backend == "local":
+        target = LocalTarget(Path(args.local_index_dir), embedding_spec.dims, args.local_vector_dtype, args.local_ivf_lists)
+        logging.info(f"Writing a local index to '{args.local_index_dir}'.")
+    else:
+        logging.info("Connecting to Elasticsearch...")
+        try:
+            es_client = Elasticsearch(
+                cloud_id=ELASTIC_CLOUD_ID,
+                api_key=ELASTIC_API_KEY,
+                request_timeout=60
+            )
+            if not es_client.ping():
+                 raise ConnectionError("Ping failed.")
+            logging.info("Connected to Elasticsearch successfully.")
+        except Exception as e:
+            logging.error(f"Failed to connect to Elasticsearch: {e}", exc_info=True)
+            exit(1)
+        target = ElasticsearchTarget(es_client, ES_INDEX_NAME, bulk_chunk_size=BULK_BATCH_SIZE,
+                                     bulk_threads=args.bulk_threads, max_bulk_bytes=int(args.bulk_max_mb * 1024 * 1024))
+
+    dedup = None
+    if args.dedup != "off":
+        dedup = ChunkDeduplicator(Path(args.dedup_store), target.index_name, embedding_spec.fingerprint,
+                                  mode=args.dedup, threshold=args.dedup_threshold)
+        target = DeduplicatingTarget(target, dedup)
+        logging.info(f"Deduplicating chunks ({args.dedup}) with the signature store '{args.dedup_store}'.")
 
     # 3. Load Embedding Model
-    logging.info(f"Loading embedding model: {EMBEDDING_MODEL_NAME} (using FastEmbed)...")
+    embedder = Embedder(embedding_spec, runtime="fastembed", threads=args.onnx_threads)
     try:
-        # --- CHANGED: Use the correct class name 'TextEmbedding' ---
-        embedding_model = TextEmbedding(model_name=EMBEDDING_MODEL_NAME)
-        logging.info("Embedding model loaded.")
+        if not args.retry_failed:
+            embedder.load()
+            logging.info(f"Embedding model {embedding_spec.model_id} loaded ({embedding_spec.dims} dims).")
     except Exception as e:
         logging.error(f"Failed to load FastEmbed model: {e}", exc_info=True)
         logging.error("Make sure 'fastembed' and its dependencies are installed: pip install fastembed")
         exit(1)
 
-    # 4. Initialize Text Splitter (No Change)
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-        separators=["\n\n", "\n", " ", "", ".", ",", ";", ":", "(", ")", "[", "]", "{", "}"]
-    )
-
-    # 5. Prepare Index Mapping (No Change, EMBEDDING_DIM is still 384)
-    index_mapping = {
-        "properties": {
-            "file_name": {"type": "keyword"},
-            "path": {"type": "keyword"},
-            "content": {"type": "text", "index": False},
-            "content_type": {"type": "keyword"},
-            "chunk_text": {"type": "text"},
-            "chunk_vector": {
-                "type": "dense_vector",
-                "dims": EMBEDDING_DIM,
-                "index": True,
-                "similarity": "cosine"
-            },
-            "timestamp": {"type": "date"}
-        }
-    }
+    # 4. Prepare Index Mapping
+    try:
+        index_options = vector_index_options(args.vector_index_type, args.hnsw_m, args.hnsw_ef_construction)
+    except ValueError as e:
+        logging.error(str(e))
+        exit(1)
+    index_meta = {**model_meta(embedding_spec), "vector_options": index_options}
+    logging.info(f"Vector index options: {index_options or 'cluster default'}")
     try:
-        if es_client.indices.exists(index=ES_INDEX_NAME):
-            logging.info(f"Deleting existing index '{ES_INDEX_NAME}'...")
-            es_client.indices.delete(index=ES_INDEX_NAME)
-        if not es_client.indices.exists(index=ES_INDEX_NAME):
-            logging.info(f"Creating index '{ES_INDEX_NAME}' with mapping...")
-            es_client.indices.create(index=ES_INDEX_NAME, mappings=index_mapping, ignore=400)
+        index_exists = target.exists()
+        current_meta = target.index_meta() if index_exists else {}
+    except Exception as e:
+        logging.error(f"Error checking index '{target.index_name}': {e}", exc_info=True)
+        exit(1)
+    # Keys an older index does not record yet are taken as matching
+    conflicts = sorted(key for key, value in index_meta.items() if key in current_meta and current_meta[key] != value)
+    # Stamped on every rebuild; the folder and Drive manifests both record the build they were written against
+    generation = current_meta.get("index_generation")
+
+    # 5. Load the manifest of previously indexed files. Without one we cannot tell which
+    # documents in an existing index are stale, so fall back to a full build. The folder and
+    # Drive sources share the index: a rebuild by either one voids the other's manifest (and
+    # Drive page token), and that source then re-adds all of its files without rebuilding.
+    if args.retry_failed:
+        if not index_exists or conflicts:
+            logging.error(f"Index '{target.index_name}' is missing or was built with a different "
+                          f"{', '.join(conflicts) or 'layout'}; run a full build instead of --retry-failed.")
+            exit(1)
+        stored = read_manifest(manifest_path)
+        if stored is not None and stored.get("index_generation") != generation:
+            logging.error(f"Index '{target.index_name}' was rebuilt since the failed actions were queued; "
+                          f"run the {args.source} source again instead of --retry-failed.")
+            exit(1)
+        if generation:
+            index_meta["index_generation"] = generation
+        manifest = load_manifest(manifest_path, target.index_name, embedding_spec.fingerprint, index_options, generation)
+        try:
+            target.create(build_index_mapping(embedding_spec.dims, index_options, index_meta), recreate=False)
+            changed = retry_failed(target, manifest, dead_letters)
+            target.finish(changed=changed, meta=index_meta)
+            save_manifest(manifest_path, manifest)
+        except Exception as e:
+            logging.error(f"Failed to replay the dead-letter queue: {e}", exc_info=True)
+            exit(1)
+        dead_letters.save()
+        exit(0)
+
+    # An interrupted run left its journal behind. Files it completed are indexed and go into the
+    # manifest; files it started may be half written and are indexed again.
+    interrupted = journal.load() if journal.exists() else None
+    if interrupted and index_exists and interrupted[0].get("index_generation") != generation:
+        logging.warning("The index was rebuilt since the interrupted run; its journal no longer applies.")
+        interrupted = None
+    resuming = args.resume and interrupted is not None
+    if interrupted and not resuming and interrupted[0].get("full"):
+        logging.warning("The previous --full run was interrupted; rebuilding from scratch (pass --resume to continue it).")
+        args.full = True
+    elif args.resume and not interrupted:
+        logging.info("No interrupted run to resume.")
+
+    if not index_exists:
+        logging.info(f"Index '{target.index_name}' does not exist. Running a full build.")
+    elif conflicts:
+        logging.warning(f"Index '{target.index_name}' was built with a different {', '.join(conflicts)}. Rebuilding it.")
+    rebuild = not index_exists or bool(conflicts) or (args.full and not resuming)
+    if not rebuild:
+        manifest = new_manifest(target.index_name, embedding_spec.fingerprint, index_options, generation)
+        if resuming and interrupted[0].get("full"):
+            # The interrupted run replaced the index, so only what it completed is in there
+            manifest["files"].update(interrupted[2])
         else:
-             logging.info(f"Index '{ES_INDEX_NAME}' already exists.")
+            manifest = load_manifest(manifest_path, target.index_name, embedding_spec.fingerprint, index_options, generation)
+            if interrupted:
+                for file_key in interrupted[1]:
+                    manifest["files"].pop(file_key, None)
+                manifest["files"].update(interrupted[2])
+        stored = read_manifest(manifest_path)
+        rebuilt_elsewhere = stored is not None and stored.get("index_generation") not in (None, generation)
+        # A manifest that was never saved is missing, unreadable or stale
+        if not manifest["files"] and manifest["updated_at"] is None:
+            if rebuilt_elsewhere or drive_source:
+                # The other source's documents are in the index, so re-add every file instead of rebuilding
+                logging.info(f"No usable manifest at '{manifest_path}'. Indexing every {args.source} file again.")
+            else:
+                logging.info(f"No usable manifest at '{manifest_path}'. Running a full build.")
+                rebuild = True
+    if rebuild:
+        if index_exists:
+            other = "Google Drive" if args.source == "folder" else "folder"
+            logging.info(f"Any {other} documents in the index are dropped too; the next {other} run indexes them again.")
+        generation = str(time.time_ns())
+        manifest = new_manifest(target.index_name, embedding_spec.fingerprint, index_options, generation)
+        interrupted, resuming = None, False
+    if generation:
+        index_meta["index_generation"] = generation
+    incremental = bool(manifest["files"]) or (manifest["updated_at"] is not None)
+    if not incremental:
+        # Every file is read again, so nothing queued from earlier runs is replayed
+        dead_letters.clear()
+    try:
+        target.create(build_index_mapping(embedding_spec.dims, index_options, index_meta), recreate=rebuild)
+        if interrupted:
+            partial = {key: names for key, names in interrupted[1].items() if key not in interrupted[2]}
+            if partial:
+                logging.info(f"Dropping what the interrupted run wrote of {len(partial)} unfinished files.")
+            for file_name, relative_path in partial.values():
+                target.delete_file(file_name, relative_path)
     except Exception as e:
-        logging.error(f"Error creating/checking index '{ES_INDEX_NAME}': {e}", exc_info=True)
+        logging.error(f"Error creating/checking index '{target.index_name}': {e}", exc_info=True)
         exit(1)
-
-    # 6. Process Documents and Generate Bulk Actions
-    all_actions = []
-    file_count = 0
-    total_chunks_processed = 0
+    if resuming:
+        logging.info(f"Resuming the interrupted run: {len(interrupted[2])} files were already completed.")
+        journal.open()
+    else:
+        journal.open({"full": rebuild, "source": args.source, "index_generation": generation,
+                      "started_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())})
+
+    # file_key -> manifest key of the version a changed file replaces, filled in as files are selected
+    replaced_files = drive_source.replaced_files if drive_source else {}
+
+    def drop_replaced(file_key: str, keep: Iterable[str] = ()) -> None:
+        previous_key = replaced_files.pop(file_key)
+        relative_path, _, file_name = previous_key.rpartition('/')
+        target.delete_file(file_name, relative_path, keep=keep)
+        manifest["files"].pop(previous_key, None)
+
+    def record_completed(file_key: str, entry: dict) -> None:
+        if drive_source and file_key in drive_source.modified_times:
+            entry = {**entry, "modified_time": drive_source.modified_times[file_key]}
+        # The new version is fully indexed; only now do the old version's documents go
+        if file_key in replaced_files:
+            drop_replaced(file_key, keep=entry["doc_ids"])
+        journal.completed(file_key, entry)
+
+    # 6. Run the extraction -> embedding -> upload pipeline over new and changed files
+    if incremental:
+        logging.info(f"Incremental mode: {len(manifest['files'])} files recorded in '{manifest_path}'.")
+    seen_files = set()
+    counts = {"processed": 0, "skipped": 0}
+    pipeline = IngestPipeline(
+        target, embedder,
+        workers=args.workers,
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        embed_batch_size=args.embed_batch_size,
+        embed_parallel=args.embed_parallel,
+        max_document_chars=int(args.max_document_mb * 1_000_000) or None,
+        extract_timeout=args.extract_timeout or None,
+        profile_dir=Path(args.profile_dir) if args.profile_dir else None,
+        dedup=dedup,
+        on_file_indexed=record_completed
+    )
     start_time = time.time()
 
-    logging.info(f"Scanning documents in '{DOCS_FOLDER}' (including subdirectories)...")
-
-    for file_path in docs_path.rglob('*'):
-        if file_path.is_file():
-            file_name = file_path.name
-            try:
-                relative_path_obj = file_path.relative_to(docs_path).parent
-                relative_path = str(relative_path_obj).replace('\\', '/')
-                if relative_path == '.':
-                    relative_path = ''
-            except ValueError:
-                relative_path = ''
-
-
-            logging.info(f"Processing: {file_path}")
-            file_count += 1
-
-            full_content_raw, content_type = get_file_content_and_type(file_path)
-
-            if full_content_raw is None or not content_type:
-                logging.warning(f"  Skipping {file_name} due to read error or unsupported type.")
-                continue
-
-            # --- Prepare Full Content Field (No Change) ---
-            full_content_for_es = None
-            text_for_chunking = ""
-            if content_type == "pdf_base64":
-                full_content_for_es = base64.b64encode(full_content_raw).decode('utf-8')
-                text_for_chunking = extract_text_from_pdf(full_content_raw, str(file_path))
-            elif content_type == "text":
-                full_content_for_es = full_content_raw
-                text_for_chunking = full_content_raw
-            else:
-                 logging.warning(f"  Internal error: Unexpected content_type '{content_type}'. Skipping.")
-                 continue
-
-            if not text_for_chunking or text_for_chunking.isspace():
-                logging.warning(f"  No text available for chunking in {file_name}. Indexing document metadata only.")
-                doc_id = f"file-{os.path.join(relative_path, file_name)}-{file_path.stat().st_mtime}"
-                action = {
-                    "_index": ES_INDEX_NAME, "_id": doc_id,
-                    "_source": {
-                        "file_name": file_name, "path": relative_path,
-                        "content": full_content_for_es, "content_type": content_type,
-                        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
-                        "chunk_text": None, "chunk_vector": None
-                    }
-                }
-                all_actions.append(action)
-                continue
-
-            # --- Chunk the text (No Change) ---
-            try:
-                chunks = text_splitter.split_text(text_for_chunking)
-                if not chunks:
-                     logging.warning(f"  Text splitting resulted in zero chunks for {file_name}. Skipping.")
-                     continue
-                logging.info(f"  Split into {len(chunks)} chunks.")
-            except Exception as e_split:
-                 logging.error(f"  Error splitting text for {file_name}: {e_split}. Skipping file.")
-                 continue
-
-            # --- Embed chunks in a single batch (No Change from previous FastEmbed version) ---
-            try:
-                valid_chunks = [chunk for chunk in chunks if chunk and not chunk.isspace()]
-                if not valid_chunks:
-                    logging.warning(f"  No valid (non-empty) chunks found after splitting {file_name}. Skipping.")
-                    continue
-                
-                logging.info(f"  Embedding {len(valid_chunks)} chunks in one batch...")
-                vectors = list(embedding_model.embed(valid_chunks))
-                logging.info(f"  Embedding complete.")
-
-                if len(vectors) != len(valid_chunks):
-                    logging.error(f"  Mismatch in chunk count ({len(valid_chunks)}) and vector count ({len(vectors)}). Skipping file.")
-                    continue
-
-                for i, (chunk, vector) in enumerate(zip(valid_chunks, vectors)):
-                    chunk_id = f"chunk-{os.path.join(relative_path, file_name)}-{file_path.stat().st_mtime}-{i}"
-                    action = {
-                        "_index": ES_INDEX_NAME,
-                        "_id": chunk_id,
-                        "_source": {
-                            "file_name": file_name,
-                            "path": relative_path,
-                            "content": full_content_for_es,
-                            "content_type": content_type,
-                            "chunk_text": chunk,
-                            "chunk_vector": vector.tolist(),
-                            "timestamp": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
-                        }
-                    }
-                    all_actions.append(action)
-                
-                total_chunks_processed += len(valid_chunks)
-
-            except Exception as e_embed:
-                logging.error(f"  Error during batch embedding for {file_name}: {e_embed}", exc_info=True)
-                continue
-            
-            # --- Bulk Indexing in Batches (No Change) ---
-            if len(all_actions) >= 500:
-                logging.info(f"Indexing batch of {len(all_actions)} actions...")
-                try:
-                    success, failed = bulk(
-                        client=es_client.options(request_timeout=120),
-                        actions=all_actions,
-                        raise_on_error=False,
-                        raise_on_exception=False,
-                        max_retries=2,
-                        initial_backoff=1,
-                        max_backoff=5
-                    )
-                    logging.info(f"  Batch Indexing: {success} succeeded.")
-                    if failed:
-                        logging.error(f"  Batch Indexing Failed Docs: {len(failed)}")
-                    all_actions = []
-                except BulkIndexError as e_bulk:
-                     logging.error(f"BULK INDEXING ERROR: {len(e_bulk.errors)} docs failed.", exc_info=False)
-                     all_actions = []
-                except Exception as e_bulk_other:
-                    logging.error(f"Unexpected error during bulk indexing: {e_bulk_other}", exc_info=True)
-                    all_actions = []
-
-    # 7. Index any remaining actions (No Change)
-    if all_actions:
-        logging.info(f"Indexing final batch of {len(all_actions)} actions...")
+    if drive_source:
         try:
-             success, failed = bulk(
-                 client=es_client.options(request_timeout=120),
-                 actions=all_actions,
-                 raise_on_error=False,
-                 raise_on_exception=False,
-                 max_retries=2,
-                 initial_backoff=1,
-                 max_backoff=5
-             )
-             logging.info(f"  Final Batch Indexing: {success} succeeded.")
-             if failed:
-                 logging.error(f"  Final Batch Indexing Failed Docs: {len(failed)}")
-        except BulkIndexError as e_bulk:
-            logging.error(f"FINAL BULK INDEXING ERROR: {len(e_bulk.errors)} docs failed.", exc_info=False)
-        except Exception as e_bulk_other:
-            logging.error(f"Unexpected error during final bulk indexing: {e_bulk_other}", exc_info=True)
+            pipeline.run(journaled(drive_source.select_files(manifest, incremental, counts), journal))
+        finally:
+            drive_source.cleanup()
+    else:
+        logging.info(f"Scanning documents in '{DOCS_FOLDER}' (including subdirectories)...")
+        pipeline.run(journaled(select_files(docs_path, manifest, incremental, seen_files, replaced_files, counts), journal))
+
+    # 7. Drop documents of files that no longer exist
+    if drive_source:
+        removed_files = drive_source.removed_files
+    else:
+        removed_files = sorted(set(manifest["files"]) - seen_files) if incremental else []
+    for file_key in removed_files:
+        logging.info(f"Removing deleted file from index: {file_key}")
+        relative_path, _, file_name = file_key.rpartition('/')
+        target.delete_file(file_name, relative_path)
+        manifest["files"].pop(file_key)
+
+    target.finish(changed=not incremental or counts["processed"] > 0 or bool(removed_files), meta=index_meta)
+
+    # 8. Persist the manifest; files with documents that failed to index are left out so the next run retries them
+    indexed_at = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    completed = pipeline.completed_entries()
+    for file_key, entry in completed.items():
+        manifest["files"][file_key] = {**entry, "indexed_at": indexed_at}
+        if drive_source and file_key in drive_source.modified_times:
+            manifest["files"][file_key]["modified_time"] = drive_source.modified_times[file_key]
+    incomplete = sorted(set(pipeline.pending_entries) - set(completed))
+    for file_key in incomplete:
+        logging.warning(f"Not recording {file_key} in the manifest because some of its documents failed to index.")
+    # A changed file whose new version did not fully index is retried (or replayed) as a new file,
+    # so its old version goes now, keeping whatever of the new one made it
+    for file_key in [file_key for file_key in replaced_files if file_key not in completed]:
+        entry = pipeline.pending_entries.get(file_key)
+        drop_replaced(file_key, keep=entry["doc_ids"] if entry else ())
+
+    # Failed actions replace whatever was queued for the same files; a file whose missing documents
+    # are all queued can be recorded by --retry-failed without extracting it again
+    dead_letters.drop_files([*pipeline.pending_entries, *pipeline.failed_files, *removed_files])
+    for action, error in pipeline.failed_actions:
+        dead_letters.add_action(action, error)
+    replayable = dead_letters.replayable()
+    for file_key in incomplete:
+        missing = pipeline.missing_ids(file_key)
+        if missing <= replayable:
+            entry = pipeline.pending_entries[file_key]
+            if drive_source and file_key in drive_source.modified_times:
+                entry = {**entry, "modified_time": drive_source.modified_times[file_key]}
+            dead_letters.add_file(file_key, entry, missing)
+    if drive_source:
+        drive_source.store_start_page_token(manifest, failed=bool(pipeline.failed_files or incomplete))
+    try:
+        save_manifest(manifest_path, manifest)
+        logging.info(f"Manifest written to '{manifest_path}' ({len(manifest['files'])} files).")
+        journal.close(finished=True)
+    except Exception as e:
+        logging.error(f"Failed to write manifest '{manifest_path}': {e}")
+        journal.close(finished=False)
+    dead_letters.save()
 
     end_time = time.time()
     logging.info("--- Document Indexing Script Finished ---")
-    logging.info(f"Processed {file_count} files found in '{DOCS_FOLDER}'.")
-    logging.info(f"Generated and attempted to index {total_chunks_processed} chunks.")
-    logging.info(f"Total time: {end_time - start_time:.2f} seconds.")
-
+    logging.info(f"Processed {counts['processed']} files found in '{'Google Drive' if drive_source else DOCS_FOLDER}'.")
+    if incremental:
+        logging.info(f"Skipped {counts['skipped']} unchanged files.")
+    for line in pipeline.report():
+        logging.info(f"  {line}")
+    logging.info(f"Wall time: {end_time - start_time:.2f} seconds.")
+    if args.report:
+        write_report(Path(args.report), args, counts, end_time - start_time, pipeline)
+    if args.profile_dir:
+        logging.info(f"cProfile stats written to '{args.profile_dir}' (open with pstats or snakeviz).")
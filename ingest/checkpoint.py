@@ -0,0 +1,163 @@
+"""Durable progress of an indexing run, and the actions it could not index.
+
+The journal is appended to while a run is in progress: a header with the run's settings, a
+line when a file is handed to extraction and a line (with its manifest entry) once every
+document of the file is confirmed indexed. A finished run deletes it, so a journal on disk
+means the last run was interrupted; --resume merges its completed files into the manifest and
+carries on with the rest. Embedded batches of files that were in flight survive in the dedup
+signature store, whose vectors are re-used when those files are processed again.
+
+The dead-letter queue holds every action that still failed after the target's own retries,
+with the error, plus the manifest entry of each file whose only missing documents are in it,
+so --retry-failed can replay them without extracting or embedding anything.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Iterable
+
+# Journal writes are flushed at once but synced to disk at most this often
+JOURNAL_SYNC_SECONDS = 1.0
+
+
+def _jsonable(value):
+    # NumPy vectors and scalars in bulk actions
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def file_key_of(action: dict) -> str | None:
+    """The file an index action belongs to, from its file_name and path."""
+    source = action.get("_source") or {}
+    if "file_name" not in source:
+        return None
+    return f"{source['path']}/{source['file_name']}" if source.get("path") else source["file_name"]
+
+
+class RunJournal:
+    """Append-only record of the run in progress."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._file = None
+        self._synced_at = 0.0
+        # Files are started by the scan and completed by the upload thread
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return self.path.is_file()
+
+    def load(self) -> tuple[dict, dict[str, tuple[str, str]], dict[str, dict]]:
+        """Returns the interrupted run's settings, the files it started as file_key -> (file_name,
+        relative_path), and the manifest entries of the files it completed."""
+        header, started, completed = {}, {}, {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # The last line of a crashed run may be cut short
+                    continue
+                if "run" in record:
+                    header = record["run"]
+                elif "started" in record:
+                    started[record["started"]] = (record["file_name"], record["relative_path"])
+                elif "completed" in record:
+                    completed[record["completed"]] = record["entry"]
+        return header, started, completed
+
+    def open(self, settings: dict | None = None) -> None:
+        """Starts a new journal with settings as its header, or appends to the existing one without."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "a" if settings is None else "w", encoding="utf-8")
+        if settings is not None:
+            self._append({"run": settings}, sync=True)
+
+    def _append(self, record: dict, sync: bool = False) -> None:
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            now = time.monotonic()
+            if sync or now - self._synced_at >= JOURNAL_SYNC_SECONDS:
+                os.fsync(self._file.fileno())
+                self._synced_at = now
+
+    def started(self, file_key: str, file_name: str, relative_path: str) -> None:
+        self._append({"started": file_key, "file_name": file_name, "relative_path": relative_path})
+
+    def completed(self, file_key: str, entry: dict) -> None:
+        self._append({"completed": file_key, "entry": entry})
+
+    def close(self, finished: bool) -> None:
+        """Closes the journal, deleting it once the run's manifest has been written."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if finished:
+            self.path.unlink(missing_ok=True)
+
+
+class DeadLetterQueue:
+    """Failed actions and replayable file entries, one JSON record per line."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.actions: list[dict] = []
+        self.files: dict[str, dict] = {}
+        if self.path.is_file():
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    if record["kind"] == "file":
+                        self.files[record["file_key"]] = record
+                    else:
+                        self.actions.append(record)
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def drop_files(self, file_keys: Iterable[str]) -> None:
+        """Forgets what is queued for files that were re-indexed or removed since."""
+        file_keys = set(file_keys)
+        self.actions = [record for record in self.actions if record.get("file_key") not in file_keys]
+        self.files = {key: record for key, record in self.files.items() if key not in file_keys}
+
+    def clear(self) -> None:
+        """Forgets everything queued, when every file is about to be indexed again."""
+        self.actions = []
+        self.files = {}
+
+    def add_action(self, action: dict, error) -> None:
+        self.actions.append({
+            "kind": "action",
+            "file_key": file_key_of(action),
+            "doc_id": action["_id"],
+            "error": error if isinstance(error, (str, dict)) or error is None else str(error),
+            "failed_at": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            "action": action,
+        })
+
+    def add_file(self, file_key: str, entry: dict, missing: Iterable[str]) -> None:
+        """Queues a file's manifest entry, recorded once its missing documents are replayed."""
+        self.files[file_key] = {"kind": "file", "file_key": file_key, "entry": entry, "missing": sorted(missing)}
+
+    def replayable(self) -> set[str]:
+        return {record["doc_id"] for record in self.actions}
+
+    def save(self) -> None:
+        """Rewrites the queue atomically; an empty queue deletes the file."""
+        if not self.actions and not self.files:
+            self.path.unlink(missing_ok=True)
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in [*self.actions, *self.files.values()]:
+                f.write(json.dumps(record, default=_jsonable) + "\n")
+        os.replace(tmp_path, self.path)
+        logging.warning(f"{len(self.actions)} failed actions are queued in '{self.path}'; "
+                        f"run with --retry-failed to replay them.")
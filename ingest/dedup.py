@@ -0,0 +1,329 @@
+"""Exact and near-duplicate chunk detection for the indexer.
+
+Every chunk is keyed by a hash of its whitespace-normalised text and, in "near" mode, by a
+MinHash signature of its word shingles, bucketed with LSH so candidates are found without a
+scan. The first chunk seen with some content is its canonical copy and is embedded. Later
+copies are indexed as references: the same text and metadata, duplicate=true and no vector.
+References cost no embedding time, take no room in the vector index and never crowd kNN
+results, and lexical search skips them unless it is restricted to a folder or file.
+
+"exact" (the default) only references byte-identical text after whitespace normalisation.
+"near" is opt-in: a chunk that merely resembles an indexed one loses its own vector and is
+hidden from unfiltered lexical search, so text that really differs can become hard to find.
+
+The signature store is a SQLite file kept next to the manifest. It holds each canonical
+chunk's vector and the chunks referencing it, so that:
+- a copy found in a later run is never embedded;
+- deleting the file that holds a canonical chunk promotes one of its references in place
+  with the stored vector;
+- a changed file re-uses the vectors of the chunks it kept.
+"""
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator
+import numpy as np
+
+DEDUP_MODES = ["off", "exact", "near"]
+# Bump when hashing, shingling or the signature layout changes; older stores are reset.
+DEDUP_STORE_VERSION = 1
+NUM_PERM = 64
+# 8 bands of 8 rows: pairs above ~0.77 estimated Jaccard usually share a bucket
+LSH_BANDS = 8
+SHINGLE_WORDS = 5
+# Chunks with fewer shingles are only matched exactly; short boilerplate is too easy to confuse
+MIN_SHINGLES = 8
+
+# Outcomes of ChunkDeduplicator.assign
+EMBED = "embed"
+REUSE = "reuse"
+REFERENCE = "reference"
+
+_MERSENNE = (1 << 32) + 15
+_MAX_HASH = (1 << 32) - 1
+_PERMUTATIONS = np.random.RandomState(1).randint(1, _MAX_HASH, size=(2, NUM_PERM), dtype=np.uint64)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS content (
+    hash TEXT PRIMARY KEY,
+    chunk_id TEXT,
+    vector BLOB,
+    signature BLOB
+);
+CREATE INDEX IF NOT EXISTS content_by_chunk ON content (chunk_id);
+CREATE TABLE IF NOT EXISTS refs (
+    chunk_id TEXT PRIMARY KEY,
+    file_key TEXT NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS refs_by_file ON refs (file_key);
+CREATE INDEX IF NOT EXISTS refs_by_hash ON refs (hash);
+CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket INTEGER NOT NULL, hash TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS bands_by_bucket ON bands (band, bucket);
+"""
+
+
+def text_hash(text: str) -> str:
+    """Hash of a chunk's text with whitespace runs collapsed, so re-flowed copies still match."""
+    return hashlib.blake2b(" ".join(text.split()).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def minhash(text: str) -> np.ndarray | None:
+    """MinHash signature (NUM_PERM uint32 values) of the text's word shingles; None if it is too short."""
+    words = text.lower().split()
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    a, b = _PERMUTATIONS
+    # (a * h + b) stays below 2**64 because a, b and h are all below 2**32
+    permuted = (a[:, None] * hashes[None, :] + b[:, None]) % _MERSENNE & _MAX_HASH
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def lsh_buckets(signature: np.ndarray) -> list[tuple[int, int]]:
+    """(band, bucket) keys of a signature; similar signatures share at least one with high probability."""
+    rows = NUM_PERM // LSH_BANDS
+    return [(band, int.from_bytes(hashlib.blake2b(signature[band * rows:(band + 1) * rows].tobytes(),
+                                                  digest_size=8).digest(), "little", signed=True))
+            for band in range(LSH_BANDS)]
+
+
+@dataclass
+class Assignment:
+    """What to index for one chunk: embed it, re-use a stored vector, or reference a canonical chunk."""
+    action: str
+    vector: np.ndarray | None = None
+    canonical_id: str | None = None
+    # The canonical chunk is still waiting to be embedded in this run
+    pending: bool = False
+
+
+class ChunkDeduplicator:
+    """The persisted signature index. Thread-safe: the embedding stage assigns chunks while the
+    scan releases the files it deletes."""
+
+    def __init__(self, store_path: Path, index_name: str, model_fingerprint: str, mode: str = "exact",
+                 threshold: float = 0.9):
+        if mode not in DEDUP_MODES[1:]:
+            raise ValueError(f"Unknown dedup mode '{mode}'. Expected 'exact' or 'near'.")
+        self.store_path = Path(store_path)
+        self.mode = mode
+        self.threshold = threshold
+        self.meta = {"version": str(DEDUP_STORE_VERSION), "index": index_name, "embedding_model": model_fingerprint}
+        self._lock = threading.Lock()
+        # Canonical chunks registered in this run whose vectors are not stored yet
+        self._pending: set[str] = set()
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.store_path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        stored = dict(self._db.execute("SELECT key, value FROM meta").fetchall())
+        if stored and stored != self.meta:
+            logging.warning(f"Dedup store {self.store_path} was built for a different index, model or layout. Resetting it.")
+            self.reset()
+        elif not stored:
+            self._write_meta()
+
+    def _write_meta(self) -> None:
+        self._db.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", self.meta.items())
+        self._db.commit()
+
+    def reset(self) -> None:
+        """Forgets every signature and vector, for a rebuilt index."""
+        with self._lock:
+            for table in ("meta", "content", "refs", "bands"):
+                self._db.execute(f"DELETE FROM {table}")
+            self._pending.clear()
+            self._write_meta()
+
+    def assign(self, chunk_id: str, file_key: str, text: str) -> Assignment:
+        """Records chunk_id as indexed for file_key and decides how it is indexed."""
+        content = text_hash(text)
+        with self._lock:
+            db = self._db
+            row = db.execute("SELECT chunk_id, vector FROM content WHERE hash = ?", (content,)).fetchone()
+            if row is not None:
+                canonical_id, vector = row
+                db.execute("INSERT OR REPLACE INTO refs (chunk_id, file_key, hash) VALUES (?, ?, ?)",
+                           (chunk_id, file_key, content))
+                if canonical_id is not None and canonical_id != chunk_id:
+                    return Assignment(REFERENCE, canonical_id=canonical_id, pending=canonical_id in self._pending)
+                # Content whose file was deleted or changed earlier in this run, or this very chunk retried
+                db.execute("UPDATE content SET chunk_id = ? WHERE hash = ?", (chunk_id, content))
+                if vector is not None:
+                    return Assignment(REUSE, vector=np.frombuffer(vector, dtype=np.float32))
+                self._pending.add(chunk_id)
+                return Assignment(EMBED)
+
+            signature = minhash(text) if self.mode == "near" else None
+            if signature is not None:
+                match = self._near_match(signature)
+                if match is not None:
+                    near_hash, canonical_id = match
+                    db.execute("INSERT OR REPLACE INTO refs (chunk_id, file_key, hash) VALUES (?, ?, ?)",
+                               (chunk_id, file_key, near_hash))
+                    return Assignment(REFERENCE, canonical_id=canonical_id, pending=canonical_id in self._pending)
+
+            db.execute("INSERT INTO content (hash, chunk_id, vector, signature) VALUES (?, ?, NULL, ?)",
+                       (content, chunk_id, signature.tobytes() if signature is not None else None))
+            if signature is not None:
+                db.executemany("INSERT INTO bands (band, bucket, hash) VALUES (?, ?, ?)",
+                               [(band, bucket, content) for band, bucket in lsh_buckets(signature)])
+            db.execute("INSERT OR REPLACE INTO refs (chunk_id, file_key, hash) VALUES (?, ?, ?)",
+                       (chunk_id, file_key, content))
+            self._pending.add(chunk_id)
+            return Assignment(EMBED)
+
+    def _near_match(self, signature: np.ndarray) -> tuple[str, str] | None:
+        """The indexed content most similar to signature above the threshold, as (hash, chunk_id)."""
+        buckets = lsh_buckets(signature)
+        candidates = self._db.execute(
+            "SELECT c.hash, c.chunk_id, c.signature FROM content c WHERE c.chunk_id IS NOT NULL AND c.hash IN"
+            f" (SELECT hash FROM bands WHERE {' OR '.join(['(band = ? AND bucket = ?)'] * len(buckets))})",
+            [value for bucket in buckets for value in bucket]).fetchall()
+        best, best_similarity = None, self.threshold
+        for content, canonical_id, blob in candidates:
+            # The fraction of equal MinHash values estimates the Jaccard similarity of the shingle sets
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = (content, canonical_id), similarity
+        return best
+
+    def store_vectors(self, vectors: Iterable[tuple[str, np.ndarray]]) -> None:
+        """Keeps the vectors of newly embedded canonical chunks, for re-use and promotion."""
+        with self._lock:
+            rows = []
+            for chunk_id, vector in vectors:
+                if chunk_id in self._pending:
+                    self._pending.discard(chunk_id)
+                    rows.append((np.asarray(vector, dtype=np.float32).tobytes(), chunk_id))
+            self._db.executemany("UPDATE content SET vector = ? WHERE chunk_id = ?", rows)
+            self._db.commit()
+
+    def forget(self, chunk_ids: Iterable[str]) -> None:
+        """Drops canonical chunks that failed to embed; files referencing them are retried next run."""
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if chunk_id in self._pending:
+                    self._pending.discard(chunk_id)
+                    self._delete_content("chunk_id = ?", (chunk_id,))
+            self._db.commit()
+
+    def _delete_content(self, condition: str, params: tuple) -> None:
+        self._db.execute(f"DELETE FROM bands WHERE hash IN (SELECT hash FROM content WHERE {condition})", params)
+        self._db.execute(f"DELETE FROM content WHERE {condition}", params)
+
+    def release_file(self, file_key: str, keep: set[str] = frozenset()) -> tuple[set[str], list[tuple[str, np.ndarray]]]:
+        """Forgets a deleted file's chunks, other than those in keep. Returns their IDs, and
+        (chunk_id, vector) for each reference that now holds their content, to be written back to
+        the index with the vector."""
+        promotions = []
+        with self._lock:
+            db = self._db
+            released = [(chunk_id,) for (chunk_id,) in
+                        db.execute("SELECT chunk_id FROM refs WHERE file_key = ?", (file_key,)).fetchall()
+                        if chunk_id not in keep]
+            db.executemany("DELETE FROM refs WHERE chunk_id = ?", released)
+            for (chunk_id,) in released:
+                row = db.execute("SELECT hash, vector FROM content WHERE chunk_id = ?", (chunk_id,)).fetchone()
+                if row is None:
+                    continue
+                content, vector = row
+                successor = db.execute("SELECT chunk_id FROM refs WHERE hash = ? LIMIT 1", (content,)).fetchone()
+                if vector is None:
+                    self._pending.discard(chunk_id)
+                    self._delete_content("hash = ?", (content,))
+                elif successor is not None:
+                    db.execute("UPDATE content SET chunk_id = ? WHERE hash = ?", (successor[0], content))
+                    promotions.append((successor[0], np.frombuffer(vector, dtype=np.float32)))
+                else:
+                    # Kept until the end of the run, so a changed file re-uses the vectors of unchanged chunks
+                    db.execute("UPDATE content SET chunk_id = NULL WHERE hash = ?", (content,))
+            db.commit()
+        return {chunk_id for (chunk_id,) in released}, promotions
+
+    def stats(self) -> dict:
+        with self._lock:
+            contents, refs = (self._db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                              for table in ("content", "refs"))
+        return {"contents": contents, "chunks": refs}
+
+    def close(self) -> None:
+        """Drops content no file holds any more and closes the store."""
+        with self._lock:
+            self._delete_content("chunk_id IS NULL", ())
+            self._db.commit()
+            self._db.close()
+
+
+class DeduplicatingTarget:
+    """Wraps an index target so that deleting a file promotes references to the chunks it held.
+
+    Promotions are partial updates (the stored vector, duplicate=false) written ahead of the
+    next action the pipeline uploads, or by finish() for deletions after the run.
+    """
+
+    def __init__(self, target, dedup: ChunkDeduplicator):
+        self.target = target
+        self.dedup = dedup
+        self.index_name = target.index_name
+        self.promoted = 0
+        self._promotions = deque()
+        self._lock = threading.Lock()
+
+    def exists(self) -> bool:
+        return self.target.exists()
+
+    def index_meta(self) -> dict:
+        return self.target.index_meta()
+
+    def create(self, mapping: dict, recreate: bool = False) -> None:
+        self.target.create(mapping, recreate=recreate)
+        if recreate:
+            self.dedup.reset()
+
+    def delete_file(self, file_name: str, relative_path: str, keep: Iterable[str] = ()) -> None:
+        keep = set(keep)
+        self.target.delete_file(file_name, relative_path, keep)
+        file_key = f"{relative_path}/{file_name}" if relative_path else file_name
+        released, promotions = self.dedup.release_file(file_key, keep)
+        with self._lock:
+            # A promotion queued for a chunk of this file would now update a deleted document
+            self._promotions = deque(action for action in self._promotions if action["_id"] not in released)
+            self._promotions.extend({
+                "_op_type": "update",
+                "_index": self.index_name,
+                "_id": chunk_id,
+                "doc": {"duplicate": False, "chunk_vector": vector}
+            } for chunk_id, vector in promotions)
+
+    def _take_promotions(self) -> list[dict]:
+        with self._lock:
+            promotions, self._promotions = list(self._promotions), deque()
+        self.promoted += len(promotions)
+        return promotions
+
+    def _with_promotions(self, actions: Iterable[dict]) -> Iterator[dict]:
+        for action in actions:
+            yield from self._take_promotions()
+            yield action
+        yield from self._take_promotions()
+
+    def write(self, actions: Iterable[dict]) -> Iterator[tuple[bool, str, object]]:
+        return self.target.write(self._with_promotions(actions))
+
+    def finish(self, changed: bool, meta: dict | None = None) -> None:
+        for ok, doc_id, error in self.target.write(self._take_promotions()):
+            if not ok:
+                logging.error(f"  Failed to promote {doc_id}: {error}")
+        if self.promoted:
+            logging.info(f"Promoted {self.promoted} duplicate chunks whose canonical copy was deleted.")
+        self.target.finish(changed or self.promoted > 0, meta)
+        self.dedup.close()
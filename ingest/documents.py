@@ -0,0 +1,336 @@
+import time
+import base64
+import signal
+import logging
+import zipfile
+from xml.etree import ElementTree
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+import PyPDF2
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 150
+TEXT_SUFFIXES = [".txt", ".md", ".csv", ".py", ".js", ".ts", ".html", ".css", ".json", ".yaml", ".yml"]
+# Chunks sent to the embedding stage per message, and text read from plain files per segment
+CHUNK_SLICE_SIZE = 64
+TEXT_BLOCK_SIZE = 256 * 1024
+# PDFs are base64-encoded from disk in blocks of this many bytes (a multiple of 3, so blocks concatenate)
+PDF_ENCODE_BLOCK_SIZE = 3 * 256 * 1024
+# The chunker splits once this many characters are buffered, so it never holds a whole document
+SPLIT_BUFFER_CHUNKS = 32
+
+_WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+# Set per worker process by init_worker: the splitter is built once, not once per file
+_text_splitter = None
+_chunk_queue = None
+_split_buffer_chars = CHUNK_SIZE * SPLIT_BUFFER_CHUNKS
+_max_document_chars = None
+_extract_timeout = None
+_profiler = None
+
+
+@dataclass
+class ChunkSlice:
+    """A run of consecutive chunks of one file, sent to the embedding stage as soon as it is split."""
+    file_key: str
+    file_name: str
+    relative_path: str
+    content_hash: str
+    start: int
+    chunks: list[str]
+
+
+@dataclass
+class PreparedFile:
+    """Sent after a file's last ChunkSlice: everything needed for its parent document record."""
+    file_key: str
+    file_name: str
+    relative_path: str
+    content_hash: str
+    content: str | None = None
+    content_type: str | None = None
+    chunk_count: int = 0
+    num_bytes: int = 0
+    truncated: bool = False
+    # extract_seconds covers the whole file; parse and wait are the parts spent reading the
+    # source format and blocked on the embedding stage, and the rest is splitting
+    extract_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    wait_seconds: float = 0.0
+
+
+@dataclass
+class FileFailed:
+    """Sent instead of PreparedFile when a file is skipped; any chunks already sent must be discarded."""
+    file_key: str
+    file_name: str
+    relative_path: str
+    reason: str
+
+
+class ExtractionTimeout(BaseException):
+    """Raised by SIGALRM. Not an Exception, so parsers that swallow their own errors cannot hide it."""
+
+
+def build_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Returns the text splitter used for every document."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", " ", "", ".", ",", ";", ":", "(", ")", "[", "]", "{", "}"]
+    )
+
+
+def init_worker(chunk_size: int, chunk_overlap: int, chunk_queue, max_document_chars: int | None = None,
+                extract_timeout: float | None = None, profile_dir: str | None = None) -> None:
+    """Process-pool initializer: builds this worker's text splitter and keeps the queue chunks are sent on.
+
+    With profile_dir, the worker runs under cProfile and dumps its stats there when it exits.
+    """
+    global _text_splitter, _chunk_queue, _split_buffer_chars, _max_document_chars, _extract_timeout, _profiler
+    _text_splitter = build_text_splitter(chunk_size, chunk_overlap)
+    _chunk_queue = chunk_queue
+    _split_buffer_chars = chunk_size * SPLIT_BUFFER_CHUNKS
+    _max_document_chars = max_document_chars
+    _extract_timeout = extract_timeout
+    if profile_dir:
+        import os
+        import cProfile
+        from multiprocessing import util
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+        # Pool workers leave through os._exit, which skips atexit but runs multiprocessing finalizers
+        util.Finalize(None, _dump_profile, args=(f"{profile_dir}/extract-worker-{os.getpid()}.prof",), exitpriority=10)
+
+
+def _dump_profile(path: str) -> None:
+    _profiler.disable()
+    _profiler.dump_stats(path)
+
+
+def iter_document_files(docs_path: Path) -> Iterator[tuple[Path, str, str, str]]:
+    """Walks a documents folder, yielding (file_path, file_key, file_name, relative_path).
+
+    relative_path is the POSIX folder relative to docs_path ('' at the root) and file_key is
+    relative_path joined with file_name; together they identify a file across runs.
+    """
+    for file_path in docs_path.rglob('*'):
+        if not file_path.is_file():
+            continue
+        file_name = file_path.name
+        try:
+            relative_path = file_path.relative_to(docs_path).parent.as_posix()
+            if relative_path == '.':
+                relative_path = ''
+        except ValueError:
+            relative_path = ''
+        file_key = f"{relative_path}/{file_name}" if relative_path else file_name
+        yield file_path, file_key, file_name, relative_path
+
+
+def content_type_for(file_path: Path) -> str | None:
+    """"pdf_base64" or "text" for supported files, None otherwise."""
+    suffix = file_path.suffix.lower()
+    if suffix == ".pdf":
+        return "pdf_base64"
+    if suffix == ".docx" or suffix in TEXT_SUFFIXES:
+        return "text"
+    return None
+
+
+def iter_pdf_pages(file_path: Path) -> Iterator[str]:
+    """Yields the text of a PDF one page at a time."""
+    reader = PyPDF2.PdfReader(file_path)
+    if reader.is_encrypted:
+        try:
+            reader.decrypt('')
+        except Exception as decrypt_error:
+            logging.warning(f"Skipping encrypted PDF (password needed): {file_path} - {decrypt_error}")
+            return
+    for page in reader.pages:
+        page_text = page.extract_text()
+        if page_text:
+            yield page_text + "\n"
+
+
+def iter_docx_paragraphs(file_path: Path) -> Iterator[str]:
+    """Yields the paragraphs of a .docx, parsing document.xml incrementally instead of into a full DOM."""
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as document:
+        for _, element in ElementTree.iterparse(document, events=("end",)):
+            if element.tag != f"{_WORD_NS}p":
+                continue
+            parts = []
+            for node in element.iter():
+                if node.tag == f"{_WORD_NS}t" and node.text:
+                    parts.append(node.text)
+                elif node.tag == f"{_WORD_NS}tab":
+                    parts.append("\t")
+                elif node.tag in (f"{_WORD_NS}br", f"{_WORD_NS}cr"):
+                    parts.append("\n")
+            element.clear()
+            yield "".join(parts) + "\n"
+
+
+def iter_text_blocks(file_path: Path) -> Iterator[str]:
+    with open(file_path, "r", encoding="utf-8", errors='ignore') as f:
+        while block := f.read(TEXT_BLOCK_SIZE):
+            yield block
+
+
+def encode_base64(file_path: Path) -> str:
+    """A file's base64 encoding, read in blocks so its raw bytes are never held alongside the encoding."""
+    parts = []
+    with open(file_path, "rb") as f:
+        while block := f.read(PDF_ENCODE_BLOCK_SIZE):
+            parts.append(base64.b64encode(block).decode("ascii"))
+    return "".join(parts)
+
+
+def iter_text_segments(file_path: Path) -> Iterator[str]:
+    """Yields a supported file's text in pieces: pages, paragraphs or fixed-size blocks."""
+    suffix = file_path.suffix.lower()
+    if suffix == ".pdf":
+        return iter_pdf_pages(file_path)
+    if suffix == ".docx":
+        return iter_docx_paragraphs(file_path)
+    return iter_text_blocks(file_path)
+
+
+def iter_chunks(segments: Iterable[str], splitter: RecursiveCharacterTextSplitter, buffer_chars: int) -> Iterator[str]:
+    """Splits a stream of text segments into chunks while buffering only about buffer_chars of text.
+
+    The last chunk of every split is carried into the next one, so chunk boundaries and overlap
+    match splitting the whole text except right at the buffer edges.
+    """
+    carry = ""
+    parts = []
+    buffered = 0
+    for segment in segments:
+        parts.append(segment)
+        buffered += len(segment)
+        if buffered >= buffer_chars:
+            chunks = splitter.split_text(carry + "".join(parts))
+            parts, buffered = [], 0
+            carry = chunks.pop() if chunks else ""
+            yield from chunks
+    yield from splitter.split_text(carry + "".join(parts))
+
+
+def _raise_timeout(signum, frame):
+    raise ExtractionTimeout()
+
+
+def _send_slice(chunk_slice: ChunkSlice) -> float:
+    """Sends one slice and returns the seconds spent waiting for room on the queue."""
+    # Blocks while the embedding stage is behind, which bounds the chunks held in memory. The
+    # extraction timeout is paused meanwhile so slow embedding never counts against a file.
+    remaining = signal.setitimer(signal.ITIMER_REAL, 0)[0] if hasattr(signal, "SIGALRM") else 0
+    start = time.perf_counter()
+    _chunk_queue.put(chunk_slice)
+    waited = time.perf_counter() - start
+    if remaining:
+        signal.setitimer(signal.ITIMER_REAL, remaining)
+    return waited
+
+
+def prepare_file(file_path: str, file_key: str, file_name: str, relative_path: str, content_hash: str) -> int:
+    """Extracts and splits one file inside a process-pool worker, streaming its chunks to the
+    embedding stage. Always ends with exactly one PreparedFile or FileFailed on the queue and
+    returns the number of chunks sent."""
+    path = Path(file_path)
+    content_type = content_type_for(path)
+    if content_type is None:
+        logging.warning(f"Skipping unsupported file type: {file_name}")
+        _chunk_queue.put(FileFailed(file_key, file_name, relative_path, "unsupported file type"))
+        return 0
+
+    # SIGALRM interrupts even a single pathological page; the pool runs tasks on the worker's main thread
+    use_alarm = bool(_extract_timeout) and hasattr(signal, "SIGALRM")
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, _extract_timeout)
+    try:
+        prepared = _stream_file(path, file_key, file_name, relative_path, content_hash, content_type)
+    except ExtractionTimeout:
+        logging.error(f"  Extraction of {file_name} exceeded {_extract_timeout:g}s. Skipping file.")
+        prepared = FileFailed(file_key, file_name, relative_path, f"timed out after {_extract_timeout:g}s")
+    except Exception as e:
+        logging.error(f"  Error extracting {file_name}: {e}. Skipping file.")
+        prepared = FileFailed(file_key, file_name, relative_path, str(e))
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+    _chunk_queue.put(prepared)
+    return prepared.chunk_count if isinstance(prepared, PreparedFile) else 0
+
+
+def _stream_file(path: Path, file_key: str, file_name: str, relative_path: str, content_hash: str,
+                 content_type: str) -> PreparedFile:
+    start = time.perf_counter()
+    prepared = PreparedFile(file_key=file_key, file_name=file_name, relative_path=relative_path,
+                            content_hash=content_hash, content_type=content_type, num_bytes=path.stat().st_size)
+    limit = _max_document_chars
+
+    # The parent record keeps the original PDF, or the extracted text, whole: it is one field of one
+    # document, so the document ceiling (not the slice size) is what bounds this worker's memory
+    content_parts = None
+    if content_type == "pdf_base64":
+        if limit is None or prepared.num_bytes <= limit:
+            prepared.content = encode_base64(path)
+        else:
+            logging.warning(f"  {file_name} is larger than the document ceiling; not storing its content.")
+    else:
+        content_parts = []
+    prepared.parse_seconds = time.perf_counter() - start
+
+    def timed_segments() -> Iterator[str]:
+        segments = iter_text_segments(path)
+        while True:
+            parse_start = time.perf_counter()
+            segment = next(segments, None)
+            prepared.parse_seconds += time.perf_counter() - parse_start
+            if segment is None:
+                return
+            yield segment
+
+    def limited_segments() -> Iterator[str]:
+        extracted = 0
+        for segment in timed_segments():
+            if limit is not None and extracted + len(segment) > limit:
+                segment = segment[:limit - extracted]
+                prepared.truncated = True
+            extracted += len(segment)
+            if content_parts is not None:
+                content_parts.append(segment)
+            yield segment
+            if prepared.truncated:
+                logging.warning(f"  {file_name} exceeds the document ceiling of {limit} characters. Truncating.")
+                return
+
+    splitter = _text_splitter or build_text_splitter(CHUNK_SIZE, CHUNK_OVERLAP)
+    pending = []
+    for chunk in iter_chunks(limited_segments(), splitter, _split_buffer_chars):
+        if not chunk or chunk.isspace():
+            continue
+        pending.append(chunk)
+        if len(pending) >= CHUNK_SLICE_SIZE:
+            prepared.wait_seconds += _send_slice(ChunkSlice(file_key, file_name, relative_path, content_hash,
+                                                            prepared.chunk_count, pending))
+            prepared.chunk_count += len(pending)
+            pending = []
+    if pending:
+        prepared.wait_seconds += _send_slice(ChunkSlice(file_key, file_name, relative_path, content_hash,
+                                                        prepared.chunk_count, pending))
+        prepared.chunk_count += len(pending)
+
+    if content_parts is not None:
+        prepared.content = "".join(content_parts)
+    if not prepared.chunk_count:
+        logging.warning(f"  No text available for chunking in {file_name}. Indexing document metadata only.")
+    prepared.extract_seconds = time.perf_counter() - start
+    return prepared
@@ -0,0 +1,229 @@
+import io
+import shutil
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator
+from api.google_drive import GOOGLE_API_RETRIES, iter_drive_files, mime_type_query
+from ingest.manifest import file_sha256
+from ingest.pipeline import FileTask
+
+# Drive mimeType -> (export mimeType, or None to download the file as stored, staged file suffix).
+# The suffix decides how the extraction stage reads the staged file.
+DRIVE_EXPORTS = {
+    'application/vnd.google-apps.document': ('text/plain', '.txt'),
+    'application/vnd.google-apps.spreadsheet': ('text/csv', '.csv'),
+    'application/pdf': (None, '.pdf'),
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': (None, '.docx'),
+    'text/plain': (None, '.txt'),
+    'text/markdown': (None, '.md'),
+    'text/csv': (None, '.csv'),
+}
+DRIVE_SYNC_FIELDS = "id, name, mimeType, modifiedTime, trashed"
+# Manifest keys of Drive files start with this; the folder below it is the file ID
+DRIVE_KEY_PREFIX = "drive/"
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+@dataclass
+class DriveFile:
+    file_id: str
+    name: str
+    mime_type: str
+    modified_time: str
+
+    @property
+    def relative_path(self) -> str:
+        return f"{DRIVE_KEY_PREFIX}{self.file_id}"
+
+    @property
+    def file_name(self) -> str:
+        # Keys are split on the last '/', so names must not contain one
+        return self.name.replace("/", "_") or self.file_id
+
+    @property
+    def file_key(self) -> str:
+        return f"{self.relative_path}/{self.file_name}"
+
+
+def drive_file_id(file_key: str) -> str | None:
+    """The Drive file ID of a manifest key, or None for keys of other sources."""
+    if not file_key.startswith(DRIVE_KEY_PREFIX):
+        return None
+    return file_key[len(DRIVE_KEY_PREFIX):].partition("/")[0]
+
+
+class DriveSource:
+    """Selects Drive files for the ingest pipeline, exporting them to a staging folder first.
+
+    The first run (or one without a stored start page token) pages through the whole listing;
+    later runs read only the Drive changes since the token saved in the manifest. Exports run
+    concurrently in threads, each retrying rate-limit and server errors with backoff.
+    """
+
+    def __init__(self, service, staging_dir: Path, export_workers: int = 8, page_size: int = 1000):
+        self.service = service
+        self.staging_dir = staging_dir
+        self.export_workers = export_workers
+        self.page_size = page_size
+        # Filled in by select_files
+        self.removed_files: list[str] = []
+        # file_key -> manifest key of the version it replaces, whose documents are deleted once it is indexed
+        self.replaced_files: dict[str, str] = {}
+        self.modified_times: dict[str, str] = {}
+        self.start_page_token: str | None = None
+        self.failed_exports = 0
+
+    def select_files(self, manifest: dict, incremental: bool, counts: dict) -> Iterator[FileTask]:
+        """Yields the Drive files that need (re-)indexing, exported and hashed.
+
+        Files that no longer exist are collected in removed_files, and changed files in
+        replaced_files, instead of being deleted here.
+        """
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        known = {drive_file_id(file_key): file_key for file_key in manifest["files"] if drive_file_id(file_key)}
+        token = manifest.get("drive_start_page_token") if incremental else None
+
+        if token:
+            logging.info("Reading Drive changes since the last sync...")
+            files, removed_ids, self.start_page_token = self._changes(token)
+        else:
+            # Taken before listing, so changes made during the listing are picked up next time
+            self.start_page_token = self._call(self.service.changes().getStartPageToken())["startPageToken"]
+            logging.info("Listing every supported file in Drive...")
+            files = list(self._listing())
+            listed = {drive_file.file_id for drive_file in files}
+            removed_ids = [file_id for file_id in known if file_id not in listed]
+        self.removed_files = sorted(known[file_id] for file_id in removed_ids if file_id in known)
+
+        candidates = []
+        for drive_file in files:
+            previous_key = known.get(drive_file.file_id)
+            previous_entry = manifest["files"].get(previous_key) if previous_key else None
+            if (incremental and previous_key == drive_file.file_key and previous_entry
+                    and previous_entry.get("modified_time") == drive_file.modified_time):
+                counts["skipped"] += 1
+                continue
+            candidates.append(drive_file)
+
+        for drive_file, staged_path in self._export_all(candidates):
+            if staged_path is None:
+                continue
+            yield from self._select(manifest, incremental, counts, known, drive_file, staged_path)
+
+    def store_start_page_token(self, manifest: dict, failed: bool = False) -> bool:
+        """Saves the start page token for the next sync in the manifest, unless an export failed or
+        failed is set (files that did not index). The old token is then kept, so the next sync
+        reads the same changes again. Returns whether the token was stored."""
+        if self.failed_exports or failed:
+            logging.warning("Some Drive files failed; the next sync will re-read the same changes.")
+            return False
+        manifest["drive_start_page_token"] = self.start_page_token
+        return True
+
+    def cleanup(self) -> None:
+        """Removes the staging folder. The pipeline deletes each export once it is extracted, so this
+        only sweeps up exports it never reached, e.g. after a run that stopped early."""
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+    def _select(self, manifest: dict, incremental: bool, counts: dict, known: dict,
+                drive_file: DriveFile, staged_path: Path) -> Iterator[FileTask]:
+        try:
+            content_hash = file_sha256(staged_path)
+        except Exception as e:
+            logging.error(f"  Could not hash the export of {drive_file.name}: {e}. Skipping.")
+            self.failed_exports += 1
+            staged_path.unlink(missing_ok=True)
+            return
+
+        file_key = drive_file.file_key
+        previous_key = known.get(drive_file.file_id)
+        previous_entry = manifest["files"].get(previous_key) if previous_key else None
+        if incremental and previous_key == file_key and previous_entry and previous_entry.get("sha256") == content_hash:
+            # Touched but not changed: remember the new modifiedTime so the next run skips the export
+            previous_entry["modified_time"] = drive_file.modified_time
+            counts["skipped"] += 1
+            staged_path.unlink(missing_ok=True)
+            return
+
+        counts["processed"] += 1
+        if incremental and previous_entry:
+            self.replaced_files[file_key] = previous_key
+        self.modified_times[file_key] = drive_file.modified_time
+        yield FileTask(str(staged_path), file_key, drive_file.file_name, drive_file.relative_path, content_hash,
+                       staged=True)
+
+    # --- Listing ---
+
+    def _call(self, request) -> dict:
+        return request.execute(num_retries=GOOGLE_API_RETRIES)
+
+    def _listing(self) -> Iterator[DriveFile]:
+        query = mime_type_query(list(DRIVE_EXPORTS))
+        for item in iter_drive_files(self.service, query, self.page_size, DRIVE_SYNC_FIELDS):
+            yield DriveFile(item["id"], item["name"], item["mimeType"], item["modifiedTime"])
+
+    def _changes(self, token: str) -> tuple[list[DriveFile], list[str], str]:
+        """Files changed since token, IDs of removed files, and the token to store for next time."""
+        changed: dict[str, DriveFile] = {}
+        removed: list[str] = []
+        while True:
+            response = self._call(self.service.changes().list(
+                pageToken=token,
+                pageSize=self.page_size,
+                spaces="drive",
+                includeRemoved=True,
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({DRIVE_SYNC_FIELDS}))"
+            ))
+            for change in response.get("changes", []):
+                file_id = change.get("fileId")
+                item = change.get("file") or {}
+                # Later changes to the same file supersede earlier ones
+                changed.pop(file_id, None)
+                if change.get("removed") or item.get("trashed"):
+                    removed.append(file_id)
+                elif item.get("mimeType") in DRIVE_EXPORTS:
+                    changed[file_id] = DriveFile(file_id, item["name"], item["mimeType"], item["modifiedTime"])
+            if "newStartPageToken" in response:
+                removed = [file_id for file_id in removed if file_id not in changed]
+                return list(changed.values()), removed, response["newStartPageToken"]
+            token = response["nextPageToken"]
+
+    # --- Export ---
+
+    def _export_all(self, files: Iterable[DriveFile]) -> Iterator[tuple[DriveFile, Path | None]]:
+        """Exports files concurrently, yielding (file, staged path or None on failure) in order."""
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.export_workers, thread_name_prefix="drive-export") as pool:
+            for drive_file in files:
+                in_flight.append((drive_file, pool.submit(self._export, drive_file)))
+                # Bound the exports staged ahead of the extraction stage
+                if len(in_flight) >= self.export_workers * 2:
+                    yield self._exported(*in_flight.popleft())
+            while in_flight:
+                yield self._exported(*in_flight.popleft())
+
+    def _exported(self, drive_file: DriveFile, future) -> tuple[DriveFile, Path | None]:
+        try:
+            return drive_file, future.result()
+        except Exception as e:
+            logging.error(f"  Failed to export {drive_file.name} ({drive_file.file_id}): {e}")
+            self.failed_exports += 1
+            return drive_file, None
+
+    def _export(self, drive_file: DriveFile) -> Path:
+        from googleapiclient.http import MediaIoBaseDownload
+        export_type, suffix = DRIVE_EXPORTS[drive_file.mime_type]
+        if export_type:
+            request = self.service.files().export_media(fileId=drive_file.file_id, mimeType=export_type)
+        else:
+            request = self.service.files().get_media(fileId=drive_file.file_id)
+        staged_path = self.staging_dir / f"{drive_file.file_id}{suffix}"
+        with io.FileIO(staged_path, "wb") as f:
+            downloader = MediaIoBaseDownload(f, request, chunksize=DOWNLOAD_CHUNK_SIZE)
+            done = False
+            while not done:
+                _, done = downloader.next_chunk(num_retries=GOOGLE_API_RETRIES)
+        return staged_path
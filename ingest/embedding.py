@@ -0,0 +1,50 @@
+import time
+import numpy as np
+from api.embeddings import Embedder
+
+
+class EmbeddingBatcher:
+    """Collects chunks from any number of files into fixed-size embedding batches.
+
+    Vectors come back as float32 rows of one NumPy matrix per batch. They are handed to the
+    Elasticsearch serializer as-is, so no per-vector .tolist() happens before serialization.
+    """
+
+    def __init__(self, embedder: Embedder, batch_size: int = 256, parallel: int | None = None):
+        self.embedder = embedder
+        self.batch_size = batch_size
+        # fastembed data parallelism: None runs in-process, 0 uses every core, N uses N workers
+        self.parallel = parallel
+        self.batches = 0
+        self.seconds = 0.0
+        self._items = []
+        self._texts = []
+
+    def __len__(self) -> int:
+        return len(self._texts)
+
+    @property
+    def items(self) -> list:
+        """The items queued for the next flush."""
+        return list(self._items)
+
+    def add(self, item, text: str) -> bool:
+        """Queues one chunk; returns True once a full batch is waiting to be flushed."""
+        self._items.append(item)
+        self._texts.append(text)
+        return len(self._texts) >= self.batch_size
+
+    def flush(self) -> list[tuple[object, np.ndarray]]:
+        """Embeds whatever is queued, even if the batch is not full."""
+        if not self._texts:
+            return []
+        items, texts = self._items, self._texts
+        self._items, self._texts = [], []
+
+        start = time.perf_counter()
+        vectors = self.embedder.embed_passages(texts, batch_size=self.batch_size, parallel=self.parallel)
+        self.seconds += time.perf_counter() - start
+        self.batches += 1
+        if len(vectors) != len(texts):
+            raise ValueError(f"Mismatch in chunk count ({len(texts)}) and vector count ({len(vectors)})")
+        return list(zip(items, vectors))
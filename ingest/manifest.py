@@ -0,0 +1,79 @@
+import os
+import json
+import hashlib
+import logging
+import time
+from pathlib import Path
+
+# Bump when the manifest layout or chunk ID scheme changes; older manifests are ignored.
+MANIFEST_VERSION = 2
+
+
+def file_sha256(file_path: Path, block_size: int = 1 << 20) -> str:
+    """Returns the hex SHA-256 of a file's bytes, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def new_manifest(index_name: str, model_name: str, vector_options: dict | None = None,
+                 index_generation: str | None = None) -> dict:
+    """Returns an empty manifest for the given index, embedding model, vector index options and
+    index build (the index_generation stamped into the index _meta when it was last recreated)."""
+    return {
+        "version": MANIFEST_VERSION,
+        "index": index_name,
+        "embedding_model": model_name,
+        "vector_options": vector_options,
+        "index_generation": index_generation,
+        "updated_at": None,
+        "files": {},
+    }
+
+
+def read_manifest(manifest_path: Path) -> dict | None:
+    """The raw manifest, or None if it is missing or unreadable."""
+    if not manifest_path.is_file():
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        logging.warning(f"Could not read manifest {manifest_path}: {e}. Starting from an empty manifest.")
+        return None
+
+
+def load_manifest(manifest_path: Path, index_name: str, model_name: str,
+                  vector_options: dict | None = None, index_generation: str | None = None) -> dict:
+    """Loads the manifest, falling back to an empty one if it is missing, unreadable or stale.
+
+    A manifest written against another build of the index is stale too: the rebuild dropped
+    the documents it lists, even if another source sharing the index did the rebuilding.
+    """
+    manifest = read_manifest(manifest_path)
+    if manifest is None:
+        return new_manifest(index_name, model_name, vector_options, index_generation)
+
+    if (manifest.get("version") != MANIFEST_VERSION
+            or manifest.get("index") != index_name
+            or manifest.get("embedding_model") != model_name
+            or manifest.get("vector_options") != vector_options):
+        logging.warning(f"Manifest {manifest_path} was built for a different index, model, vector options or layout. Ignoring it.")
+        return new_manifest(index_name, model_name, vector_options, index_generation)
+    if manifest.get("index_generation") != index_generation:
+        logging.warning(f"The index was rebuilt since manifest {manifest_path} was written. Ignoring it.")
+        return new_manifest(index_name, model_name, vector_options, index_generation)
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def save_manifest(manifest_path: Path, manifest: dict) -> None:
+    """Writes the manifest atomically so a crash never leaves a half-written file."""
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    manifest["updated_at"] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+    tmp_path = manifest_path.with_suffix(manifest_path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
@@ -0,0 +1,54 @@
+# dense_vector index_options types accepted by Elasticsearch. "hnsw"/"flat" keep raw float32
+# vectors in the graph; the int8/int4/bbq variants quantize them to cut graph memory.
+VECTOR_INDEX_TYPES = ["hnsw", "int8_hnsw", "int4_hnsw", "bbq_hnsw", "flat", "int8_flat", "int4_flat", "bbq_flat"]
+
+
+def vector_index_options(index_type: str | None, m: int | None = None,
+                         ef_construction: int | None = None) -> dict | None:
+    """Builds dense_vector index_options, or None to leave the cluster default in place."""
+    if index_type is None:
+        return None
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type '{index_type}'. Expected one of: {', '.join(VECTOR_INDEX_TYPES)}")
+    options = {"type": index_type}
+    if index_type.endswith("_hnsw") or index_type == "hnsw":
+        if m is not None:
+            options["m"] = m
+        if ef_construction is not None:
+            options["ef_construction"] = ef_construction
+    return options
+
+
+def build_index_mapping(dims: int, index_options: dict | None = None, meta: dict | None = None) -> dict:
+    """Mapping for the two-tier layout: one "document" record per file holding its content,
+    and any number of "chunk" records carrying only the chunk text, vector and parent_id.
+    meta is stored as the mapping _meta (e.g. the embedding model the index is built with)."""
+    chunk_vector = {
+        "type": "dense_vector",
+        "dims": dims,
+        "index": True,
+        "similarity": "cosine"
+    }
+    if index_options:
+        chunk_vector["index_options"] = index_options
+    mapping = {
+        "properties": {
+            "doc_type": {"type": "keyword"},
+            "parent_id": {"type": "keyword"},
+            "file_name": {"type": "keyword"},
+            "path": {"type": "keyword"},
+            "content": {"type": "text", "index": False},
+            "content_type": {"type": "keyword"},
+            "content_hash": {"type": "keyword"},
+            "chunk_count": {"type": "integer"},
+            "chunk_index": {"type": "integer"},
+            "chunk_text": {"type": "text"},
+            "chunk_vector": chunk_vector,
+            # Set on chunks indexed as references to identical or near-identical content elsewhere
+            "duplicate": {"type": "boolean"},
+            "timestamp": {"type": "date"}
+        }
+    }
+    if meta:
+        mapping["_meta"] = meta
+    return mapping
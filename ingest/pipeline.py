@@ -0,0 +1,485 @@
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Iterable, Iterator
+from ingest.documents import ChunkSlice, FileFailed, PreparedFile, init_worker, prepare_file
+from api.embeddings import Embedder
+from ingest.embedding import EmbeddingBatcher
+from ingest.dedup import EMBED, REUSE, ChunkDeduplicator
+
+# Marks the end of a stage's output on the queue feeding the next stage
+_DONE = object()
+
+
+@dataclass
+class _ExtractDone:
+    """Sent by the extraction stage after its last task: how many tasks ended with a final message."""
+    files: int
+
+
+@dataclass
+class FileTask:
+    """A file selected for (re-)indexing by the scan."""
+    file_path: str
+    file_key: str
+    file_name: str
+    relative_path: str
+    content_hash: str
+    # The file is a temporary copy owned by the run (a staged export), deleted once it is extracted
+    staged: bool = False
+
+
+@dataclass
+class StageStats:
+    """Work done and time spent by one pipeline stage."""
+    name: str
+    unit: str
+    items: int = 0
+    num_bytes: int = 0
+    busy_seconds: float = 0.0
+
+    def record(self, seconds: float, items: int = 1, num_bytes: int = 0) -> None:
+        self.items += items
+        self.num_bytes += num_bytes
+        self.busy_seconds += seconds
+
+    @property
+    def rate(self) -> float:
+        return self.items / self.busy_seconds if self.busy_seconds > 0 else 0.0
+
+    def summary(self) -> str:
+        line = f"{self.name}: {self.items} {self.unit} in {self.busy_seconds:.2f}s busy ({self.rate:.1f} {self.unit}/s)"
+        if self.num_bytes:
+            line += f", {self.num_bytes / 1_000_000:.1f} MB"
+        return line
+
+    def to_dict(self) -> dict:
+        return {"unit": self.unit, "items": self.items, "bytes": self.num_bytes,
+                "busy_seconds": self.busy_seconds, "per_second": self.rate}
+
+
+def timestamp() -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+
+
+def document_action(index_name: str, doc_id: str, prepared: PreparedFile) -> dict:
+    """Builds the parent record that holds a file's full content once."""
+    return {
+        "_index": index_name,
+        "_id": doc_id,
+        "_source": {
+            "doc_type": "document",
+            "file_name": prepared.file_name,
+            "path": prepared.relative_path,
+            "content": prepared.content,
+            "content_type": prepared.content_type,
+            "content_hash": prepared.content_hash,
+            "chunk_count": prepared.chunk_count,
+            "timestamp": timestamp()
+        }
+    }
+
+
+def chunk_action(index_name: str, chunk_id: str, parent_id: str, chunk_slice: ChunkSlice,
+                 offset: int, vector) -> dict:
+    """Builds a lean chunk record, for chunk number offset of a slice, that points back to its parent document.
+    Without a vector the record is a duplicate reference."""
+    action = {
+        "_index": index_name,
+        "_id": chunk_id,
+        "_source": {
+            "doc_type": "chunk",
+            "parent_id": parent_id,
+            "file_name": chunk_slice.file_name,
+            "path": chunk_slice.relative_path,
+            "chunk_index": chunk_slice.start + offset,
+            "chunk_text": chunk_slice.chunks[offset],
+            "timestamp": timestamp()
+        }
+    }
+    if vector is None:
+        # A reference to content indexed under another chunk: searchable as text, never by vector
+        action["_source"]["duplicate"] = True
+    else:
+        # float32 NumPy row; the Elasticsearch serializer converts it when the request is built
+        action["_source"]["chunk_vector"] = vector
+    return action
+
+
+def parent_id(file_key: str, content_hash: str) -> str:
+    """ID of a file's parent document. IDs derive from content, not mtime."""
+    return f"doc-{file_key}-{content_hash[:16]}"
+
+
+def chunk_id(file_key: str, content_hash: str, chunk_index: int) -> str:
+    return f"chunk-{file_key}-{content_hash[:16]}-{chunk_index}"
+
+
+class IngestPipeline:
+    """Runs extraction, embedding and bulk upload as concurrent stages joined by bounded queues.
+
+    Extraction and splitting run in a process pool and stream each file's chunks to one
+    embedding thread as they are split, so a large document is never held whole. That thread
+    batches chunks across files, and upload runs through the target (parallel_bulk for
+    Elasticsearch, sqlite for a local index) in another thread.
+    """
+
+    def __init__(self, target, embedder: Embedder, *, workers: int, chunk_size: int, chunk_overlap: int,
+                 embed_batch_size: int = 256, embed_parallel: int | None = None, queue_size: int = 32,
+                 upload_queue_size: int = 4000, max_document_chars: int | None = None,
+                 extract_timeout: float | None = None, profile_dir: Path | None = None,
+                 dedup: ChunkDeduplicator | None = None,
+                 on_file_indexed: Callable[[str, dict], None] | None = None):
+        self.target = target
+        self.embedder = embedder
+        self.index_name = target.index_name
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batcher = EmbeddingBatcher(embedder, batch_size=embed_batch_size, parallel=embed_parallel)
+        # Chunk slices waiting between extraction and embedding
+        self.queue_size = queue_size
+        self.upload_queue_size = upload_queue_size
+        # Per-document ceiling on extracted text (and stored PDF bytes), and per-file extraction time limit
+        self.max_document_chars = max_document_chars
+        self.extract_timeout = extract_timeout
+        # Every stage thread and extraction worker dumps cProfile stats here (pstats format)
+        self.profile_dir = profile_dir
+        # Chunks whose content is already indexed are written as references instead of being embedded
+        self.dedup = dedup
+        # Called from the upload thread with (file_key, manifest entry) as soon as a file is fully indexed
+        self.on_file_indexed = on_file_indexed
+
+        self.extract_stats = StageStats("Extract", "files")
+        self.embed_stats = StageStats("Embed", "chunks")
+        self.upload_stats = StageStats("Upload", "docs")
+        # file_key -> manifest entry, filled in once every document of the file has been queued
+        self.pending_entries: dict[str, dict] = {}
+        self.indexed_ids: set[str] = set()
+        self.failed_ids: set[str] = set()
+        # file_key -> (file_name, relative_path) of files skipped during extraction
+        self.failed_files: dict[str, tuple[str, str]] = {}
+        self.truncated_files = 0
+        self._streamed_files: set[str] = set()
+        # One timing record per extracted file, in the order they finished
+        self.file_stats: list[dict] = []
+        self.duplicate_chunks = 0
+        self.reused_vectors = 0
+        # file_key -> canonical chunks of this run its references point at; the file is only
+        # complete once they are indexed too
+        self._references: dict[str, set[str]] = {}
+        # (action, error) of every action the target failed to index
+        self.failed_actions: list[tuple[dict, object]] = []
+        self._progress_lock = threading.Lock()
+        # file_key -> IDs not confirmed yet, and doc_id -> files waiting on it
+        self._outstanding: dict[str, set[str]] = {}
+        self._waiting: dict[str, list[str]] = {}
+
+    def run(self, tasks: Iterable[FileTask]) -> None:
+        # "spawn" keeps the workers free of the parent's ONNX runtime threads
+        context = multiprocessing.get_context("spawn")
+        chunk_queue = context.Queue(maxsize=self.queue_size)
+        action_queue = queue.Queue(maxsize=self.upload_queue_size)
+        if self.profile_dir:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+        embed_thread = threading.Thread(target=self._profiled,
+                                        args=("embed", self._embed_stage, chunk_queue, action_queue),
+                                        name="ingest-embed", daemon=True)
+        upload_thread = threading.Thread(target=self._profiled, args=("upload", self._upload_stage, action_queue),
+                                         name="ingest-upload", daemon=True)
+        embed_thread.start()
+        upload_thread.start()
+        finished = [0]
+        try:
+            self._profiled("dispatch", self._extract_stage, tasks, context, chunk_queue, finished)
+        finally:
+            chunk_queue.put(_ExtractDone(finished[0]))
+            embed_thread.join()
+            upload_thread.join()
+        self._discard_partial_files()
+
+    def _profiled(self, name: str, stage, *args) -> None:
+        """Runs one stage, under its own cProfile profiler when profiling is on (profilers are per thread)."""
+        if not self.profile_dir:
+            stage(*args)
+            return
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.runcall(stage, *args)
+        finally:
+            profiler.dump_stats(str(self.profile_dir / f"{name}.prof"))
+
+    def extract_breakdown(self) -> dict:
+        """Extraction time split into parsing, splitting and waiting for the embedding stage."""
+        parse = sum(record["parse_seconds"] for record in self.file_stats)
+        wait = sum(record["wait_seconds"] for record in self.file_stats)
+        return {"parse_seconds": parse, "split_seconds": self.extract_stats.busy_seconds - parse - wait,
+                "wait_seconds": wait}
+
+    def report(self) -> list[str]:
+        lines = [stats.summary() for stats in (self.extract_stats, self.embed_stats, self.upload_stats)]
+        if self.file_stats:
+            breakdown = self.extract_breakdown()
+            lines.append(f"Extract breakdown: parse {breakdown['parse_seconds']:.2f}s, "
+                         f"split {breakdown['split_seconds']:.2f}s, "
+                         f"waiting on the embedder {breakdown['wait_seconds']:.2f}s")
+        if self.batcher.batches:
+            lines.append(f"Embedding batches: {self.batcher.batches} "
+                         f"(avg {self.embed_stats.items / self.batcher.batches:.1f} chunks per batch)")
+        if self.dedup is not None:
+            lines.append(f"Deduplicated: {self.duplicate_chunks} chunks indexed as references, "
+                         f"{self.reused_vectors} stored vectors re-used")
+        if self.failed_files or self.truncated_files:
+            lines.append(f"Skipped during extraction: {len(self.failed_files)} files; "
+                         f"truncated at the document ceiling: {self.truncated_files} files")
+        return lines
+
+    def report_data(self) -> dict:
+        """Machine-readable form of report(), with one record per extracted file."""
+        return {
+            "stages": {stats.name.lower(): stats.to_dict()
+                       for stats in (self.extract_stats, self.embed_stats, self.upload_stats)},
+            "extract_breakdown": self.extract_breakdown(),
+            "embedding_batches": self.batcher.batches,
+            "duplicate_chunks": self.duplicate_chunks,
+            "reused_vectors": self.reused_vectors,
+            "failed_files": len(self.failed_files),
+            "truncated_files": self.truncated_files,
+            "failed_docs": len(self.failed_ids),
+            "dead_letters": len(self.failed_actions),
+            "files": self.file_stats,
+        }
+
+    # --- Stage 1: extraction and splitting in worker processes ---
+
+    def _extract_stage(self, tasks: Iterable[FileTask], context, chunk_queue, finished: list) -> None:
+        in_flight = deque()
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=init_worker,
+                                 initargs=(self.chunk_size, self.chunk_overlap, chunk_queue,
+                                           self.max_document_chars, self.extract_timeout,
+                                           str(self.profile_dir) if self.profile_dir else None)) as pool:
+            for task in tasks:
+                logging.info(f"Processing: {task.file_path}")
+                in_flight.append((task, pool.submit(prepare_file, task.file_path, task.file_key,
+                                                    task.file_name, task.relative_path, task.content_hash)))
+                # Bound the number of files being extracted ahead of the embedder
+                if len(in_flight) >= self.workers * 2:
+                    self._collect(in_flight.popleft(), finished)
+            while in_flight:
+                self._collect(in_flight.popleft(), finished)
+
+    def _collect(self, submitted, finished: list) -> None:
+        task, future = submitted
+        try:
+            future.result()
+            finished[0] += 1
+        except Exception as e:
+            # The worker died before sending the file's final message
+            logging.error(f"  Extraction failed for {task.file_name}: {e}")
+            self.failed_files[task.file_key] = (task.file_name, task.relative_path)
+        finally:
+            # The worker has read the file to the end (or given up on it)
+            if task.staged:
+                Path(task.file_path).unlink(missing_ok=True)
+
+    # --- Stage 2: embedding in fixed-size batches across files ---
+
+    def _messages(self, chunk_queue) -> Iterator[object]:
+        """Worker messages, until extraction is done and every finished task's final message is in.
+
+        Each worker process feeds the queue on its own, so the done marker can overtake the last
+        messages of other workers; counting final messages makes the end exact.
+        """
+        expected = None
+        received = 0
+        while expected is None or received < expected:
+            message = chunk_queue.get()
+            if isinstance(message, _ExtractDone):
+                expected = message.files
+                continue
+            if isinstance(message, (PreparedFile, FileFailed)):
+                received += 1
+            yield message
+
+    def _embed_stage(self, chunk_queue, action_queue: queue.Queue) -> None:
+        messages = self._messages(chunk_queue)
+        try:
+            for message in messages:
+                if isinstance(message, ChunkSlice):
+                    self._streamed_files.add(message.file_key)
+                    for offset, chunk in enumerate(message.chunks):
+                        if self.dedup is not None and self._deduplicated(message, offset, action_queue):
+                            continue
+                        if self.batcher.add((message, offset), chunk):
+                            self._flush_batch(action_queue)
+                elif isinstance(message, PreparedFile):
+                    self._finish_file(message, action_queue)
+                else:
+                    self.failed_files[message.file_key] = (message.file_name, message.relative_path)
+            self._flush_batch(action_queue)
+        except Exception as e:
+            logging.error(f"Embedding stage failed: {e}", exc_info=True)
+            # Keep draining so extraction workers never block on a full queue
+            for _ in messages:
+                pass
+        finally:
+            action_queue.put(_DONE)
+
+    def _finish_file(self, prepared: PreparedFile, action_queue: queue.Queue) -> None:
+        self.extract_stats.record(prepared.extract_seconds, num_bytes=prepared.num_bytes)
+        if prepared.truncated:
+            self.truncated_files += 1
+        self.file_stats.append({
+            "file_key": prepared.file_key,
+            "content_type": prepared.content_type,
+            "bytes": prepared.num_bytes,
+            "chunks": prepared.chunk_count,
+            "extract_seconds": prepared.extract_seconds,
+            "parse_seconds": prepared.parse_seconds,
+            "split_seconds": prepared.extract_seconds - prepared.parse_seconds - prepared.wait_seconds,
+            "wait_seconds": prepared.wait_seconds,
+            "truncated": prepared.truncated,
+        })
+        doc_id = parent_id(prepared.file_key, prepared.content_hash)
+        action_queue.put(document_action(self.index_name, doc_id, prepared))
+        self.pending_entries[prepared.file_key] = {
+            "sha256": prepared.content_hash,
+            "doc_ids": [doc_id, *(chunk_id(prepared.file_key, prepared.content_hash, i)
+                                  for i in range(prepared.chunk_count))]
+        }
+        self._track(prepared.file_key)
+
+    def _track(self, file_key: str) -> None:
+        """Starts waiting for the confirmations a file still needs; it is reported once they are in."""
+        with self._progress_lock:
+            outstanding = self.missing_ids(file_key)
+            if outstanding:
+                self._outstanding[file_key] = outstanding
+                for doc_id in outstanding:
+                    self._waiting.setdefault(doc_id, []).append(file_key)
+                return
+        self._file_indexed(file_key)
+
+    def _confirm(self, doc_id: str) -> None:
+        completed = []
+        with self._progress_lock:
+            self.indexed_ids.add(doc_id)
+            for file_key in self._waiting.pop(doc_id, ()):
+                outstanding = self._outstanding[file_key]
+                outstanding.discard(doc_id)
+                if not outstanding:
+                    del self._outstanding[file_key]
+                    completed.append(file_key)
+        for file_key in completed:
+            self._file_indexed(file_key)
+
+    def _file_indexed(self, file_key: str) -> None:
+        if self.on_file_indexed is not None:
+            self.on_file_indexed(file_key, self.pending_entries[file_key])
+
+    def missing_ids(self, file_key: str) -> set[str]:
+        """IDs a queued file still needs confirmed: its own documents and the canonical chunks it references."""
+        entry = self.pending_entries[file_key]
+        return (set(entry["doc_ids"]) | self._references.get(file_key, set())) - self.indexed_ids
+
+    def _deduplicated(self, chunk_slice: ChunkSlice, offset: int, action_queue: queue.Queue) -> bool:
+        """Queues a chunk whose content is already known without embedding it; False if it must be embedded."""
+        file_key, content_hash = chunk_slice.file_key, chunk_slice.content_hash
+        doc_id = chunk_id(file_key, content_hash, chunk_slice.start + offset)
+        assignment = self.dedup.assign(doc_id, file_key, chunk_slice.chunks[offset])
+        if assignment.action == EMBED:
+            return False
+        if assignment.action == REUSE:
+            self.reused_vectors += 1
+        else:
+            self.duplicate_chunks += 1
+            if assignment.pending:
+                self._references.setdefault(file_key, set()).add(assignment.canonical_id)
+        action_queue.put(chunk_action(self.index_name, doc_id, parent_id(file_key, content_hash),
+                                      chunk_slice, offset, assignment.vector))
+        return True
+
+    def _flush_batch(self, action_queue: queue.Queue) -> None:
+        pending = len(self.batcher)
+        if not pending:
+            return
+        queued = self.batcher.items
+        start = time.perf_counter()
+        try:
+            embedded = self.batcher.flush()
+        except Exception as e_embed:
+            # The dropped chunks never reach the index, which keeps their files out of the manifest
+            logging.error(f"  Error embedding a batch of {pending} chunks: {e_embed}", exc_info=True)
+            if self.dedup is not None:
+                self.dedup.forget(chunk_id(chunk_slice.file_key, chunk_slice.content_hash, chunk_slice.start + offset)
+                                  for chunk_slice, offset in queued)
+            return
+        self.embed_stats.record(time.perf_counter() - start, items=len(embedded))
+        vectors = []
+        for (chunk_slice, offset), vector in embedded:
+            file_key, content_hash = chunk_slice.file_key, chunk_slice.content_hash
+            doc_id = chunk_id(file_key, content_hash, chunk_slice.start + offset)
+            vectors.append((doc_id, vector))
+            action_queue.put(chunk_action(self.index_name, doc_id, parent_id(file_key, content_hash),
+                                          chunk_slice, offset, vector))
+        if self.dedup is not None:
+            self.dedup.store_vectors(vectors)
+
+    def _discard_partial_files(self) -> None:
+        """Deletes chunks already indexed for files that failed after streaming some of them."""
+        for file_key, (file_name, relative_path) in self.failed_files.items():
+            if file_key in self._streamed_files:
+                self.target.delete_file(file_name, relative_path)
+
+    # --- Stage 3: bulk upload ---
+
+    def _drain(self, action_queue: queue.Queue, waited: list) -> Iterator[dict]:
+        while True:
+            start = time.perf_counter()
+            action = action_queue.get()
+            waited[0] += time.perf_counter() - start
+            if action is _DONE:
+                return
+            yield action
+
+    def _upload_stage(self, action_queue: queue.Queue) -> None:
+        waited = [0.0]
+        # Actions handed to the target and not reported yet, kept for the dead-letter queue
+        in_flight = {}
+
+        def tracked() -> Iterator[dict]:
+            for action in self._drain(action_queue, waited):
+                in_flight[action["_id"]] = action
+                yield action
+
+        start = time.perf_counter()
+        try:
+            for ok, doc_id, error in self.target.write(tracked()):
+                action = in_flight.pop(doc_id, None)
+                if ok:
+                    self._confirm(doc_id)
+                    self.upload_stats.items += 1
+                else:
+                    self.failed_ids.add(doc_id)
+                    logging.error(f"  Failed to index {doc_id}: {error}")
+                    if action is not None:
+                        self.failed_actions.append((action, error))
+        except Exception as e_bulk:
+            logging.error(f"Unexpected error during bulk indexing: {e_bulk}", exc_info=True)
+            # Everything still queued is lost for this run; unblock the embedder and move on
+            for action in [*in_flight.values(), *self._drain(action_queue, waited)]:
+                self.failed_ids.add(action["_id"])
+                self.failed_actions.append((action, str(e_bulk)))
+        self.upload_stats.busy_seconds = time.perf_counter() - start - waited[0]
+
+    def completed_entries(self) -> dict[str, dict]:
+        """Manifest entries for files whose documents were all confirmed indexed."""
+        return {file_key: entry for file_key, entry in self.pending_entries.items()
+                if not self.missing_ids(file_key)}
@@ -0,0 +1,245 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator
+from elasticsearch import ApiError, Elasticsearch
+from elastic_transport import TransportError
+from elasticsearch.helpers import expand_action
+
+
+class BulkSizer:
+    """Byte budget of one bulk request: halved whenever the cluster pushes back with 429s and
+    grown back by a quarter after each request it accepts in full."""
+
+    def __init__(self, max_bytes: int, min_bytes: int):
+        self.max_bytes = max_bytes
+        self.min_bytes = min(min_bytes, max_bytes)
+        self.limit = max_bytes
+        self.rejections = 0
+        self._lock = threading.Lock()
+
+    def rejected(self) -> None:
+        with self._lock:
+            self.rejections += 1
+            self.limit = max(self.min_bytes, self.limit // 2)
+
+    def accepted(self) -> None:
+        with self._lock:
+            self.limit = min(self.max_bytes, self.limit + max(self.limit // 4, 1))
+
+
+@dataclass
+class _BulkItem:
+    """One serialized action, and how often it has been sent."""
+    doc_id: str
+    lines: list[bytes]
+    size: int
+    attempts: int = 0
+
+
+class ElasticsearchTarget:
+    """Writes the index into Elasticsearch with concurrent bulk requests sized in bytes.
+
+    Actions rejected with 429 (whole requests or single items), and requests that fail on the
+    connection, are re-sent with exponential backoff while the byte budget of later requests
+    shrinks; only errors that persist past max_retries are reported as failures.
+    """
+
+    def __init__(self, es_client: Elasticsearch, index_name: str, bulk_chunk_size: int = 500, bulk_threads: int = 4,
+                 max_bulk_bytes: int = 10 * 1024 * 1024, min_bulk_bytes: int = 512 * 1024, max_retries: int = 8,
+                 initial_backoff: float = 2.0, max_backoff: float = 60.0):
+        self.es_client = es_client
+        self.index_name = index_name
+        # Upper bound on actions per request; the byte budget usually binds first for chunk records
+        self.bulk_chunk_size = bulk_chunk_size
+        self.bulk_threads = bulk_threads
+        self.sizer = BulkSizer(max_bulk_bytes, min_bulk_bytes)
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+
+    def exists(self) -> bool:
+        return self.es_client.indices.exists(index=self.index_name)
+
+    def index_meta(self) -> dict:
+        """The index mapping's _meta; empty if the index does not exist."""
+        if not self.exists():
+            return {}
+        mapping = self.es_client.indices.get_mapping(index=self.index_name)
+        return next(iter(mapping.values()))["mappings"].get("_meta", {})
+
+    def create(self, mapping: dict, recreate: bool = False) -> None:
+        if recreate and self.exists():
+            logging.info(f"Deleting existing index '{self.index_name}'...")
+            self.es_client.indices.delete(index=self.index_name)
+        if not self.exists():
+            logging.info(f"Creating index '{self.index_name}' with mapping...")
+            self.es_client.indices.create(index=self.index_name, mappings=mapping, ignore=400)
+        else:
+            logging.info(f"Index '{self.index_name}' already exists.")
+
+    def delete_file(self, file_name: str, relative_path: str, keep: Iterable[str] = ()) -> None:
+        """Removes every indexed document belonging to one file, whatever ID scheme produced it,
+        except the IDs in keep (the version of the file that replaces them)."""
+        file_key = f"{relative_path}/{file_name}" if relative_path else file_name
+        keep = list(keep)
+        try:
+            response = self.es_client.delete_by_query(
+                index=self.index_name,
+                query={"bool": {"filter": [
+                    {"term": {"file_name": file_name}},
+                    {"term": {"path": relative_path}}
+                ], "must_not": [{"ids": {"values": keep}}] if keep else []}},
+                conflicts="proceed",
+                refresh=True
+            )
+            logging.info(f"  Deleted {response.get('deleted', 0)} stale documents for {file_key}.")
+        except Exception as e:
+            logging.error(f"  Failed to delete stale documents for {file_key}: {e}")
+
+    def write(self, actions: Iterable[dict]) -> Iterator[tuple[bool, str, object]]:
+        """Bulk-indexes actions, yielding (ok, id, error) for each one."""
+        serializer = self.es_client.transport.serializers.get_serializer("application/json")
+        client = self.es_client.options(request_timeout=120)
+        items = (self._bulk_item(action, serializer) for action in actions)
+        # Actions to send before new ones: rejected items, and the one that overflowed the last request
+        carried = deque()
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.bulk_threads, thread_name_prefix="bulk") as pool:
+            while True:
+                while len(in_flight) < self.bulk_threads:
+                    batch = self._take_batch(items, carried)
+                    if not batch:
+                        break
+                    in_flight.append(pool.submit(self._send, client, batch))
+                if not in_flight:
+                    return
+                for item, ok, error in in_flight.popleft().result():
+                    if ok is None:
+                        if item.attempts <= self.max_retries:
+                            carried.append(item)
+                            continue
+                        ok, error = False, f"gave up after {item.attempts} attempts: {error}"
+                    yield ok, item.doc_id, error
+
+    @staticmethod
+    def _bulk_item(action: dict, serializer) -> _BulkItem:
+        header, data = expand_action(action)
+        lines = [serializer.dumps(header)] + ([serializer.dumps(data)] if data is not None else [])
+        lines = [line.encode("utf-8") if isinstance(line, str) else line for line in lines]
+        return _BulkItem(action["_id"], lines, sum(len(line) + 1 for line in lines))
+
+    def _take_batch(self, items: Iterator[_BulkItem], carried: deque) -> list[_BulkItem]:
+        batch, size, limit = [], 0, self.sizer.limit
+        while len(batch) < self.bulk_chunk_size:
+            item = carried.popleft() if carried else next(items, None)
+            if item is None:
+                break
+            if batch and size + item.size > limit:
+                carried.appendleft(item)
+                break
+            batch.append(item)
+            size += item.size
+        return batch
+
+    def _send(self, client: Elasticsearch, batch: list[_BulkItem]) -> list[tuple[_BulkItem, bool | None, object]]:
+        """Sends one bulk request. ok is None for items to retry."""
+        attempts = max(item.attempts for item in batch)
+        if attempts:
+            time.sleep(min(self.max_backoff, self.initial_backoff * 2 ** (attempts - 1)))
+        for item in batch:
+            item.attempts += 1
+        try:
+            response = client.bulk(operations=[line for item in batch for line in item.lines])
+        except ApiError as e:
+            if e.status_code != 429:
+                return [(item, False, str(e)) for item in batch]
+            self.sizer.rejected()
+            return [(item, None, str(e)) for item in batch]
+        except TransportError as e:
+            # Timeouts and dropped connections from an overloaded cluster are worth another try
+            self.sizer.rejected()
+            return [(item, None, str(e)) for item in batch]
+
+        results, rejected = [], False
+        for item, entry in zip(batch, response["items"]):
+            result = next(iter(entry.values()))
+            if result.get("status") == 429:
+                rejected = True
+                results.append((item, None, result.get("error")))
+            else:
+                results.append((item, "error" not in result, result.get("error")))
+        if rejected:
+            self.sizer.rejected()
+        else:
+            self.sizer.accepted()
+        return results
+
+    def finish(self, changed: bool, meta: dict | None = None) -> None:
+        """Merges meta into the mapping _meta and, if the index changed, stamps a new index_version
+        so API caches drop stale results."""
+        try:
+            mapping = self.es_client.indices.get_mapping(index=self.index_name)
+            current = next(iter(mapping.values()))["mappings"].get("_meta", {})
+            # put_mapping replaces _meta wholesale, so carry the existing keys over
+            updated = {**current, **(meta or {})}
+            if changed:
+                updated["index_version"] = str(time.time_ns())
+            if updated != current:
+                self.es_client.indices.put_mapping(index=self.index_name, meta=updated)
+            if changed:
+                logging.info(f"Index version bumped to {updated['index_version']}.")
+        except Exception as e:
+            logging.error(f"Failed to update _meta for '{self.index_name}': {e}")
+        if self.sizer.rejections:
+            logging.warning(f"Elasticsearch pushed back {self.sizer.rejections} times; bulk requests ended at "
+                            f"{self.sizer.limit / 1_000_000:.1f} MB.")
+
+
+class LocalTarget:
+    """Writes the index into a local directory served by the API's local backend."""
+
+    def __init__(self, directory: Path, dims: int, vector_dtype: str = "float32", ivf_lists: int = 0):
+        from api.local_index import LocalIndexWriter
+        self.writer = LocalIndexWriter(directory, dims)
+        self.index_name = str(directory)
+        self.vector_dtype = vector_dtype
+        self.ivf_lists = ivf_lists
+
+    def exists(self) -> bool:
+        return self.writer.exists()
+
+    def index_meta(self) -> dict:
+        return self.writer.read_meta().get("_meta", {})
+
+    def create(self, mapping: dict, recreate: bool = False) -> None:
+        # The local layout is fixed; the Elasticsearch mapping does not apply
+        if recreate:
+            logging.info(f"Resetting local index '{self.index_name}'...")
+            self.writer.reset()
+        else:
+            self.writer.open()
+
+    def delete_file(self, file_name: str, relative_path: str, keep: Iterable[str] = ()) -> None:
+        file_key = f"{relative_path}/{file_name}" if relative_path else file_name
+        deleted = self.writer.delete_file(file_name, relative_path, keep)
+        logging.info(f"  Deleted {deleted} stale documents for {file_key}.")
+
+    def write(self, actions: Iterable[dict]) -> Iterator[tuple[bool, str, object]]:
+        return self.writer.write(actions)
+
+    def finish(self, changed: bool, meta: dict | None = None) -> None:
+        """Re-exports the search matrix and stamps a new index_version, recording meta in meta.json."""
+        current = self.writer.read_meta()
+        stale_meta = any(current.get("_meta", {}).get(key) != value for key, value in (meta or {}).items())
+        # Exports from before chunk_ids.npy are re-exported once
+        stale_export = not (self.writer.directory / "chunk_ids.npy").is_file()
+        if changed or not current or stale_meta or stale_export:
+            committed = self.writer.commit(self.vector_dtype, self.ivf_lists, meta)
+            logging.info(f"Local index committed: {committed['count']} vectors ({committed['vector_dtype']}, "
+                         f"{committed['ivf_lists']} IVF lists), version {committed['index_version']}.")
+        self.writer.close()
@@ -38,9 +38,67 @@ export const searchCloudDocuments = async (query: string): Promise<ElasticResult
     }
 };
 
+export interface ContextChunk {
+    chunkIndex: number;
+    text: string;
+}
+
+export interface StreamSearchHandlers {
+    onHit?: (result: ElasticResult) => void;
+    onContext?: (id: string, chunks: ContextChunk[]) => void;
+}
+
+// Streams results from /api/search/stream as NDJSON, calling onHit as each one arrives.
+// contextWindow > 0 also delivers the neighbouring chunks of every hit once all hits are in.
+export const streamCloudDocuments = async (
+    query: string,
+    handlers: StreamSearchHandlers = {},
+    contextWindow = 0
+): Promise<ElasticResult[]> => {
+    console.log(`[API] Streaming cloud search for: "${query}"`);
+    const endpoint = `${API_BASE_URL}/search/stream?format=ndjson`;
+    const results: ElasticResult[] = [];
+
+    try {
+        const response = await fetch(endpoint, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ query, context_window: contextWindow }),
+        });
+        if (!response.ok || !response.body) await handleApiError(response, 'API search stream request failed');
+        const reader = response.body!.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += value;
+            const lines = buffer.split('\n');
+            buffer = lines.pop() ?? '';
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const { event, data } = JSON.parse(line);
+                if (event === 'hit') {
+                    results.push(data);
+                    handlers.onHit?.(data);
+                } else if (event === 'context') {
+                    handlers.onContext?.(data.id, data.chunks);
+                } else if (event === 'error') {
+                    throw new Error(`Search stream failed: ${data.detail}`);
+                }
+            }
+        }
+        return results;
+    } catch (error) {
+        console.error("Error streaming cloud search:", error);
+        throw error;
+    }
+};
+
 export const getCloudFileContent = async (source: Source): Promise<string> => {
     console.log(`[API] Fetching cloud content for: "${source.fileName}"`);
-    const endpoint = `${API_BASE_URL}/files/${source.id}`;
+    const endpoint = `${API_BASE_URL}/files/${encodeURIComponent(source.id)}`;
 
     try {
         const response = await fetch(endpoint);
@@ -53,14 +111,23 @@ export const getCloudFileContent = async (source: Source): Promise<string> => {
     }
 };
 
-export const getAllCloudFiles = async (): Promise<Source[]> => {
+export const getAllCloudFiles = async (onPage?: (files: Source[]) => void): Promise<Source[]> => {
     console.log(`[API] Fetching all cloud files`);
-    const endpoint = `${API_BASE_URL}/files`;
+    const files: Source[] = [];
+    let cursor: string | null = null;
 
     try {
-        const response = await fetch(endpoint);
-        if (!response.ok) await handleApiError(response, 'Failed to fetch all files from API');
-        return await response.json();
+        do {
+            const params = new URLSearchParams({ limit: '1000' });
+            if (cursor) params.set('cursor', cursor);
+            const response = await fetch(`${API_BASE_URL}/files?${params}`);
+            if (!response.ok) await handleApiError(response, 'Failed to fetch all files from API');
+            const page: { files: Source[]; nextCursor: string | null } = await response.json();
+            files.push(...page.files);
+            onPage?.(page.files);
+            cursor = page.nextCursor;
+        } while (cursor);
+        return files;
     } catch (error) {
         console.error("Error fetching all cloud files:", error);
         throw error;
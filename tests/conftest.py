@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The API and ingest packages are imported from the repository root, as the scripts do
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,162 @@
+"""In-memory stand-ins for the Google API clients, recording the calls made to them."""
+import re
+
+
+class FakeResponse(dict):
+    """httplib2-style response: headers as a dict, plus a status."""
+
+    def __init__(self, status: int, headers: dict):
+        super().__init__(headers)
+        self.status = status
+
+
+class FakeHttp:
+    def __init__(self, status: int, data: bytes):
+        self.status = status
+        self.data = data
+
+    def request(self, uri, method="GET", headers=None, **kwargs):
+        return FakeResponse(self.status, {"content-length": str(len(self.data))}), self.data
+
+
+class FakeRequest:
+    """A request whose execute() returns result; media downloads read data through http."""
+
+    def __init__(self, result=None, data: bytes = b"", status: int = 200, on_execute=None):
+        self.result = result
+        self.http = FakeHttp(status, data)
+        self.uri = "https://fake.googleapis.com/media"
+        self.headers = {}
+        self.on_execute = on_execute
+
+    def execute(self, num_retries=0):
+        if self.on_execute:
+            self.on_execute()
+        return self.result
+
+
+class FakeDrive:
+    """Drive v3 service with a change log: every put or remove is one change and advances the token."""
+
+    def __init__(self):
+        self.items: dict[str, dict] = {}
+        self.contents: dict[str, bytes] = {}
+        self.failing: set[str] = set()
+        self.changes_log: list[tuple[int, str, bool]] = []
+        self.token = 1
+
+    def put(self, file_id: str, name: str, mime_type: str, content: bytes, modified_time: str) -> None:
+        self.items[file_id] = {"id": file_id, "name": name, "mimeType": mime_type,
+                               "modifiedTime": modified_time, "trashed": False}
+        self.contents[file_id] = content
+        self.changes_log.append((self.token, file_id, False))
+        self.token += 1
+
+    def remove(self, file_id: str) -> None:
+        del self.items[file_id]
+        self.changes_log.append((self.token, file_id, True))
+        self.token += 1
+
+    def files(self):
+        return FakeDriveFiles(self)
+
+    def changes(self):
+        return FakeDriveChanges(self)
+
+
+class FakeDriveFiles:
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def list(self, q=None, pageSize=100, pageToken=None, fields=None, **kwargs):
+        # Only the mimeType terms of the query are honoured
+        mime_types = set(re.findall(r"mimeType='([^']+)'", q or ""))
+        items = sorted((item for item in self.drive.items.values() if not mime_types or item["mimeType"] in mime_types),
+                       key=lambda item: item["id"])
+        start = int(pageToken or 0)
+        response = {"files": items[start:start + pageSize]}
+        if start + pageSize < len(items):
+            response["nextPageToken"] = str(start + pageSize)
+        return FakeRequest(response)
+
+    def export_media(self, fileId, mimeType):
+        return self._media(fileId)
+
+    def get_media(self, fileId):
+        return self._media(fileId)
+
+    def _media(self, file_id: str) -> FakeRequest:
+        if file_id in self.drive.failing:
+            return FakeRequest(data=b"not found", status=404)
+        return FakeRequest(data=self.drive.contents[file_id])
+
+
+class FakeDriveChanges:
+    def __init__(self, drive: FakeDrive):
+        self.drive = drive
+
+    def getStartPageToken(self):
+        return FakeRequest({"startPageToken": str(self.drive.token)})
+
+    def list(self, pageToken, pageSize=100, **kwargs):
+        token = int(pageToken)
+        changes = [change for change in self.drive.changes_log if change[0] >= token][:pageSize]
+        response = {"changes": [
+            {"fileId": file_id, "removed": removed, **({} if removed else {"file": self.drive.items[file_id]})}
+            for _, file_id, removed in changes
+        ]}
+        if changes and changes[-1][0] + 1 < self.drive.token:
+            response["nextPageToken"] = str(changes[-1][0] + 1)
+        else:
+            response["newStartPageToken"] = str(self.drive.token)
+        return FakeRequest(response)
+
+
+class FakeSheets:
+    """Sheets v4 service recording values().update ranges and grid resizes, in call order."""
+
+    def __init__(self):
+        self.calls: list[tuple] = []
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def update(self, spreadsheetId, range, valueInputOption, body):
+        return FakeRequest(on_execute=lambda: self.calls.append(("update", range, len(body["values"]))))
+
+    def batchUpdate(self, spreadsheetId, body):
+        grid = body["requests"][0]["updateSheetProperties"]["properties"]["gridProperties"]
+        return FakeRequest(on_execute=lambda: self.calls.append(("resize", grid["rowCount"], grid["columnCount"])))
+
+
+class FakeRedis:
+    """The subset of redis.asyncio.Redis that RedisCache uses, with expiry by a settable clock."""
+
+    def __init__(self):
+        self.now_ms = 0
+        self.entries: dict[str, tuple[bytes, int | None]] = {}
+
+    async def get(self, key):
+        value, expires_at = self.entries.get(key, (None, None))
+        if expires_at is not None and expires_at <= self.now_ms:
+            self.entries.pop(key)
+            return None
+        return value
+
+    async def set(self, key, value, ex=None, px=None):
+        if ex is not None and ex <= 0 or px is not None and px <= 0:
+            raise ValueError("invalid expire time in 'set' command")
+        ttl_ms = px if px is not None else ex * 1000 if ex is not None else None
+        self.entries[key] = (value.encode("utf-8"), self.now_ms + ttl_ms if ttl_ms is not None else None)
+
+    async def scan_iter(self, match="*", count=None):
+        prefix = match.rstrip("*")
+        for key in list(self.entries):
+            if key.startswith(prefix):
+                yield key
+
+    async def delete(self, *keys):
+        return sum(self.entries.pop(key, None) is not None for key in keys)
@@ -0,0 +1,155 @@
+import sys
+import types
+import asyncio
+import api.cache as cache
+from api.cache import IndexVersionTracker, LocalTTLCache, SearchCache
+from fakes import FakeRedis
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    backend = LocalTTLCache(maxsize=10, ttl_seconds=60)
+    run(backend.set("a", 1))
+
+    clock.now += 59
+    assert run(backend.get("a")) == 1
+    clock.now += 2
+    assert run(backend.get("a")) is None
+    assert len(backend) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    backend = LocalTTLCache(maxsize=2, ttl_seconds=60)
+    run(backend.set("a", 1))
+    run(backend.set("b", 2))
+    # Reading "a" makes "b" the least recently used
+    assert run(backend.get("a")) == 1
+    run(backend.set("c", 3))
+
+    assert run(backend.get("b")) is None
+    assert run(backend.get("a")) == 1
+    assert run(backend.get("c")) == 3
+    assert len(backend) == 2
+
+
+def test_embeddings_are_keyed_by_normalized_query():
+    search_cache = SearchCache(LocalTTLCache(10, 60), LocalTTLCache(10, 60), "model")
+    run(search_cache.set_embedding("Card  Fees", [0.1, 0.2]))
+
+    assert run(search_cache.get_embedding(" card fees ")) == [0.1, 0.2]
+    assert run(search_cache.get_embedding("other")) is None
+    assert search_cache.stats()["embedding"] == {"hits": 1, "misses": 1, "hitRate": 0.5}
+
+
+def test_results_are_keyed_by_index_version():
+    search_cache = SearchCache(LocalTTLCache(10, 60), LocalTTLCache(10, 60), "model")
+    vector, params = [0.1, 0.2], {"k": 5}
+    run(search_cache.set_results(vector, params, "docs", "v1", [{"id": 1}]))
+
+    assert run(search_cache.get_results(vector, params, "docs", "v1")) == [{"id": 1}]
+    assert run(search_cache.get_results(vector, params, "docs", "v2")) is None
+    assert run(search_cache.get_results(vector, {"k": 10}, "docs", "v1")) is None
+
+
+def test_version_change_invalidates_cached_results(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    search_cache = SearchCache(LocalTTLCache(10, 600), LocalTTLCache(10, 600), "model")
+    versions = ["v1"]
+    fetches = []
+
+    async def fetch_version():
+        fetches.append(clock.now)
+        return versions[-1]
+
+    tracker = IndexVersionTracker(fetch_version, search_cache, check_interval=30)
+    vector, params = [0.1, 0.2], {"k": 5}
+
+    async def scenario():
+        assert await tracker.current() == "v1"
+        await search_cache.set_results(vector, params, "docs", "v1", [{"id": 1}])
+        await search_cache.set_embedding("fees", vector)
+
+        # Within the check interval the version is not fetched again
+        versions.append("v2")
+        clock.now += 10
+        assert await tracker.current() == "v1"
+        assert len(fetches) == 1
+
+        clock.now += 30
+        assert await tracker.current() == "v2"
+        assert await search_cache.get_results(vector, params, "docs", "v1") is None
+        # Embeddings do not depend on the index and survive
+        assert await search_cache.get_embedding("fees") == vector
+
+    run(scenario())
+
+
+def test_failed_version_fetch_keeps_the_last_version(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    search_cache = SearchCache(LocalTTLCache(10, 600), LocalTTLCache(10, 600), "model")
+    responses = ["v1", RuntimeError("cluster unavailable")]
+
+    async def fetch_version():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    tracker = IndexVersionTracker(fetch_version, search_cache, check_interval=30)
+
+    async def scenario():
+        assert await tracker.current() == "v1"
+        await search_cache.set_results([0.1], {}, "docs", "v1", [{"id": 1}])
+        clock.now += 31
+        assert await tracker.current() == "v1"
+        assert await search_cache.get_results([0.1], {}, "docs", "v1") == [{"id": 1}]
+
+    run(scenario())
+
+
+def redis_caches(monkeypatch, *namespaces, ttl_seconds=60):
+    """RedisCaches sharing one fake server, as every worker does."""
+    server = FakeRedis()
+    redis_module = types.ModuleType("redis")
+    redis_module.asyncio = types.SimpleNamespace(from_url=lambda url: server)
+    monkeypatch.setitem(sys.modules, "redis", redis_module)
+    monkeypatch.setitem(sys.modules, "redis.asyncio", redis_module.asyncio)
+    return server, [cache.RedisCache("redis://fake", namespace, ttl_seconds) for namespace in namespaces]
+
+
+def test_redis_clear_only_drops_its_own_namespace(monkeypatch):
+    _, (embeddings, results) = redis_caches(monkeypatch, "search:embeddings", "search:results")
+    run(embeddings.set("key", [0.1]))
+    run(results.set("key", [{"id": 1}]))
+    run(results.set("other", [{"id": 2}]))
+
+    run(results.clear())
+
+    assert run(results.get("key")) is None
+    assert run(results.get("other")) is None
+    assert run(embeddings.get("key")) == [0.1]
+
+
+def test_redis_ttl_under_a_second_is_kept_in_milliseconds(monkeypatch):
+    server, (results,) = redis_caches(monkeypatch, "search:results", ttl_seconds=0.25)
+    run(results.set("key", [1]))
+
+    server.now_ms = 200
+    assert run(results.get("key")) == [1]
+    server.now_ms = 300
+    assert run(results.get("key")) is None
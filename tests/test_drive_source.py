@@ -0,0 +1,150 @@
+from concurrent.futures import Future
+from types import SimpleNamespace
+from ingest.drive import DriveSource
+from ingest.manifest import new_manifest
+from ingest.pipeline import FileTask, IngestPipeline
+from fakes import FakeDrive
+
+GOOGLE_DOC = "application/vnd.google-apps.document"
+
+
+def sync(drive, manifest, staging_dir, incremental=None):
+    """One sync as the indexing script runs it, recording every selected file as indexed."""
+    source = DriveSource(drive, staging_dir, export_workers=2, page_size=2)
+    counts = {"processed": 0, "skipped": 0}
+    if incremental is None:
+        incremental = bool(manifest["files"])
+    tasks = list(source.select_files(manifest, incremental, counts))
+    for file_key in source.removed_files:
+        manifest["files"].pop(file_key)
+    for task in tasks:
+        manifest["files"][task.file_key] = {"sha256": task.content_hash,
+                                            "modified_time": source.modified_times[task.file_key]}
+    source.store_start_page_token(manifest)
+    source.cleanup()
+    return source, sorted(task.file_key for task in tasks)
+
+
+def test_first_sync_lists_everything_and_stores_the_token(tmp_path):
+    drive = FakeDrive()
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha", "t1")
+    drive.put("b", "notes.md", "text/markdown", b"# notes", "t1")
+    drive.put("c", "Slides", "application/vnd.google-apps.presentation", b"unsupported", "t1")
+    manifest = new_manifest("index", "model")
+
+    source, selected = sync(drive, manifest, tmp_path / "staging")
+
+    assert selected == ["drive/a/Doc A", "drive/b/notes.md"]
+    assert manifest["drive_start_page_token"] == str(drive.token)
+    assert not (tmp_path / "staging").exists()
+
+
+def test_changes_since_the_token_are_read_incrementally(tmp_path):
+    drive = FakeDrive()
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha", "t1")
+    drive.put("b", "notes.md", "text/markdown", b"# notes", "t1")
+    drive.put("c", "Other", GOOGLE_DOC, b"other", "t1")
+    manifest = new_manifest("index", "model")
+    sync(drive, manifest, tmp_path / "staging")
+
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha changed", "t2")
+    drive.put("b", "notes.md", "text/markdown", b"# notes", "t2")
+    drive.remove("c")
+    source, selected = sync(drive, manifest, tmp_path / "staging")
+
+    assert selected == ["drive/a/Doc A"]
+    # The old version is only deleted once the new one is indexed
+    assert source.replaced_files == {"drive/a/Doc A": "drive/a/Doc A"}
+    assert source.removed_files == ["drive/c/Other"]
+    # Touched without a content change: only the recorded modifiedTime moves on
+    assert manifest["files"]["drive/b/notes.md"]["modified_time"] == "t2"
+    assert manifest["drive_start_page_token"] == str(drive.token)
+
+
+def test_token_is_held_back_after_a_failed_export(tmp_path):
+    drive = FakeDrive()
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha", "t1")
+    manifest = new_manifest("index", "model")
+    sync(drive, manifest, tmp_path / "staging")
+    token = manifest["drive_start_page_token"]
+
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha changed", "t2")
+    drive.put("b", "Doc B", GOOGLE_DOC, b"beta", "t2")
+    drive.failing.add("b")
+    source, selected = sync(drive, manifest, tmp_path / "staging")
+
+    assert selected == ["drive/a/Doc A"]
+    assert source.failed_exports == 1
+    assert manifest["drive_start_page_token"] == token
+
+    # The next sync reads the same changes again and picks up the file that failed
+    drive.failing.clear()
+    source, selected = sync(drive, manifest, tmp_path / "staging")
+    assert selected == ["drive/b/Doc B"]
+    assert manifest["drive_start_page_token"] == str(drive.token)
+
+
+def test_token_is_held_back_when_files_failed_to_index(tmp_path):
+    drive = FakeDrive()
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha", "t1")
+    manifest = new_manifest("index", "model")
+    manifest["drive_start_page_token"] = "1"
+    source = DriveSource(drive, tmp_path / "staging")
+    list(source.select_files(manifest, True, {"processed": 0, "skipped": 0}))
+    source.cleanup()
+
+    assert not source.store_start_page_token(manifest, failed=True)
+    assert manifest["drive_start_page_token"] == "1"
+    assert source.store_start_page_token(manifest)
+    assert manifest["drive_start_page_token"] == str(drive.token)
+
+
+def test_unchanged_exports_are_deleted_right_away(tmp_path):
+    drive = FakeDrive()
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha", "t1")
+    drive.put("b", "notes.md", "text/markdown", b"# notes", "t1")
+    manifest = new_manifest("index", "model")
+    sync(drive, manifest, tmp_path / "staging")
+
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha changed", "t2")
+    drive.put("b", "notes.md", "text/markdown", b"# notes", "t2")
+    source = DriveSource(drive, tmp_path / "staging")
+    tasks = list(source.select_files(manifest, True, {"processed": 0, "skipped": 0}))
+
+    # Only the export handed to the pipeline is left, and the pipeline owns it
+    assert [task.staged for task in tasks] == [True]
+    assert sorted(path.name for path in (tmp_path / "staging").iterdir()) == ["a.txt"]
+
+
+def test_pipeline_deletes_staged_files_once_extracted(tmp_path):
+    staged, kept = tmp_path / "a.txt", tmp_path / "b.txt"
+    staged.write_text("alpha")
+    kept.write_text("beta")
+    pipeline = IngestPipeline(SimpleNamespace(index_name="index"), None, workers=1, chunk_size=100, chunk_overlap=0)
+    finished = [0]
+
+    for path, is_staged in ((staged, True), (kept, False)):
+        future = Future()
+        future.set_result(None)
+        pipeline._collect((FileTask(str(path), path.name, path.name, "", "hash", staged=is_staged), future), finished)
+
+    assert finished == [2]
+    assert not staged.exists()
+    assert kept.exists()
+
+
+def test_renamed_file_replaces_its_old_key_once_indexed(tmp_path):
+    drive = FakeDrive()
+    drive.put("a", "Doc A", GOOGLE_DOC, b"alpha", "t1")
+    manifest = new_manifest("index", "model")
+    sync(drive, manifest, tmp_path / "staging")
+
+    drive.put("a", "Renamed", GOOGLE_DOC, b"alpha", "t2")
+    source = DriveSource(drive, tmp_path / "staging")
+    tasks = list(source.select_files(manifest, True, {"processed": 0, "skipped": 0}))
+
+    assert [task.file_key for task in tasks] == ["drive/a/Renamed"]
+    assert source.replaced_files == {"drive/a/Renamed": "drive/a/Doc A"}
+    # Still recorded: the old documents stay searchable until the new ones are in
+    assert "drive/a/Doc A" in manifest["files"]
+    source.cleanup()
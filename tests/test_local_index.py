@@ -0,0 +1,60 @@
+import numpy as np
+from api.local_index import LocalIndexReader, LocalIndexWriter
+
+DIMS = 4
+
+
+def chunk(chunk_id, axis, path="", file_name="a.txt"):
+    vector = np.zeros(DIMS, dtype=np.float32)
+    vector[axis] = 1.0
+    return {"_id": chunk_id, "_source": {
+        "doc_type": "chunk", "parent_id": f"doc-{file_name}", "file_name": file_name, "path": path,
+        "chunk_index": 0, "chunk_text": f"text of {chunk_id}", "chunk_vector": vector.tolist()}}
+
+
+def write(writer, *actions):
+    assert all(ok for ok, _, _ in writer.write(actions))
+    writer.commit()
+
+
+def test_reader_on_the_previous_export_resolves_rows_to_the_right_chunks(tmp_path):
+    writer = LocalIndexWriter(tmp_path, DIMS)
+    writer.open()
+    write(writer, chunk("m-chunk", 0), chunk("z-chunk", 1, path="sub"))
+    reader = LocalIndexReader(tmp_path)
+
+    # A chunk that sorts first shifts every row of the new export
+    write(writer, chunk("a-chunk", 2))
+
+    assert [hit["_id"] for hit in reader.knn([1, 0, 0, 0], k=1, num_candidates=10)] == ["m-chunk"]
+    assert [hit["_id"] for hit in reader.knn([0, 1, 0, 0], k=1, num_candidates=10, path="sub")] == ["z-chunk"]
+
+    reader.reload()
+    assert [hit["_id"] for hit in reader.knn([0, 0, 1, 0], k=1, num_candidates=10)] == ["a-chunk"]
+    assert [hit["_id"] for hit in reader.knn([0, 1, 0, 0], k=3, num_candidates=10, path="sub")] == ["z-chunk"]
+    writer.close()
+
+
+def test_chunks_deleted_after_the_export_are_dropped_from_hits(tmp_path):
+    writer = LocalIndexWriter(tmp_path, DIMS)
+    writer.open()
+    write(writer, chunk("m-chunk", 0), chunk("z-chunk", 1, file_name="b.txt"))
+    reader = LocalIndexReader(tmp_path)
+
+    writer.delete_file("a.txt", "")
+
+    assert [hit["_id"] for hit in reader.knn([1, 0, 0, 0], k=2, num_candidates=10)] == ["z-chunk"]
+    writer.close()
+
+
+def test_delete_file_spares_the_replacing_version(tmp_path):
+    writer = LocalIndexWriter(tmp_path, DIMS)
+    writer.open()
+    write(writer, chunk("old-chunk", 0), chunk("new-chunk", 1))
+
+    assert writer.delete_file("a.txt", "", keep=["new-chunk"]) == 1
+    writer.commit()
+
+    reader = LocalIndexReader(tmp_path)
+    assert [hit["_id"] for hit in reader.knn([1, 1, 0, 0], k=2, num_candidates=10)] == ["new-chunk"]
+    writer.close()
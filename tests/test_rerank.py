@@ -0,0 +1,27 @@
+import asyncio
+from api.cache import LocalTTLCache
+from api.rerank import RerankScoreCache
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_scores_are_keyed_on_the_exact_query_text():
+    scores = RerankScoreCache(LocalTTLCache(10, 60), "model")
+    run(scores.set("Card Fees", {"d1": 0.9}))
+
+    assert run(scores.get("Card Fees", ["d1"])) == {"d1": 0.9}
+    assert run(scores.get("card  fees", ["d1"])) == {}
+    assert scores.stats() == {"hits": 1, "misses": 1, "hitRate": 0.5}
+
+
+def test_entry_keeps_the_most_recently_scored_pairs():
+    backend = LocalTTLCache(10, 60)
+    scores = RerankScoreCache(backend, "model", max_pairs=3)
+    run(scores.set("fees", {"d1": 0.1, "d2": 0.2}))
+    run(scores.set("fees", {"d3": 0.3, "d1": 0.4}))
+    run(scores.set("fees", {"d4": 0.5}))
+
+    assert run(scores.get("fees", ["d1", "d2", "d3", "d4"])) == {"d3": 0.3, "d1": 0.4, "d4": 0.5}
+    assert len(run(backend.get(scores._key("fees")))) == 3
@@ -0,0 +1,72 @@
+import io
+import json
+from api.sheets_export import ExportJob, SheetWriter, run_export
+from fakes import FakeSheets
+
+
+def spreadsheet(rows=1000, columns=26):
+    return {"spreadsheetId": "sheet", "spreadsheetUrl": "https://sheets/sheet",
+            "sheets": [{"properties": {"gridProperties": {"rowCount": rows, "columnCount": columns}}}]}
+
+
+def test_batches_are_written_at_explicit_ranges():
+    sheets = FakeSheets()
+    writer = SheetWriter(sheets, spreadsheet())
+
+    writer.write([["a", 1], ["b", 2]])
+    writer.write([["c", 3]])
+    writer.write([])
+    writer.write([["d", 4], ["e", 5]])
+
+    assert sheets.calls == [("update", "'Sheet1'!A1", 2), ("update", "'Sheet1'!A3", 1), ("update", "'Sheet1'!A4", 2)]
+    assert writer.rows_written == 5
+
+
+def test_grid_grows_ahead_of_the_rows_and_is_trimmed_at_the_end():
+    sheets = FakeSheets()
+    writer = SheetWriter(sheets, spreadsheet(rows=4, columns=2))
+
+    writer.write([["a", 1]] * 3)
+    # Past the grid: doubled rather than grown to fit, to keep resizes rare
+    writer.write([["b", 2]] * 2)
+    # A wider row grows the columns only
+    writer.write([["c", 3, "wide"]])
+    # A batch larger than double the grid grows it to fit
+    writer.write([["d", 4]] * 20)
+    writer.finish()
+
+    assert sheets.calls == [
+        ("update", "'Sheet1'!A1", 3),
+        ("resize", 8, 2),
+        ("update", "'Sheet1'!A4", 2),
+        ("resize", 8, 3),
+        ("update", "'Sheet1'!A6", 1),
+        ("resize", 26, 3),
+        ("update", "'Sheet1'!A7", 20),
+    ]
+    assert (writer.row_count, writer.column_count) == (26, 3)
+
+
+def test_finish_trims_unused_rows():
+    sheets = FakeSheets()
+    writer = SheetWriter(sheets, spreadsheet(rows=1000, columns=26))
+    writer.write([["a"]] * 3)
+    writer.finish()
+
+    assert sheets.calls[-1] == ("resize", 3, 26)
+
+
+def test_run_export_streams_the_body_in_batches(monkeypatch):
+    monkeypatch.setattr(SheetWriter.__init__, "__defaults__", (2,))
+    sheets = FakeSheets()
+    job = ExportJob("export", "owner", "sheet", "https://sheets/sheet")
+    rows = [[f"row {i}", i] for i in range(5)]
+    body = io.BytesIO(json.dumps({"title": "Results", "tableData": rows}).encode("utf-8"))
+
+    run_export(sheets, job, spreadsheet(rows=1000), body)
+
+    assert job.status == "done"
+    assert (job.rows_written, job.batches) == (5, 3)
+    assert [call[1] for call in sheets.calls if call[0] == "update"] == ["'Sheet1'!A1", "'Sheet1'!A3", "'Sheet1'!A5"]
+    assert sheets.calls[-1] == ("resize", 5, 26)
+    assert body.closed
@@ -125,4 +125,6 @@ export interface ElasticResult {
   source: Source;
   contentSnippet: string;
   score: number;
+  // Cross-encoder score, present when the search was re-ranked
+  rerankScore?: number;
 }